@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+
+Checkpoints for resuming an interrupted run over a large extract.
+
+The driver processes the rows of the input file in chunks. After each chunk
+the results for its rows are written to a new part file in the checkpoint
+directory. Each part file uses the manifest format (see manifest.py) and is
+written to a temporary file that is renamed into place when complete, so a
+crash leaves either a complete part file or none at all.
+
+A meta file records the input file path, size, and modification time, and the
+versions of the modules and the run settings that affect the results. On
+resume the part files are only loaded if all of these still match. Rows found
+in the checkpoint are carried forward like unchanged rows in the manifest, so a
+resumed run produces the same results as an uninterrupted one.
+
+The checkpoint directory is removed after a run completes.
+
+"""
+
+import os
+import json
+
+from . import manifest
+
+_META_FILE = 'checkpoint.json'
+_PART_PREFIX = 'part_'
+_PART_EXT = '.jsonl'
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 2
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def _input_signature(input_file, versions):
+    """
+    Return a dict identifying the input file and the code that processes it.
+    """
+
+    stat = os.stat(input_file)
+    return {
+        'input_file' : os.path.abspath(input_file),
+        'size'       : stat.st_size,
+        'mtime_ns'   : stat.st_mtime_ns,
+        'versions'   : versions,
+    }
+
+
+###############################################################################
+class Checkpoint(object):
+    """
+    The checkpoint directory for a single run over an input file.
+    """
+
+    def __init__(self, checkpoint_dir, input_file, versions):
+        self.checkpoint_dir = checkpoint_dir
+        self.versions = versions
+        self.signature = _input_signature(input_file, versions)
+        self.meta_file = os.path.join(checkpoint_dir, _META_FILE)
+        self.part_count = 0
+
+    def _part_files(self):
+        """
+        Return the sorted list of complete part files in the directory.
+        """
+
+        if not os.path.isdir(self.checkpoint_dir):
+            return []
+
+        part_files = []
+        for f in sorted(os.listdir(self.checkpoint_dir)):
+            if f.startswith(_PART_PREFIX) and f.endswith(_PART_EXT):
+                part_files.append(os.path.join(self.checkpoint_dir, f))
+
+        return part_files
+
+    def load(self):
+        """
+        Load all part files written for the same input file and versions.
+        Returns a dict mapping patient id to a manifest.ManifestEntry, which
+        is empty if there is no usable checkpoint.
+        """
+
+        entries = {}
+        if not os.path.isfile(self.meta_file):
+            return entries
+
+        with open(self.meta_file, 'rt', encoding='utf-8') as infile:
+            meta = json.load(infile)
+        if meta != self.signature:
+            print('Checkpoint in "{0}" does not match the input file, ' \
+                  'module versions, or settings, all rows will be ' \
+                  'processed.'.
+                  format(self.checkpoint_dir))
+            return entries
+
+        part_files = self._part_files()
+        for part_file in part_files:
+            entries.update(manifest.load(part_file, self.versions))
+        self.part_count = len(part_files)
+
+        if _TRACE:
+            print('Loaded {0} entries from {1} checkpoint files'.
+                  format(len(entries), len(part_files)))
+
+        return entries
+
+    def start(self, resume=False):
+        """
+        Prepare the directory for writing. Unless resuming, any existing
+        part files are deleted.
+        """
+
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        if not resume:
+            self.remove()
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            self.part_count = 0
+
+        tmp_file = self.meta_file + '.tmp'
+        with open(tmp_file, 'wt', encoding='utf-8') as outfile:
+            json.dump(self.signature, outfile)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp_file, self.meta_file)
+
+    def writer(self):
+        """
+        Return a manifest.ManifestWriter for the next part file. The part
+        file becomes part of the checkpoint when the writer is closed.
+        """
+
+        part_file = os.path.join(self.checkpoint_dir, '{0}{1:06d}{2}'.
+                                 format(_PART_PREFIX, self.part_count, _PART_EXT))
+        self.part_count += 1
+        return manifest.ManifestWriter(part_file, self.versions)
+
+    def remove(self):
+        """
+        Delete the checkpoint files, and the directory if it is then empty.
+        """
+
+        if not os.path.isdir(self.checkpoint_dir):
+            return
+
+        for f in os.listdir(self.checkpoint_dir):
+            if f.startswith(_PART_PREFIX) or f.startswith(_META_FILE):
+                os.remove(os.path.join(self.checkpoint_dir, f))
+
+        if 0 == len(os.listdir(self.checkpoint_dir)):
+            os.rmdir(self.checkpoint_dir)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+
+Transparent reading and writing of compressed files.
+
+The SET-NET extracts are shipped compressed, and are several times larger
+when uncompressed. The functions in this module open a file for streaming,
+decompressing or compressing it on the fly, so that a compressed extract
+can be processed without first writing the uncompressed file to disk:
+
+    gzip    .gz     Python standard library
+    xz      .xz     Python standard library
+    zstd    .zst    requires the 'zstandard' package; files are compressed
+                    with ZSTD_THREADS worker threads
+
+A file being read is identified by its leading magic bytes, so a compressed
+file is read correctly whatever its name. A file being written is compressed
+according to its extension; any other extension gives a plain file.
+
+A compressed file can only be read from the start, so it cannot be split
+into byte-range shards for parallel reading (see shards.py).
+
+"""
+
+import io
+import os
+import gzip
+import lzma
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# compression formats
+GZIP = 'gzip'
+XZ   = 'xz'
+ZSTD = 'zstd'
+
+# file name extension for each format
+EXTENSIONS = {
+    GZIP : '.gz',
+    XZ   : '.xz',
+    ZSTD : '.zst',
+}
+
+# leading bytes of a file in each format
+_MAGIC = [
+    (b'\x1f\x8b',                  GZIP),
+    (b'\xfd\x37\x7a\x58\x5a\x00',  XZ),
+    (b'\x28\xb5\x2f\xfd',          ZSTD),
+]
+_MAGIC_LEN = max([len(magic) for magic, fmt in _MAGIC])
+
+# compression settings for the output files
+GZIP_LEVEL = 6
+XZ_PRESET  = 6
+ZSTD_LEVEL = 3
+
+# worker threads for zstd compression, -1 for one per logical CPU
+ZSTD_THREADS = -1
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 1
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def format_from_name(filename):
+    """
+    Return the compression format for a file name from its extension, or
+    None for a plain file.
+    """
+
+    ext = os.path.splitext(filename)[1].lower()
+    for fmt, fmt_ext in EXTENSIONS.items():
+        if ext == fmt_ext:
+            return fmt
+
+    return None
+
+
+###############################################################################
+def detect(filename):
+    """
+    Return the compression format of an existing file from its magic bytes,
+    or None if it is not compressed.
+    """
+
+    with open(filename, 'rb') as infile:
+        head = infile.read(_MAGIC_LEN)
+
+    for magic, fmt in _MAGIC:
+        if head.startswith(magic):
+            return fmt
+
+    return None
+
+
+###############################################################################
+def _require_zstandard(filename):
+
+    if zstandard is None:
+        raise RuntimeError('the "zstandard" package is required for "{0}"'.
+                           format(filename))
+
+
+###############################################################################
+def open_binary(filename, mode='rb'):
+    """
+    Open a file in binary mode 'rb' or 'wb', decompressing it when read and
+    compressing it when written. Returns a buffered binary file object.
+    """
+
+    if 'rb' == mode:
+        fmt = detect(filename)
+    elif 'wb' == mode:
+        fmt = format_from_name(filename)
+    else:
+        raise ValueError('unsupported mode "{0}"'.format(mode))
+
+    if _TRACE:
+        print('\topening "{0}" as {1}'.format(filename, fmt))
+
+    if fmt is None:
+        return open(filename, mode)
+    elif GZIP == fmt:
+        if 'rb' == mode:
+            return gzip.open(filename, mode)
+        return gzip.open(filename, mode, compresslevel=GZIP_LEVEL)
+    elif XZ == fmt:
+        if 'rb' == mode:
+            return lzma.open(filename, mode)
+        return lzma.open(filename, mode, preset=XZ_PRESET)
+
+    _require_zstandard(filename)
+    raw = open(filename, mode)
+    if 'rb' == mode:
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.BufferedReader(reader)
+
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL,
+                                          threads=ZSTD_THREADS)
+    writer = compressor.stream_writer(raw, closefd=True,
+                                      write_return_read=True)
+    return io.BufferedWriter(writer)
+
+
+###############################################################################
+def open_text(filename, mode='rt', encoding=None, newline=None):
+    """
+    Open a file in text mode 'rt' or 'wt', with the same arguments as the
+    builtin 'open', decompressing it when read and compressing it when
+    written.
+    """
+
+    if 'rt' == mode or 'r' == mode:
+        binary_mode = 'rb'
+    elif 'wt' == mode or 'w' == mode:
+        binary_mode = 'wb'
+    else:
+        raise ValueError('unsupported mode "{0}"'.format(mode))
+
+    return io.TextIOWrapper(open_binary(filename, binary_mode),
+                            encoding=encoding, newline=newline)
@@ -0,0 +1,669 @@
+#!/usr/bin/env python3
+"""
+
+Seeded generator of large synthetic SET-NET extracts for load testing.
+
+The synthetic extract that ships with the notebook has 200 rows, far too few
+to exercise the sharding, caching, and parallel parts of the driver. This
+module writes a CSV file of any number of rows with the column schema of a
+template extract (by default that synthetic file):
+
+    - The radio-button columns are copied from a random template row, so
+      that the values within a row stay consistent (a row with mv_sx=88
+      tends to have 88 in the symptom columns too). Each value is then
+      replaced, with probability 'radio_noise', by a value drawn from the
+      values of its column in the template. The values 1, 0, 88, and '.'
+      therefore keep the template distribution.
+
+    - The date columns are generated around a random day in the date range
+      of the template. Each column keeps its template rate of missing
+      values and its template offsets from the reference date column.
+
+    - The text columns keep their template rate of empty values, and of
+      placeholder values without letters, such as 88. Any other text
+      repeats a recent text of its column with probability
+      'duplicate_rate'. Otherwise a new text is made: the notes are
+      'note_sentences' sentences on average, drawn from the template notes
+      and, with probability 'o2_rate', from o2sat_finder.SENTENCES. The
+      numbers in each sentence are varied slightly. The shorter text
+      columns recombine the template values of the column. For the columns
+      with few template values, the actual duplicate rate is higher.
+
+    - The id columns (columns of distinct integers in the template) are
+      numbered from 1.
+
+A fraction 'pathological_rate' of the rows get one of the PATHOLOGICAL_KINDS
+of bad input:
+
+    long          a note of about 'long_note_chars' characters
+    multiline     a note with line breaks and double quotes
+    unicode       a note with non-ASCII and zero-width characters
+    punctuation   a note with long runs of punctuation and digits
+    bad_values    unexpected radio-button values and unparseable dates
+    short_row     a row with missing trailing fields
+
+The output depends only on the template file, the seed, and the options, so
+that benchmark runs on the same corpus can be compared. The output file is
+compressed if its name ends with a compression extension (see
+compression.py).
+
+Usage:
+
+        python3 -m src.corpus -o load_1m.csv.gz --rows 1000000 --seed 1
+
+"""
+
+import os
+import re
+import sys
+import csv
+import random
+import argparse
+import datetime
+from collections import namedtuple
+
+from . import fields
+from . import metrics
+from . import compression
+from . import o2sat_finder as o2f
+
+# the template extract, and the default size and seed of a corpus
+DEFAULT_TEMPLATE  = 'synthetic_data_20220328.csv'
+DEFAULT_ROW_COUNT = 100000
+DEFAULT_SEED      = 0
+
+CORPUS_OPTIONS_FIELDS = [
+    'duplicate_rate',       # probability that a text repeats an earlier one
+    'note_sentences',       # mean number of sentences in a new note
+    'o2_rate',              # probability that a note sentence is an O2 sentence
+    'radio_noise',          # probability that a radio value is redrawn
+    'pathological_rate',    # fraction of rows with a pathological input
+    'long_note_chars',      # length of the pathological long notes
+]
+CorpusOptions = namedtuple('CorpusOptions', CORPUS_OPTIONS_FIELDS)
+
+# the long notes exceed the max_chars of text_budget.DEFAULT_BUDGET
+DEFAULT_OPTIONS = CorpusOptions(
+    duplicate_rate    = 0.5,
+    note_sentences    = 2.0,
+    o2_rate           = 0.3,
+    radio_noise       = 0.05,
+    pathological_rate = 0.001,
+    long_note_chars   = 50000,
+)
+
+# kinds of pathological input
+PATHOLOGICAL_LONG        = 'long'
+PATHOLOGICAL_MULTILINE   = 'multiline'
+PATHOLOGICAL_UNICODE     = 'unicode'
+PATHOLOGICAL_PUNCTUATION = 'punctuation'
+PATHOLOGICAL_BAD_VALUES  = 'bad_values'
+PATHOLOGICAL_SHORT_ROW   = 'short_row'
+
+PATHOLOGICAL_KINDS = [
+    PATHOLOGICAL_LONG, PATHOLOGICAL_MULTILINE, PATHOLOGICAL_UNICODE,
+    PATHOLOGICAL_PUNCTUATION, PATHOLOGICAL_BAD_VALUES, PATHOLOGICAL_SHORT_ROW,
+]
+
+# free-text note columns; the other text columns hold short phrases
+NOTE_COLS = ['mg_notes']
+
+# the values of a radio-button column
+RADIO_VALUES = ['1', '0', '88', '.', '']
+
+# number of recent texts of each column that can be repeated
+DUPLICATE_POOL_SIZE = 1000
+
+# max number of sentences in a note
+MAX_NOTE_SENTENCES = 50
+
+# length of the runs in the punctuation notes
+PUNCTUATION_RUN_CHARS = 2000
+
+# snippets for the unicode notes
+UNICODE_SNIPPETS = [
+    'SpO2 91 % – 2 L NC',
+    'T 38.6 °C',
+    'naïve',
+    '40 µg',
+    'sat ≥ 94%',
+    'pt on RA',
+    'café',
+    'o2\u200bsat 89%',
+    '“short of breath”',
+]
+
+# unexpected values for the bad_values rows
+BAD_RADIO_VALUES = ['yes', 'no', '2', '-1', 'NA', '1.0', ' 1', 'unk']
+BAD_DATE_VALUES  = ['31-Feb-20', '2020-13-01', 'unknown', '00-Jan-00', '1/1']
+
+# dates are written in the format of the template, such as '6-Dec-20'
+_MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+           'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+_regex_number = re.compile(r'\d+')
+_regex_letter = re.compile(r'[a-z]', re.IGNORECASE)
+
+# roles of the template columns
+_ROLE_ID    = 'id'
+_ROLE_RADIO = 'radio'
+_ROLE_DATE  = 'date'
+_ROLE_TEXT  = 'text'
+
+# the rows are generated in batches of this size between progress updates
+_PROGRESS_ROWS = 10000
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 1
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def _format_date(day):
+    """
+    Convert a day number from fields.DateColumn to a string like '6-Dec-20'.
+    """
+
+    d = datetime.date.fromordinal(day + _EPOCH_ORDINAL)
+    return '{0}-{1}-{2:02d}'.format(d.day, _MONTHS[d.month - 1], d.year % 100)
+
+
+###############################################################################
+def _unique(values):
+    """
+    Return the distinct values in order of first occurrence.
+    """
+
+    return list(dict.fromkeys(values))
+
+
+###############################################################################
+def _column_role(values):
+    """
+    Return the role of a template column from its list of values.
+    """
+
+    stripped = [v.strip() for v in values]
+    if all([v.isdigit() for v in stripped]) and \
+       len(set(stripped)) == len(stripped):
+        return _ROLE_ID
+
+    if all([v in RADIO_VALUES for v in stripped]) and \
+       any([v in ['1', '0', '88'] for v in stripped]):
+        return _ROLE_RADIO
+
+    present = [v for v in stripped if v not in ['', '.']]
+    if len(present) > 0:
+        days = fields.DateColumn('template').parse(present)
+        if all([fields.NO_DATE != day for day in days]):
+            return _ROLE_DATE
+
+    return _ROLE_TEXT
+
+
+###############################################################################
+class TextColumn(object):
+    """
+    Template values of a text column, and the texts generated for it.
+    """
+
+    def __init__(self, col_name, values):
+        self.col_name = col_name
+        self.is_note = col_name.lower() in NOTE_COLS
+
+        present = [v for v in values if len(v.strip()) > 0]
+        self.present_rate = len(present) / max(1, len(values))
+
+        # values without letters, such as '88', are copied unchanged
+        self.placeholders = [v for v in present if not _regex_letter.search(v)]
+        self.placeholder_rate = len(self.placeholders) / max(1, len(present))
+        self.phrases = _unique([v.strip() for v in present
+                                if _regex_letter.search(v)])
+
+        # the recent texts that can be repeated
+        self.pool = []
+
+
+###############################################################################
+class CorpusStats(object):
+    """
+    Counts of the generated rows and texts.
+    """
+
+    def __init__(self):
+        self.row_count = 0
+        self.text_count = 0
+        self.duplicate_count = 0
+        self.pathological_counts = {kind:0 for kind in PATHOLOGICAL_KINDS}
+
+
+###############################################################################
+class CorpusGenerator(object):
+    """
+    Generates the rows of a synthetic corpus from a template extract.
+    """
+
+    def __init__(self, template_file=DEFAULT_TEMPLATE, seed=DEFAULT_SEED,
+                 options=DEFAULT_OPTIONS):
+        self.seed = seed
+        self.options = options
+        self.rng = random.Random(seed)
+        self.stats = CorpusStats()
+
+        with compression.open_text(template_file, newline='') as infile:
+            reader = csv.reader(infile)
+            self.header = next(reader)
+            col_count = len(self.header)
+            self.template_rows = [row for row in reader if len(row) == col_count]
+
+        if 0 == len(self.template_rows):
+            raise ValueError('no complete rows in template file "{0}"'.
+                             format(template_file))
+
+        columns = [[row[j] for row in self.template_rows]
+                   for j in range(col_count)]
+        self.roles = [_column_role(values) for values in columns]
+
+        self.radio_indices = [j for j, role in enumerate(self.roles)
+                              if _ROLE_RADIO == role]
+        self.radio_values = {j:columns[j] for j in self.radio_indices}
+        self.text_columns = {j:TextColumn(self.header[j], columns[j])
+                             for j, role in enumerate(self.roles)
+                             if _ROLE_TEXT == role}
+        self._init_dates(columns)
+
+        # the sentences for the notes
+        self.note_phrases = []
+        for text_col in self.text_columns.values():
+            if text_col.is_note:
+                self.note_phrases.extend(text_col.phrases)
+        self.note_phrases = _unique(self.note_phrases)
+        self.o2_sentences = [s.strip() for s in o2f.SENTENCES]
+
+        if _TRACE:
+            for name, role in zip(self.header, self.roles):
+                print('\t{0:<20} {1}'.format(name, role))
+
+    def _init_dates(self, columns):
+        """
+        Find the missing rates of the date columns, and the offsets of each
+        from the reference column, which has the fewest missing dates.
+        """
+
+        self.date_indices = [j for j, role in enumerate(self.roles)
+                             if _ROLE_DATE == role]
+        self.date_missing = {}
+        self.date_offsets = {}
+        if 0 == len(self.date_indices):
+            return
+
+        days = {}
+        for j in self.date_indices:
+            days[j] = fields.DateColumn(self.header[j]).parse(columns[j])
+            missing = [fields.NO_DATE == day for day in days[j]]
+            self.date_missing[j] = sum(missing) / len(missing)
+
+        self.ref_index = min(self.date_indices,
+                             key=lambda j: self.date_missing[j])
+        ref_days = [int(day) for day in days[self.ref_index]
+                    if fields.NO_DATE != day]
+        self.min_day = min(ref_days)
+        self.max_day = max(ref_days)
+
+        for j in self.date_indices:
+            offsets = [int(day) - int(ref_day)
+                       for day, ref_day in zip(days[j], days[self.ref_index])
+                       if fields.NO_DATE != day and fields.NO_DATE != ref_day]
+            if 0 == len(offsets):
+                offsets = [0]
+            self.date_offsets[j] = offsets
+
+    def _jitter(self, text):
+        """
+        Vary the numbers in a text slightly, keeping numbers up to 100 (such
+        as O2 saturations) at most 100.
+        """
+
+        rng = self.rng
+
+        def replace(match):
+            n = int(match.group(0))
+            if n < 10 or len(match.group(0)) > 4:
+                return match.group(0)
+            m = max(0, n + rng.randint(-2, 2))
+            if n <= 100:
+                m = min(m, 100)
+            return str(m)
+
+        return _regex_number.sub(replace, text)
+
+    def _note_sentence(self):
+        rng = self.rng
+        if 0 == len(self.note_phrases) or rng.random() < self.options.o2_rate:
+            return rng.choice(self.o2_sentences)
+        return rng.choice(self.note_phrases)
+
+    def _new_note(self, sentence_count=None):
+        rng = self.rng
+        if sentence_count is None:
+            sentence_count = 1
+            p_more = 1.0 - 1.0 / max(1.0, self.options.note_sentences)
+            while sentence_count < MAX_NOTE_SENTENCES and rng.random() < p_more:
+                sentence_count += 1
+
+        sentences = [self._jitter(self._note_sentence()).rstrip('. ')
+                     for i in range(sentence_count)]
+        return '. '.join(sentences)
+
+    def _new_phrase(self, text_col):
+        rng = self.rng
+        phrase_count = 1
+        if rng.random() < 0.25:
+            phrase_count = 2
+
+        phrases = []
+        for i in range(phrase_count):
+            phrase = rng.choice(text_col.phrases)
+            case = rng.randrange(4)
+            if 1 == case:
+                phrase = phrase.lower()
+            elif 2 == case:
+                phrase = phrase.upper()
+            elif 3 == case:
+                phrase = phrase.capitalize()
+            phrases.append(phrase)
+        return '; '.join(phrases)
+
+    def _text(self, text_col):
+        """
+        Return a text for a text column, which is often empty.
+        """
+
+        rng = self.rng
+        if rng.random() >= text_col.present_rate:
+            return ''
+
+        self.stats.text_count += 1
+        if len(text_col.placeholders) > 0 and rng.random() < text_col.placeholder_rate:
+            return rng.choice(text_col.placeholders)
+
+        if len(text_col.pool) > 0 and rng.random() < self.options.duplicate_rate:
+            self.stats.duplicate_count += 1
+            return rng.choice(text_col.pool)
+
+        if text_col.is_note or 0 == len(text_col.phrases):
+            text = self._new_note()
+        else:
+            text = self._new_phrase(text_col)
+
+        if len(text_col.pool) < DUPLICATE_POOL_SIZE:
+            text_col.pool.append(text)
+        else:
+            text_col.pool[rng.randrange(DUPLICATE_POOL_SIZE)] = text
+
+        return text
+
+    def _pathological_note(self, kind):
+        rng = self.rng
+        if PATHOLOGICAL_LONG == kind:
+            sentences = []
+            length = 0
+            while length < self.options.long_note_chars:
+                sentence = self._new_note(1)
+                sentences.append(sentence)
+                length += len(sentence) + 2
+            return '. '.join(sentences)
+
+        elif PATHOLOGICAL_MULTILINE == kind:
+            lines = [self._new_note(1) for i in range(rng.randint(2, 6))]
+            lines.insert(rng.randrange(len(lines)), 'pt states "I can\'t breathe"')
+            return '\n'.join(lines)
+
+        elif PATHOLOGICAL_UNICODE == kind:
+            parts = [self._new_note(1)]
+            parts.extend(rng.sample(UNICODE_SNIPPETS, 3))
+            return ', '.join(parts)
+
+        # PATHOLOGICAL_PUNCTUATION
+        run = rng.choice(['%', '.', '/', '88/', '9', 'o2 ', '-'])
+        run_chars = run * (PUNCTUATION_RUN_CHARS // len(run))
+        return '{0} {1} {2}'.format(self._new_note(1), run_chars,
+                                    self._new_note(1))
+
+    def make_row(self, index):
+        """
+        Return the list of field values for the row with the given index,
+        and the kind of pathological input in the row, or None.
+        """
+
+        rng = self.rng
+        options = self.options
+
+        kind = None
+        if rng.random() < options.pathological_rate:
+            kind = rng.choice(PATHOLOGICAL_KINDS)
+
+        template_row = self.template_rows[rng.randrange(len(self.template_rows))]
+        row = [''] * len(self.header)
+
+        if len(self.date_indices) > 0:
+            ref_day = rng.randint(self.min_day, self.max_day)
+
+        for j, role in enumerate(self.roles):
+            if _ROLE_ID == role:
+                row[j] = str(index + 1)
+            elif _ROLE_RADIO == role:
+                value = template_row[j]
+                if rng.random() < options.radio_noise:
+                    value = rng.choice(self.radio_values[j])
+                row[j] = value
+            elif _ROLE_DATE == role:
+                if rng.random() < self.date_missing[j]:
+                    row[j] = '.'
+                else:
+                    row[j] = _format_date(ref_day +
+                                          rng.choice(self.date_offsets[j]))
+            else:
+                row[j] = self._text(self.text_columns[j])
+
+        if kind is not None:
+            self.stats.pathological_counts[kind] += 1
+            self._add_pathology(row, kind)
+
+        self.stats.row_count += 1
+        return row, kind
+
+    def _add_pathology(self, row, kind):
+        rng = self.rng
+        if PATHOLOGICAL_BAD_VALUES == kind:
+            if len(self.radio_indices) > 0:
+                for j in rng.sample(self.radio_indices,
+                                    min(3, len(self.radio_indices))):
+                    row[j] = rng.choice(BAD_RADIO_VALUES)
+            if len(self.date_indices) > 0:
+                row[rng.choice(self.date_indices)] = rng.choice(BAD_DATE_VALUES)
+        elif PATHOLOGICAL_SHORT_ROW == kind:
+            del row[len(row) - rng.randint(1, min(5, len(row) - 1)):]
+        else:
+            note_indices = [j for j, text_col in self.text_columns.items()
+                            if text_col.is_note]
+            if 0 == len(note_indices):
+                note_indices = list(self.text_columns.keys())
+            if len(note_indices) > 0:
+                row[rng.choice(note_indices)] = self._pathological_note(kind)
+
+    def rows(self, row_count):
+        """
+        Generator yielding the field lists of 'row_count' rows.
+        """
+
+        for i in range(row_count):
+            yield self.make_row(i)[0]
+
+
+###############################################################################
+def generate(output_file, row_count=DEFAULT_ROW_COUNT, seed=DEFAULT_SEED,
+             template_file=DEFAULT_TEMPLATE, options=DEFAULT_OPTIONS,
+             progress_interval=metrics.PROGRESS_INTERVAL_S):
+    """
+    Write a synthetic corpus of 'row_count' rows to 'output_file', and return
+    its CorpusStats. A progress line is printed every 'progress_interval'
+    seconds, or never if None.
+    """
+
+    generator = CorpusGenerator(template_file, seed, options)
+    progress = metrics.Progress(row_count, progress_interval)
+
+    with compression.open_text(output_file, 'wt', encoding='utf-8',
+                               newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(generator.header)
+        for i, row in enumerate(generator.rows(row_count)):
+            writer.writerow(row)
+            if 0 == (i + 1) % _PROGRESS_ROWS:
+                progress.update(i + 1)
+
+    print('Wrote corpus file "{0}"'.format(output_file))
+    return generator.stats
+
+
+###############################################################################
+def report(stats, seed=None):
+    """
+    Return a printable summary of a CorpusStats object.
+    """
+
+    dup_pct = 0.0
+    if stats.text_count > 0:
+        dup_pct = 100.0 * stats.duplicate_count / stats.text_count
+
+    lines = ['Corpus summary: ']
+    if seed is not None:
+        lines.append('\tSeed         : {0:>9}'.format(seed))
+    lines.append('\tRows         : {0:>9}'.format(stats.row_count))
+    lines.append('\tTexts        : {0:>9}'.format(stats.text_count))
+    lines.append('\tRepeated     : {0:>9} ({1:.1f}%)'.
+                 format(stats.duplicate_count, dup_pct))
+    lines.append('\tPathological : {0:>9}'.
+                 format(sum(stats.pathological_counts.values())))
+    for kind in PATHOLOGICAL_KINDS:
+        lines.append('\t  {0:<11}: {1:>9}'.
+                     format(kind, stats.pathological_counts[kind]))
+
+    return '\n'.join(lines)
+
+
+###############################################################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='generate a large synthetic SET-NET CSV file')
+
+    parser.add_argument('-v', '--version',
+                        action='store_true',
+                        help='print version to stdout and then exit')
+    parser.add_argument('-o', '--output',
+                        help='output CSV file; add .gz, .xz, or .zst to compress')
+    parser.add_argument('-t', '--template',
+                        default=DEFAULT_TEMPLATE,
+                        help='template CSV file, default "{0}"'.
+                        format(DEFAULT_TEMPLATE))
+    parser.add_argument('--rows',
+                        type=int,
+                        default=DEFAULT_ROW_COUNT,
+                        help='number of rows, default {0}'.
+                        format(DEFAULT_ROW_COUNT))
+    parser.add_argument('--seed',
+                        type=int,
+                        default=DEFAULT_SEED,
+                        help='random seed, default {0}'.format(DEFAULT_SEED))
+    parser.add_argument('--duplicate-rate',
+                        type=float,
+                        default=DEFAULT_OPTIONS.duplicate_rate,
+                        help='probability that a text repeats an earlier ' \
+                        'one, default {0}'.format(DEFAULT_OPTIONS.duplicate_rate))
+    parser.add_argument('--note-sentences',
+                        type=float,
+                        default=DEFAULT_OPTIONS.note_sentences,
+                        help='mean number of sentences in a note, default {0}'.
+                        format(DEFAULT_OPTIONS.note_sentences))
+    parser.add_argument('--o2-rate',
+                        type=float,
+                        default=DEFAULT_OPTIONS.o2_rate,
+                        help='probability that a note sentence is an O2 ' \
+                        'sentence, default {0}'.format(DEFAULT_OPTIONS.o2_rate))
+    parser.add_argument('--radio-noise',
+                        type=float,
+                        default=DEFAULT_OPTIONS.radio_noise,
+                        help='probability that a radio-button value is ' \
+                        'redrawn, default {0}'.format(DEFAULT_OPTIONS.radio_noise))
+    parser.add_argument('--pathological-rate',
+                        type=float,
+                        default=DEFAULT_OPTIONS.pathological_rate,
+                        help='fraction of rows with pathological input, ' \
+                        'default {0}'.format(DEFAULT_OPTIONS.pathological_rate))
+    parser.add_argument('--long-note-chars',
+                        type=int,
+                        default=DEFAULT_OPTIONS.long_note_chars,
+                        help='length of the pathological long notes, ' \
+                        'default {0}'.format(DEFAULT_OPTIONS.long_note_chars))
+    parser.add_argument('-d', '--debug',
+                        action='store_true',
+                        help='print debug information to stdout')
+
+    args = parser.parse_args()
+
+    if args.version:
+        print(get_version())
+        sys.exit(0)
+
+    if args.output is None:
+        print('\n*** Missing --output argument ***')
+        sys.exit(-1)
+
+    if args.template is None or not os.path.isfile(args.template):
+        print('\n*** Missing or invalid --template argument ***')
+        sys.exit(-1)
+
+    if args.rows < 0:
+        print('\n*** The --rows argument must not be negative ***')
+        sys.exit(-1)
+
+    rates = [args.duplicate_rate, args.o2_rate, args.radio_noise,
+             args.pathological_rate]
+    if any([not 0.0 <= rate <= 1.0 for rate in rates]):
+        print('\n*** The rate arguments must be between 0 and 1 ***')
+        sys.exit(-1)
+
+    if args.debug:
+        enable_debug()
+
+    options = CorpusOptions(
+        duplicate_rate    = args.duplicate_rate,
+        note_sentences    = args.note_sentences,
+        o2_rate           = args.o2_rate,
+        radio_noise       = args.radio_noise,
+        pathological_rate = args.pathological_rate,
+        long_note_chars   = args.long_note_chars,
+    )
+
+    stats = generate(args.output, args.rows, args.seed, args.template, options)
+    print(report(stats, args.seed))
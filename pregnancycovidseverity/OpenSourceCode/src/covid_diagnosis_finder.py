@@ -10,6 +10,7 @@ import json
 from collections import namedtuple
 
 from . import finder_overlap as overlap
+from . import explain
 
 COVID_DIAGNOSIS_FIELDS = [
     'sentence',
@@ -21,11 +22,14 @@ CovidDiagnosisTuple = namedtuple('CovidDiagnosisTuple', COVID_DIAGNOSIS_FIELDS)
 
 ###############################################################################
 _VERSION_MAJOR = 0
-_VERSION_MINOR = 2
+_VERSION_MINOR = 4
 
 # set to True to enable debug output
 _TRACE = False
 
+# finder name for the explain records
+_FINDER = 'covid_diagnosis_finder'
+
 
 # names used for regex capture groups
 _GROUP_HIST            = {'hist'}
@@ -76,6 +80,10 @@ def _make_covid_str(group_name = 'covid'):
 #def _make_words_str(group_name = 'words'):
 #    return _str_words.format(group_name)
 
+# all group names checked with _key_present
+_KEY_GROUPS = _GROUP_HIST | _GROUP_COVID | _GROUP_POS | _GROUP_NEG |\
+    _GROUP_TEST | _GROUP_WORDS | _GROUP_PNEUMONIA | _GROUP_COVID_PNEUMONIA
+
 def _key_present(keys, group):
     for s in group:
         if s in keys:
@@ -146,6 +154,13 @@ _REGEXES = [
     _regex_pneumonia,
 ]
 
+# precomputed (group_name, group_index) tables for the _KEY_GROUPS of each
+# regex, to find the groups in a match without calling match.groupdict();
+# keyed by id(regex), since hashing a compiled regex is expensive
+_GROUP_TABLES = {
+    id(regex):overlap.group_table(regex, _KEY_GROUPS) for regex in _REGEXES
+}
+
 
 ###############################################################################
 def enable_debug():
@@ -173,15 +188,12 @@ def _cleanup(sentence):
 
     # collapse repeated whitespace
     sentence = re.sub(r'\s+', ' ', sentence)
-
-    if _TRACE:
-        print('Cleaned sentence: "{0}"'.format(sentence))
     
     return sentence
 
 
 ###############################################################################
-def _regex_match(sentence, regex_list):
+def _regex_match(sentence, regex_list, sink=None):
     """
     """
 
@@ -197,12 +209,10 @@ def _regex_match(sentence, regex_list):
                                                 other=match))
             
 
-            if _TRACE:
-                print('[{0:2}]: [{1:3}, {2:3})\tMATCH TEXT: ->{3}<-'.
-                      format(i, start, end, match_text))
-                print('\tmatch.groupdict entries: ')
-                for k,v in match.groupdict().items():
-                    print('\t\t{0} => {1}'.format(k,v))
+            if sink is not None:
+                sink.add(_FINDER, explain.EVENT_MATCH, regex_index=i,
+                         start=start, end=end, text=match_text,
+                         groups=explain.match_groups(match))
     
 
     if 0 == len(candidates):
@@ -211,39 +221,42 @@ def _regex_match(sentence, regex_list):
     # sort candidates in descending order of length, for overlap resolution
     candidates = sorted(candidates, key=lambda x: x.end-x.start, reverse=True)
 
-    if _TRACE:
-        print('\tCandidate matches: ')
-        index = 0
-        for c in candidates:
-            print('\t[{0:2}]\t[{1},{2}): {3}'.
-                  format(index, c.start, c.end, c.match_text, c.regex))
-            index += 1
-        print()
-
     candidates = sorted(candidates, key=lambda x: x.end-x.start, reverse=True)
     pruned_candidates = overlap.remove_overlap(candidates,
-                                               _TRACE,
                                                keep_longest=True)
     pruned_candidates = sorted(pruned_candidates, key=lambda x: x.start)
+
+    if sink is not None:
+        for c in candidates:
+            if c not in pruned_candidates:
+                sink.add(_FINDER, explain.EVENT_DISCARD, start=c.start,
+                         end=c.end, text=c.match_text,
+                         reason='overlaps a longer candidate')
         
     return pruned_candidates
 
 
 ###############################################################################
-def run(sentence):
+def run(sentence, sink=None):
     """
     """
 
     results = []
+
+    if sink is None and _TRACE:
+        sink = explain.TraceSink()
     
     cleaned_sentence = _cleanup(sentence)
-    candidates = _regex_match(cleaned_sentence, _REGEXES)
+    if sink is not None:
+        sink.add(_FINDER, explain.EVENT_SENTENCE, text=cleaned_sentence)
+
+    candidates = _regex_match(cleaned_sentence, _REGEXES, sink)
 
     keys = set()    
     for c in candidates:
         # get matching groups and add matching group names to 'keys'
-        for k,v in c.other.groupdict().items():
-            if v is not None:
+        for k, index in _GROUP_TABLES[id(c.regex)]:
+            if c.other.group(index) is not None:
                 keys.add(k)
 
         # check matching text against covid regex to find if _str_words
@@ -252,9 +265,10 @@ def run(sentence):
         if match:
             keys.add('covid')
 
-        if _TRACE:
-            print('\t  text : {0}'.format(c.match_text))
-            print('\tgroups : {0}'.format(keys))
+        if sink is not None:
+            sink.add(_FINDER, explain.EVENT_NOTE, start=c.start, end=c.end,
+                     text=c.match_text, groups=sorted(keys),
+                     reason='key groups found so far')
         
 
     # need to check for negation... TBD
@@ -280,6 +294,14 @@ def run(sentence):
     elif has_covid and not has_neg:
         is_covid_positive = True
 
+    if sink is not None:
+        if has_covid and has_neg:
+            sink.add(_FINDER, explain.EVENT_NEGATION,
+                     reason='negation group matched with covid')
+        sink.add(_FINDER, explain.EVENT_RESULT,
+                 groups={'has_covid':is_covid_positive,
+                         'has_pneumonia':has_pneumonia})
+
     if 0 == len(candidates):
         cleaned_sentence = ''        
 
@@ -4,7 +4,6 @@ Diagnoses the severity of a Covid-19 infection according to the surveillance cas
 """
 
 import os
-import re
 import sys
 import json
 import datetime
@@ -57,9 +56,17 @@ PATIENT_DATA_FIELDS = [
     # whether the patient died from covid
     'died_from_covid', 
 
-    # from o2sat finder
-    'o2_flow_rate_list',  # L/min
+    # from o2sat finder, see o2f.O2Summary
+    'o2_count',             # number of O2 results found
+    'o2_max_flow_rate',     # L/min
+    'o2_high_flow_device',
+    'o2_needs_o2',
+    'o2_min_spo2',
+
+    # the individual O2 results, only kept for debugging (None otherwise)
+    'o2_flow_rate_list',    # L/min
     'o2_device_list',
+    'o2_device_type_list',  # o2f.DEVICE_TYPE_NC, o2f.DEVICE_TYPE_HFNC, etc.
     'needs_o2_list',
     
     # radio-button boolean indicating whether symptoms were present
@@ -68,10 +75,15 @@ PATIENT_DATA_FIELDS = [
     
     # mainly for debugging, all text fields for this patient
     'text_list',
+
+    # list of 'column:flag' strings for the texts that exceeded the text
+    # budget (see text_budget.py), or None
+    'budget_flags',
     
-    # dates of covid diagnosis and icu admission, not necessarily in this order
-    'datetime1',
-    'datetime2'
+    # dates of covid diagnosis and icu admission, not necessarily in this order,
+    # as days since 1970-01-01 (see fields.py), or None if not a valid date
+    'day1',
+    'day2'
 ]
 
 PatientData = namedtuple('PatientData', PATIENT_DATA_FIELDS)
@@ -98,26 +110,17 @@ NON_SYMPTOM_FIELDS = {
     'on_remdesivir', 'on_plasma', 'on_plaquenil', 'on_azithromycin',
     'on_other_drugs','on_dexamethasone',
     'is_asymptomatic', 'died_from_covid',
-    'datetime1', 'datetime2'
+    'day1', 'day2', 'budget_flags',
+    # only 'o2_count' is checked, as a single Oxygen symptom
+    'o2_max_flow_rate', 'o2_high_flow_device', 'o2_needs_o2', 'o2_min_spo2',
+    'o2_flow_rate_list', 'o2_device_list', 'o2_device_type_list', 'needs_o2_list',
 }
 
 
 ###############################################################################
 _VERSION_MAJOR = 0
-_VERSION_MINOR = 8
-
-# regexes to recognize high-flow devices
-
-# nasal cannula
-_str_nc = r'(O2\s)?'                                                  +\
-    r'(?<!HEENT:)(?<!HEENT :)(?<!HEENT: )(?<!HEENT : )'               +\
-    r'(n\.?[cp]\.?|n/c|(nas[ae]l[-\s]?)?(cannula|prongs?))(?![a-z])'
-_str_device_nc = r'(?P<nc>' + _str_nc + r')'
-_str_device_hfnc = r'(?P<hfnc>(O2\s)?(h\.?f\.?|h/f|high[- ]?flow)\s?' +\
-    _str_nc + r')'
+_VERSION_MINOR = 12
 
-_str_high_flow_device = _str_device_hfnc
-_regex_high_flow_device = re.compile(_str_high_flow_device, re.IGNORECASE)
 
 ###############################################################################
 def get_version():
@@ -141,12 +144,8 @@ def diagnose_covid_severity(patient_data_obj):
     # Check dates of icu admission and covid diagnosis. If dates differ by
     # 14 days or less, set dates_in_range to True. Could be a critical case.
     dates_in_range = False
-    if obj.datetime1 is not None and obj.datetime2 is not None:
-        if obj.datetime1 >= obj.datetime2:
-            delta = obj.datetime1 - obj.datetime2
-        else:
-            delta = obj.datetime2 - obj.datetime1
-        if delta.days <= 14:
+    if obj.day1 is not None and obj.day2 is not None:
+        if abs(obj.day1 - obj.day2) <= 14:
             dates_in_range = True
     
     has_critical_covid = False
@@ -193,23 +192,12 @@ def diagnose_covid_severity(patient_data_obj):
             has_severe_covid = True
 
         # severe covid if receiving O2 by nasal cannula or high-flow O2 device
-        n = len(obj.o2_flow_rate_list)
-        assert len(obj.o2_device_list) == n
-        assert len(obj.needs_o2_list)  == n
-        for k in range(n):
-            device = obj.o2_device_list[k]
-            if device is not None and len(device) > 0:
-                match = _regex_high_flow_device.search(device)
-                if match:
-                    # this is a high-flow device
-                    has_severe_covid = True
-                    break
+        if obj.o2_high_flow_device:
+            has_severe_covid = True
 
         # check flow rates; anything > 15 l/min is 'high flow' per CDC
-        for flow_rate in obj.o2_flow_rate_list:
-            if flow_rate is not None and flow_rate > 15:
-                has_severe_covid = True
-                break
+        if obj.o2_max_flow_rate is not None and obj.o2_max_flow_rate > 15:
+            has_severe_covid = True
 
     if not has_critical_covid and not has_severe_covid:
         # Check for absence of symptoms. A patient has
@@ -223,8 +211,8 @@ def diagnose_covid_severity(patient_data_obj):
                 continue
             else:
                 assert v is not None
-                if list == type(v):
-                    if len(v) > 0:
+                if 'o2_count' == k:
+                    if v > 0:
                         # found an Oxygen device, or a flow rate,
                         # or a statement about the patient needing
                         # supplemental Oxygen; hence the patient has
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+
+Executors for running the batch work of the SET-NET driver on workers.
+
+The sharded runs in pipeline.py and jobs.py submit tasks to an Executor,
+which has three backends:
+
+    INPROCESS   runs each task as it is submitted, in this process; useful
+                for debugging and profiling
+    PROCESS     a concurrent.futures.ProcessPoolExecutor on this machine
+    DASK        a dask.distributed cluster; a LocalCluster of worker
+                processes is started unless the address of a running
+                scheduler is given, so the same code can run on several
+                machines; requires the 'distributed' package
+
+Every Executor returns a concurrent.futures.Future from 'submit', so that the
+callers can wait on the results with concurrent.futures.wait whatever the
+backend.
+
+The 'initializer' of an Executor is called with 'initargs' once in each
+worker process, before its first task from the Executor. The initializer is
+used to send the settings for a run to the workers once, rather than with
+every task. For the PROCESS backend the arguments are sent as each worker
+process starts; for the DASK backend they are scattered to the workers once.
+The initializer is run as part of the first task in each worker, so that an
+error in the initializer is raised by that task's future, and so that Dask
+workers that join the cluster later are set up too.
+
+The tasks must be module-level functions, so that they can be pickled. The
+worker processes must be able to import this package; on a cluster, the
+package and its spaCy model must be installed on every worker machine.
+
+"""
+
+import os
+import uuid
+import threading
+import concurrent.futures
+from collections import deque
+
+try:
+    import distributed
+except ImportError:
+    distributed = None
+
+# executor backends
+INPROCESS = 'inprocess'
+PROCESS   = 'process'
+DASK      = 'dask'
+
+BACKENDS = [INPROCESS, PROCESS, DASK]
+
+# the tokens of the executors whose initializer has run in this process
+_initialized_tokens = set()
+_init_lock = threading.Lock()
+
+# the (initializer, initargs) of the process executors, keyed by token
+_init_data = {}
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 2
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+class Executor(object):
+    """
+    Base class for the executors. Use as a context manager, or call
+    'shutdown' when done.
+    """
+
+    backend = None
+
+    def __init__(self, worker_count=None, initializer=None, initargs=()):
+        if worker_count is None:
+            worker_count = os.cpu_count()
+        self.worker_count = max(1, worker_count)
+        self.initializer = initializer
+        self.initargs = initargs
+
+    def submit(self, fn, *args):
+        """
+        Run fn(*args) on a worker, and return a concurrent.futures.Future.
+        """
+        raise NotImplementedError()
+
+    def shutdown(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+
+###############################################################################
+class InProcessExecutor(Executor):
+    """
+    Runs each task in this process when it is submitted. The initializer is
+    run with the first task, like the other backends, so that an error in
+    the initializer is raised by that task's future.
+    """
+
+    backend = INPROCESS
+
+    def __init__(self, worker_count=None, initializer=None, initargs=()):
+        super().__init__(1, initializer, initargs)
+        self._initialized = False
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        try:
+            if not self._initialized:
+                if self.initializer is not None:
+                    self.initializer(*self.initargs)
+                self._initialized = True
+            future.set_result(fn(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+
+###############################################################################
+def _run_initialized(token, init_data, fn, *args):
+    """
+    Run a task on a worker, first calling the initializer of its executor
+    if it has not yet run in this worker process. If 'init_data' is None,
+    the initializer is found by the token of the executor.
+    """
+
+    with _init_lock:
+        if token not in _initialized_tokens:
+            if init_data is None:
+                init_data = _init_data[token]
+            initializer, initargs = init_data
+            if initializer is not None:
+                initializer(*initargs)
+            _initialized_tokens.add(token)
+
+    return fn(*args)
+
+
+###############################################################################
+def _store_init_data(token, init_data):
+    """
+    Pool initializer for ProcessExecutor, which stores the initializer of
+    the executor for '_run_initialized'.
+    """
+
+    _init_data[token] = init_data
+
+
+###############################################################################
+class ProcessExecutor(Executor):
+    """
+    Runs the tasks on a pool of worker processes on this machine.
+    """
+
+    backend = PROCESS
+
+    def __init__(self, worker_count=None, initializer=None, initargs=()):
+        super().__init__(worker_count, initializer, initargs)
+        self._token = uuid.uuid4().hex
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            self.worker_count, initializer=_store_init_data,
+            initargs=(self._token, (initializer, initargs)))
+
+    def submit(self, fn, *args):
+        return self._pool.submit(_run_initialized, self._token, None, fn, *args)
+
+    def shutdown(self):
+        self._pool.shutdown()
+
+
+###############################################################################
+class DaskExecutor(Executor):
+    """
+    Runs the tasks on a dask.distributed cluster. A LocalCluster with one
+    single-threaded worker process per worker is started if no scheduler
+    'address' is given.
+    """
+
+    backend = DASK
+
+    def __init__(self, worker_count=None, initializer=None, initargs=(),
+                 address=None):
+        if distributed is None:
+            raise RuntimeError('the "distributed" package is required for ' \
+                               'the {0} executor'.format(DASK))
+
+        super().__init__(worker_count, initializer, initargs)
+
+        self._cluster = None
+        if address is None:
+            self._cluster = distributed.LocalCluster(
+                n_workers=self.worker_count, threads_per_worker=1,
+                processes=True)
+            self._client = distributed.Client(self._cluster)
+        else:
+            self._client = distributed.Client(address)
+            self.worker_count = max(1, len(self._client.scheduler_info()['workers']))
+
+        # the initializer and its arguments are sent to the workers once
+        self._token = uuid.uuid4().hex
+        self._init_data = self._client.scatter( (initializer, initargs),
+                                                broadcast=True)
+
+        # the Dask futures must be kept until done, or the tasks are cancelled
+        self._lock = threading.Lock()
+        self._pending = set()
+
+        if _TRACE:
+            print('\tstarted Dask executor with {0} workers, dashboard {1}'.
+                  format(self.worker_count, self._client.dashboard_link))
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        dask_future = self._client.submit(_run_initialized, self._token,
+                                          self._init_data, fn, *args,
+                                          pure=False)
+        with self._lock:
+            self._pending.add(dask_future)
+
+        def done(f):
+            with self._lock:
+                self._pending.discard(f)
+            try:
+                future.set_result(f.result())
+            except Exception as exc:
+                future.set_exception(exc)
+
+        dask_future.add_done_callback(done)
+        return future
+
+    def shutdown(self):
+        self._client.close()
+        if self._cluster is not None:
+            self._cluster.close()
+
+
+###############################################################################
+def make_executor(backend, worker_count=None, initializer=None, initargs=(),
+                  address=None):
+    """
+    Return an Executor for one of the BACKENDS. The 'address' of a Dask
+    scheduler is used by the DASK backend only.
+    """
+
+    if INPROCESS == backend:
+        return InProcessExecutor(worker_count, initializer, initargs)
+    elif PROCESS == backend:
+        return ProcessExecutor(worker_count, initializer, initargs)
+    elif DASK == backend:
+        return DaskExecutor(worker_count, initializer, initargs, address)
+
+    raise ValueError('unknown executor backend "{0}"'.format(backend))
+
+
+###############################################################################
+def map_ordered(executor, fn, items, window=None):
+    """
+    Generator yielding fn(item) for each item, in order, computed on the
+    executor. At most 'window' tasks are in flight at a time, by default two
+    per worker, which bounds the results held in memory.
+    """
+
+    if window is None:
+        window = 2 * executor.worker_count
+
+    futures = deque()
+    for item in items:
+        if len(futures) >= window:
+            yield futures.popleft().result()
+        futures.append(executor.submit(fn, item))
+
+    while len(futures) > 0:
+        yield futures.popleft().result()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+
+Structured explanations of the finder results.
+
+The finders accept an optional 'sink' argument. If a sink is given, each
+finder adds an ExplainRecord to it for every regex match, for every match or
+candidate that is discarded and why, for every negation that is applied, and
+for every result. If no sink is given, nothing is recorded, and the only cost
+is a test for None at each point where a record could be added.
+
+An ExplainSink collects the records for later inspection:
+
+    sink = explain.ExplainSink()
+    o2f.extract(sentence, sink=sink)
+    for record in sink.records:
+        ...
+    print(sink.format())
+
+A TraceSink prints each record as it is added. The finders use a TraceSink if
+debug output has been enabled with their 'enable_debug' function and no sink
+was given.
+
+"""
+
+import os
+from collections import namedtuple
+
+EXPLAIN_RECORD_FIELDS = [
+    'finder',       # module name of the finder, such as 'o2sat_finder'
+    'event',        # one of the EVENT_ strings below
+    'stage',        # the regex set or step, such as 'sao2' or 'fever'
+    'regex_index',  # index of the regex in the regex list for the stage
+    'start',        # [start, end) offsets of the text in the sentence
+    'end',
+    'text',         # matching text, or the sentence for EVENT_SENTENCE
+    'groups',       # dict of the named groups present in the match
+    'reason',       # why a match was discarded or a negation applied, etc.
+]
+ExplainRecord = namedtuple('ExplainRecord', EXPLAIN_RECORD_FIELDS)
+
+# all fields not given to ExplainSink.add are None
+ExplainRecord.__new__.__defaults__ = (None,) * len(EXPLAIN_RECORD_FIELDS)
+
+EVENT_SENTENCE = 'sentence'     # the cleaned sentence searched by a finder
+EVENT_MATCH    = 'match'        # a regex matched
+EVENT_DISCARD  = 'discard'      # a match or candidate was dropped
+EVENT_NEGATION = 'negation'     # a negation applied to a candidate
+EVENT_RESULT   = 'result'       # a result was produced from a candidate
+EVENT_NOTE     = 'note'         # any other step of interest
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 1
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def match_groups(match):
+    """
+    Return a dict of the named groups present in a regex match object.
+    """
+
+    return {k:v for k,v in match.groupdict().items() if v is not None}
+
+
+###############################################################################
+def format_record(record):
+    """
+    Return a single line of text for an ExplainRecord.
+    """
+
+    parts = ['{0:>22} {1:<8}'.format(record.finder, record.event)]
+    if record.stage is not None:
+        parts.append('[{0}]'.format(record.stage))
+    if record.regex_index is not None:
+        parts.append('regex {0}'.format(record.regex_index))
+    if record.start is not None:
+        parts.append('[{0}, {1})'.format(record.start, record.end))
+    if record.text is not None:
+        parts.append('"{0}"'.format(record.text))
+    if record.groups is not None:
+        parts.append('groups: {0}'.format(record.groups))
+    if record.reason is not None:
+        parts.append('({0})'.format(record.reason))
+
+    return ' '.join(parts)
+
+
+###############################################################################
+class ExplainSink(object):
+    """
+    Collects ExplainRecords from the finders.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def add(self, finder, event, **kwargs):
+        self.records.append(ExplainRecord(finder=finder, event=event, **kwargs))
+
+    def clear(self):
+        self.records = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def format(self):
+        """
+        Return the records as printable text, one record per line.
+        """
+
+        return '\n'.join([format_record(r) for r in self.records])
+
+
+###############################################################################
+class TraceSink(ExplainSink):
+    """
+    Prints each record as it is added, without keeping it.
+    """
+
+    def add(self, finder, event, **kwargs):
+        print(format_record(ExplainRecord(finder=finder, event=event, **kwargs)))
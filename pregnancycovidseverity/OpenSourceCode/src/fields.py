@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+
+Conversion of the radio-button and date columns of a SET-NET extract.
+
+The radio-button columns hold the strings '1' (yes), '0' (no), '88' (not
+reported), or '.' or an empty string (missing). The values for a chunk of
+rows are converted in a single pass to a matrix of tri-state codes, which
+can then be compared as a whole against RADIO_YES or RADIO_NO.
+
+The date columns use different formats in different extracts, such as
+'2020-03-24' or '24-Mar-20'. Each DateColumn remembers the format that last
+succeeded for its column and tries that first, and caches the result for
+each distinct string, since the same dates occur in many rows. Dates are
+converted to integer days since 1970-01-01, so that the difference of two
+dates is a simple subtraction. Missing or unparseable dates are NO_DATE.
+
+"""
+
+import os
+import datetime
+import numpy as np
+
+# tri-state radio-button codes
+RADIO_YES     = 1
+RADIO_NO      = 0
+RADIO_UNKNOWN = -1   # not reported, missing, or unexpected value
+
+# only exact matches count as yes or no
+_RADIO_CODES = {
+    '1' : RADIO_YES,
+    '0' : RADIO_NO,
+}
+
+# day number for a missing or unparseable date
+NO_DATE = np.iinfo(np.int32).min
+
+# date formats found in the extracts, tried in this order
+DATE_FORMATS = [
+    '%Y-%m-%d',     # 2020-03-24
+    '%d-%b-%y',     # 24-Mar-20
+    '%d-%b-%Y',     # 24-Mar-2020
+    '%m/%d/%Y',     # 03/24/2020
+    '%m/%d/%y',     # 03/24/20
+]
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 2
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def parse_radio(radio_rows):
+    """
+    Convert a list of tuples of radio-button strings, one tuple per row, to a
+    numpy int8 matrix of RADIO_YES, RADIO_NO, and RADIO_UNKNOWN codes. The
+    strings are compared with each code as a whole matrix, rather than
+    looked up one value at a time.
+    """
+
+    if 0 == len(radio_rows):
+        return np.zeros((0, 0), dtype=np.int8)
+
+    values = np.array(radio_rows, dtype=object)
+    matrix = np.full(values.shape, RADIO_UNKNOWN, dtype=np.int8)
+    for value, code in _RADIO_CODES.items():
+        matrix[values == value] = code
+    return matrix
+
+
+###############################################################################
+def days_to_list(days):
+    """
+    Convert an array of day numbers to a list of ints, with None for NO_DATE.
+    """
+
+    return [None if NO_DATE == d else d for d in days.tolist()]
+
+
+###############################################################################
+class DateColumn(object):
+    """
+    Parser for the dates in a single column.
+    """
+
+    def __init__(self, col_name):
+        self.col_name = col_name
+
+        # the format that last parsed a date in this column
+        self.date_format = None
+
+        # maps a date string to its day number
+        self._cache = {}
+
+    def _parse_one(self, date_string):
+        """
+        Convert a single date string to a day number.
+        """
+
+        text = date_string.strip()
+        if 0 == len(text) or '.' == text:
+            return NO_DATE
+
+        formats = DATE_FORMATS
+        if self.date_format is not None:
+            formats = [self.date_format] + formats
+
+        for date_format in formats:
+            try:
+                d = datetime.datetime.strptime(text, date_format)
+            except ValueError:
+                continue
+            if date_format != self.date_format:
+                self.date_format = date_format
+                if _TRACE:
+                    print('\t{0}: using date format "{1}"'.
+                          format(self.col_name, date_format))
+            return d.toordinal() - _EPOCH_ORDINAL
+
+        if _TRACE:
+            print('\t{0}: unrecognized date "{1}"'.
+                  format(self.col_name, date_string))
+        return NO_DATE
+
+    def parse(self, date_strings):
+        """
+        Convert a list of date strings to a numpy int32 array of day numbers.
+        """
+
+        cache = self._cache
+        days = np.empty(len(date_strings), dtype=np.int32)
+        for i, date_string in enumerate(date_strings):
+            day = cache.get(date_string)
+            if day is None:
+                day = self._parse_one(date_string)
+                cache[date_string] = day
+            days[i] = day
+
+        return days
@@ -14,7 +14,7 @@ Candidate.__new__.__defaults__ = (None,) * len(Candidate._fields)
 ###############################################################################
 
 _VERSION_MAJOR = 0
-_VERSION_MINOR = 4
+_VERSION_MINOR = 5
 _MODULE_NAME   = 'finder_overlap.py'
 
 
@@ -132,6 +132,38 @@ def remove_overlap(candidates, debug=False, keep_longest=True):
     return results
 
 
+###############################################################################
+def group_table(regex, names=None):
+    """
+    Return a list of (group_name, group_index) pairs for the named groups of a
+    compiled regex, in the same order as match.groupdict(). If 'names' is not
+    None, only the groups with these names are included. The finders compute
+    these tables once per regex and read the values with match.group(index),
+    instead of building a dict for every match.
+    """
+
+    table = []
+    for name, index in sorted(regex.groupindex.items(), key=lambda x: x[1]):
+        if names is None or name in names:
+            table.append( (name, index) )
+
+    return table
+
+
+###############################################################################
+def group_value(match, name):
+    """
+    Return the value of the named group of a match, or None if the group did
+    not participate in the match or the regex has no such group.
+    """
+
+    index = match.re.groupindex.get(name)
+    if index is None:
+        return None
+
+    return match.group(index)
+
+
 ###############################################################################
 def get_version():
     return '{0} {1}.{2}'.format(_MODULE_NAME, _VERSION_MAJOR, _VERSION_MINOR)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+
+Micro-benchmark for reading the named groups of finder matches.
+
+The finders read the named groups of each regex match either through the
+precomputed tables from finder_overlap.group_table, or one group at a time
+with finder_overlap.group_value. This script collects the matches of the
+SaO2 regexes on the o2sat_finder.SENTENCES and times these against building
+a dict for every match with match.groupdict(), which is what the finders did
+before. It also times o2sat_finder.extract on all of the SENTENCES.
+
+Usage:
+
+        python3 -m src.finder_overlap_benchmark --number 200 --repeat 5
+
+"""
+
+import os
+import sys
+import timeit
+import argparse
+
+from . import finder_overlap as overlap
+from . import o2sat_finder as o2f
+
+# named groups read with 'group_value' in o2sat_finder
+_VALUE_NAMES = ['val', 'flow_rate', 'flow_rate2', 'flow_rate3', 'device']
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 1
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def collect_matches(sentences):
+    """
+    Return the list of all matches of the SaO2 regexes in the cleaned
+    sentences.
+    """
+
+    matches = []
+    for sentence in sentences:
+        cleaned_sentence = o2f._cleanup(sentence)
+        for regex in o2f._SAO2_REGEXES:
+            matches.extend(regex.finditer(cleaned_sentence))
+
+    return matches
+
+
+###############################################################################
+def _groupdict_items(matches):
+    for match in matches:
+        [(k, v) for k, v in match.groupdict().items() if v is not None]
+
+
+###############################################################################
+def _table_items(matches):
+    for match in matches:
+        groups = []
+        for k, index in o2f._GROUP_TABLES[id(match.re)]:
+            v = match.group(index)
+            if v is not None:
+                groups.append( (k, v) )
+
+
+###############################################################################
+def _groupdict_values(matches):
+    for match in matches:
+        d = match.groupdict()
+        for name in _VALUE_NAMES:
+            d.get(name)
+
+
+###############################################################################
+def _group_values(matches):
+    for match in matches:
+        for name in _VALUE_NAMES:
+            overlap.group_value(match, name)
+
+
+###############################################################################
+def _extract_all(sentences):
+    for sentence in sentences:
+        o2f.extract(sentence)
+
+
+###############################################################################
+def _best_time(fn, arg, number, repeat):
+    """
+    Return the best time in seconds for a single call of fn(arg).
+    """
+
+    times = timeit.repeat(lambda: fn(arg), number=number, repeat=repeat)
+    return min(times) / number
+
+
+###############################################################################
+def run(number, repeat):
+    """
+    Run the benchmark and print the results.
+    """
+
+    sentences = o2f.SENTENCES
+    matches = collect_matches(sentences)
+    match_count = max(1, len(matches))
+
+    print('Group benchmark summary: ')
+    print('\tSentences    : {0:>9}'.format(len(sentences)))
+    print('\tMatches      : {0:>9}'.format(len(matches)))
+
+    # per-match times for reading the groups
+    for label, fn in [('groupdict', _groupdict_items),
+                      ('group_table', _table_items),
+                      ('groupdict get', _groupdict_values),
+                      ('group_value', _group_values)]:
+        seconds = _best_time(fn, matches, number, repeat)
+        print('\t{0:<13}: {1:>9.3f} us/match'.
+              format(label, 1.0e6 * seconds / match_count))
+
+    # number of calls for the slower end-to-end timing
+    extract_number = max(1, number // 20)
+    seconds = _best_time(_extract_all, sentences, extract_number, repeat)
+    print('\t{0:<13}: {1:>9.3f} ms/pass'.format('extract', 1.0e3 * seconds))
+
+
+###############################################################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='benchmark the named-group reads of the finders')
+
+    parser.add_argument('-v', '--version',
+                        action='store_true',
+                        help='print version to stdout and then exit')
+    parser.add_argument('--number',
+                        type=int,
+                        default=200,
+                        help='passes over the matches per timing, default 200')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=5,
+                        help='timings to take the best of, default 5')
+
+    args = parser.parse_args()
+
+    if args.version:
+        print(get_version())
+        sys.exit(0)
+
+    run(args.number, args.repeat)
@@ -0,0 +1,641 @@
+#!/usr/bin/env python3
+"""
+
+Run the SET-NET driver on several input files with one shared worker pool.
+
+The extracts for several jurisdictions and months are often processed
+together. Running each in its own notebook session loads the spaCy model
+once per file and processes the files one after another. Instead, run_jobs
+diagnoses all of the files with a single pool of workers from executors.py,
+which stays warm from the first file to the last:
+
+    - Each file is split into byte-range shards of about 'shard_bytes'
+      bytes (see shards.py); a compressed file is a single shard. The
+      shards of all files are the tasks for the pool.
+
+    - The tasks are scheduled in fair-share order, taking one shard from
+      each unfinished file in turn, so that a small file is not held up
+      behind a large one. At most two tasks per worker are in flight at a
+      time, which bounds the results held in memory.
+
+    - Each worker keeps a result_cache.ResultCache, so that the finders
+      are run once per distinct text per worker across all of the files,
+      not once per chunk.
+
+    - The results for each file are written in file order by the main
+      process, to its own output directory. The output directories follow
+      the notebook convention 'results/<date>', where the date is the first
+      run of digits in the file name. Files that share a date are written
+      to 'results/<date>/<file name>' instead.
+
+A line is printed as each file is completed, and a summary of the status and
+throughput of every file is printed at the end, with the stage timings and
+counters from all of the workers (see metrics.py). A progress line with the
+estimated time remaining is printed periodically. If memory profiling is
+enabled, a memory report for all of the workers is printed too (see
+memory_profile.py); a run with a memory budget stops as soon as any worker
+exceeds it. An error in one file, including an unreadable header, is
+reported and does not stop the other files, and the partial output files
+of a failed file are removed.
+
+Manifests and checkpoints are not used for multi-file runs.
+
+Usage:
+
+        python3 -m src.jobs -o results 'extracts/*.csv.gz' other.csv
+
+"""
+
+import os
+import re
+import sys
+import glob
+import math
+import time
+import argparse
+import datetime
+from collections import namedtuple
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from . import output
+from . import shards
+from . import pipeline
+from . import text_plan
+from . import text_budget
+from . import metrics
+from . import memory_profile
+from . import executors
+from . import compression
+from . import result_cache
+
+# output files are written to subdirectories of this directory
+DEFAULT_OUTDIR = 'results'
+
+# target size of each shard of an uncompressed file
+SHARD_BYTES = 8 * 1024 * 1024
+
+# max number of tasks in flight for each worker process
+TASKS_PER_WORKER = 2
+
+# job states
+STATE_PENDING = 'pending'
+STATE_RUNNING = 'running'
+STATE_DONE    = 'done'
+STATE_FAILED  = 'failed'
+
+# extensions removed from the input file name to name its output directory
+_STEM_EXTENSIONS = ['.csv', '.txt'] + list(compression.EXTENSIONS.values())
+
+JOB_FIELDS = [
+    'input_file',
+    'output_dir',
+    'date',             # date string for the diagnoses file name
+]
+Job = namedtuple('Job', JOB_FIELDS)
+
+# the result of a single task in a worker process
+TASK_RESULT_FIELDS = [
+    'job_index',
+    'shard_index',
+    'shard_result',     # pipeline.ShardResult
+    'cache_hits',       # result cache hits for this task
+    'cache_misses',     # result cache misses for this task
+]
+TaskResult = namedtuple('TaskResult', TASK_RESULT_FIELDS)
+
+# ShardOptions for each job and the result cache, in a worker process
+_job_options = None
+_cache = None
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 7
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def job_date(input_file):
+    """
+    Return the date string for an input file, as in the notebook: the first
+    run of digits in the file name, or else the current year and month.
+    """
+
+    match = re.search(r'\d+', os.path.basename(input_file))
+    if match:
+        return match.group()
+
+    now = datetime.datetime.now()
+    return '{0:4d}{1:02d}'.format(now.year, now.month)
+
+
+###############################################################################
+def _file_stem(input_file):
+    """
+    Return the file name without its directory and extensions.
+    """
+
+    stem = os.path.basename(input_file)
+    while True:
+        root, ext = os.path.splitext(stem)
+        if ext.lower() not in _STEM_EXTENSIONS:
+            return stem
+        stem = root
+
+
+###############################################################################
+def find_jobs(patterns, outdir=DEFAULT_OUTDIR):
+    """
+    Return a list of Jobs for the files matching a list of file names or glob
+    patterns, each file once, in the order given.
+    """
+
+    input_files = []
+    for pattern in patterns:
+        for input_file in sorted(glob.glob(pattern)):
+            if os.path.isfile(input_file) and input_file not in input_files:
+                input_files.append(input_file)
+
+    dates = [job_date(input_file) for input_file in input_files]
+
+    jobs = []
+    used_dirs = set()
+    for input_file, date in zip(input_files, dates):
+        output_dir = os.path.join(outdir, date)
+        if dates.count(date) > 1:
+            output_dir = os.path.join(output_dir, _file_stem(input_file))
+
+        # files with the same name in different directories
+        unique_dir = output_dir
+        k = 1
+        while unique_dir in used_dirs:
+            k += 1
+            unique_dir = '{0}_{1}'.format(output_dir, k)
+        used_dirs.add(unique_dir)
+
+        jobs.append(Job(input_file, unique_dir, date))
+
+    return jobs
+
+
+###############################################################################
+def _init_worker(config, options_list, cache_entries):
+    """
+    Initializer for the worker processes. The spaCy model is loaded when the
+    pipeline module is imported, so it is loaded once per worker for all of
+    the files.
+    """
+
+    global _job_options
+    global _cache
+    pipeline.check_worker_config(config)
+    _job_options = options_list
+    _cache = result_cache.ResultCache(cache_entries)
+
+
+###############################################################################
+def _run_task(job_index, shard_index, shard):
+    """
+    Diagnose a single shard of the file for a job in a worker process, and
+    return a TaskResult.
+    """
+
+    hits = _cache.hit_count
+    misses = _cache.miss_count
+    shard_result = pipeline.diagnose_shard(_job_options[job_index], shard,
+                                           _cache)
+
+    return TaskResult(
+        job_index    = job_index,
+        shard_index  = shard_index,
+        shard_result = shard_result,
+        cache_hits   = _cache.hit_count - hits,
+        cache_misses = _cache.miss_count - misses,
+    )
+
+
+###############################################################################
+def _fair_share(shard_lists):
+    """
+    Return the list of (job_index, shard_index, shard) tasks for the shard
+    lists of the jobs, taking one shard from each job in turn.
+    """
+
+    tasks = []
+    max_len = max([len(shard_list) for shard_list in shard_lists] + [0])
+    for shard_index in range(max_len):
+        for job_index, shard_list in enumerate(shard_lists):
+            if shard_index < len(shard_list):
+                tasks.append( (job_index, shard_index, shard_list[shard_index]) )
+
+    return tasks
+
+
+###############################################################################
+class JobStatus(object):
+    """
+    Progress of a single job, and the output writer for its results.
+    """
+
+    def __init__(self, job, shard_count):
+        self.job = job
+        self.shard_count = shard_count
+        self.state = STATE_PENDING
+        self.error = None
+
+        self.shards_done = 0
+        self.patient_count = 0
+        self.corrupted_line_indices = []
+        self.plan_totals = text_plan.TextPlan(pipeline.TEXT_COLS)
+        self.budget_stats = text_budget.BudgetStats()
+        self.metrics = metrics.Metrics()
+        self.memory_profile = None
+
+        # the output files are keyed by patient id
+        self.seen_ids = set()
+
+        self.start_time = None
+        self.end_time = None
+        self.writer = None
+
+        # results received ahead of their turn, keyed by shard index
+        self.held = {}
+
+    def start(self, compress=None):
+        if STATE_PENDING != self.state:
+            return
+        self.state = STATE_RUNNING
+        self.start_time = time.perf_counter()
+        self.writer = output.OutputWriter(self.job.output_dir, self.job.date,
+                                          compress=compress)
+
+    def add(self, shard_index, shard_result):
+        """
+        Write the results for a shard, and for any held shards that follow
+        it. Returns True if the job is complete.
+        """
+
+        self.held[shard_index] = shard_result
+        while self.shards_done in self.held:
+            result = self.held.pop(self.shards_done)
+            write_start_time = time.perf_counter()
+            for user_id, row_hash, diagnosis, patient_data in result.chunk_result.rows:
+                if user_id in self.seen_ids:
+                    raise ValueError('duplicate patient id "{0}"'.format(user_id))
+                self.seen_ids.add(user_id)
+                self.writer.add(user_id, diagnosis, patient_data)
+                self.patient_count += 1
+            self.metrics.add_time(metrics.STAGE_OUTPUT,
+                                  time.perf_counter() - write_start_time)
+            self.metrics.count(metrics.COUNTER_ROWS,
+                               len(result.chunk_result.rows))
+            self.corrupted_line_indices.extend(result.corrupted_line_indices)
+            self.plan_totals.add_stats(result.chunk_result.plan_stats)
+            self.budget_stats.merge(result.budget_stats)
+            self.metrics.merge(result.metrics)
+            if result.memory_profile is not None:
+                if self.memory_profile is None:
+                    self.memory_profile = memory_profile.MemoryProfile(
+                        result.memory_profile.trace,
+                        result.memory_profile.budget_mb)
+                self.memory_profile.merge(result.memory_profile)
+            self.shards_done += 1
+
+        return self.shards_done == self.shard_count
+
+    def finish(self):
+        self.writer.close()
+        self.writer = None
+        self.state = STATE_DONE
+        self.end_time = time.perf_counter()
+
+    def fail(self, exc):
+        if self.writer is not None:
+            self.writer.discard()
+            self.writer = None
+        self.held = {}
+        self.state = STATE_FAILED
+        self.error = exc
+        self.end_time = time.perf_counter()
+
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+        end_time = self.end_time
+        if end_time is None:
+            end_time = time.perf_counter()
+        return end_time - self.start_time
+
+    def rate(self):
+        elapsed = self.elapsed()
+        if 0.0 == elapsed:
+            return 0.0
+        return self.patient_count / elapsed
+
+
+###############################################################################
+def _shard_count(input_file, shard_bytes):
+    """
+    Return the number of shards for an input file of the given shard size.
+    """
+
+    size = os.path.getsize(input_file)
+    return max(1, int(math.ceil(size / shard_bytes)))
+
+
+###############################################################################
+def run_jobs(jobs, processes=None, shard_bytes=SHARD_BYTES,
+             chunk_size=pipeline.CHUNK_SIZE, do_segmentation=True,
+             keep_debug_fields=False, budget=text_budget.DEFAULT_BUDGET,
+             cache_entries=result_cache.DEFAULT_MAX_ENTRIES, compress=None,
+             backend=executors.PROCESS, address=None, metrics_file=None,
+             prometheus_file=None,
+             progress_interval=metrics.PROGRESS_INTERVAL_S,
+             profile_memory=False, memory_budget_mb=None):
+    """
+    Diagnose the input files of a list of Jobs with a shared pool of
+    'processes' workers (by default, one per CPU) from an executor with the
+    given 'backend'. The 'address' of a Dask scheduler is used by the DASK
+    backend only. Returns the list of JobStatus objects, one for each job.
+    The output files are compressed with the compression format 'compress',
+    if given. The stage timings and counters for all of the files are
+    written to 'metrics_file' as JSON and to 'prometheus_file' in the
+    Prometheus text format, if given.
+
+    If 'profile_memory' is True, the memory used by each stage in the
+    workers is traced and reported. If 'memory_budget_mb' is given, the run
+    stops with a memory_profile.MemoryBudgetError as soon as the RSS of a
+    worker exceeds that many MB.
+    """
+
+    if processes is None:
+        processes = os.cpu_count()
+
+    start_time = time.perf_counter()
+    total_rows = 0
+
+    statuses = []
+    options_list = []
+    shard_lists = []
+    for job in jobs:
+        try:
+            col_names, col_map = pipeline.read_header(job.input_file)
+            shard_list = shards.find_shards(job.input_file,
+                                            _shard_count(job.input_file,
+                                                         shard_bytes))
+            row_count = shards.estimate_row_count(job.input_file)
+        except Exception as exc:
+            status = JobStatus(job, 0)
+            status.fail(exc)
+            statuses.append(status)
+            options_list.append(None)
+            shard_lists.append([])
+            print('\n*** Failed "{0}": {1}: {2} ***'.
+                  format(job.input_file, type(exc).__name__, exc))
+            continue
+
+        options_list.append(pipeline.ShardOptions(
+            input_file        = job.input_file,
+            col_names         = col_names,
+            col_map           = col_map,
+            entries           = {},
+            do_segmentation   = do_segmentation,
+            keep_debug_fields = keep_debug_fields,
+            budget            = budget,
+            chunk_size        = chunk_size,
+            profile_memory    = profile_memory,
+            memory_budget_mb  = memory_budget_mb,
+        ))
+        shard_lists.append(shard_list)
+        statuses.append(JobStatus(job, len(shard_list)))
+
+        if total_rows is not None and row_count is not None:
+            total_rows += row_count
+        else:
+            total_rows = None
+
+    # files without data rows are complete already
+    for status in statuses:
+        if 0 == status.shard_count and STATE_PENDING == status.state:
+            status.start(compress)
+            status.finish()
+
+    tasks = _fair_share(shard_lists)
+    cache_hits = 0
+    cache_misses = 0
+    progress = metrics.Progress(total_rows, progress_interval)
+
+    pending = {}
+    next_task = 0
+    with executors.make_executor(backend, processes, _init_worker,
+                                 (pipeline.worker_config(), options_list,
+                                  cache_entries),
+                                 address) as executor:
+        max_in_flight = executor.worker_count * TASKS_PER_WORKER
+        while next_task < len(tasks) or len(pending) > 0:
+            while next_task < len(tasks) and len(pending) < max_in_flight:
+                job_index, shard_index, shard = tasks[next_task]
+                next_task += 1
+                status = statuses[job_index]
+                if STATE_FAILED == status.state:
+                    continue
+                status.start(compress)
+                future = executor.submit(_run_task, job_index, shard_index,
+                                         shard)
+                pending[future] = job_index
+
+            if 0 == len(pending):
+                continue
+
+            done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                status = statuses[pending.pop(future)]
+                if STATE_FAILED == status.state:
+                    continue
+
+                try:
+                    result = future.result()
+                    cache_hits += result.cache_hits
+                    cache_misses += result.cache_misses
+                    complete = status.add(result.shard_index,
+                                          result.shard_result)
+                except memory_profile.MemoryBudgetError as exc:
+                    # the other files would exceed the budget too, so remove
+                    # the partial output of every running job before stopping
+                    for s in statuses:
+                        if STATE_RUNNING == s.state:
+                            s.fail(exc)
+                    raise
+                except Exception as exc:
+                    status.fail(exc)
+                    print('\n*** Failed "{0}": {1}: {2} ***'.
+                          format(status.job.input_file, type(exc).__name__,
+                                 exc))
+                    continue
+
+                progress.update(sum([s.patient_count for s in statuses]))
+                if _TRACE:
+                    print('\t"{0}": {1} of {2} shards'.
+                          format(status.job.input_file, status.shards_done,
+                                 status.shard_count))
+
+                if complete:
+                    status.finish()
+                    print('Completed "{0}": {1} patients in {2:.3f} s ' \
+                          '({3:.1f} patients/sec)'.
+                          format(status.job.input_file, status.patient_count,
+                                 status.elapsed(), status.rate()))
+
+    elapsed_s = time.perf_counter() - start_time
+    run_metrics = metrics.Metrics()
+    run_profile = None
+    for status in statuses:
+        run_metrics.merge(status.metrics)
+        if status.memory_profile is not None:
+            if run_profile is None:
+                run_profile = memory_profile.MemoryProfile(profile_memory,
+                                                           memory_budget_mb)
+            run_profile.merge(status.memory_profile)
+
+    print(report(statuses, cache_hits, cache_misses))
+    print(run_metrics.report())
+    if run_profile is not None:
+        run_profile.record_rss()
+        print(run_profile.report())
+    if metrics_file is not None:
+        metrics.write_json(run_metrics, metrics_file, elapsed_s)
+    if prometheus_file is not None:
+        metrics.write_prometheus(run_metrics, prometheus_file, elapsed_s)
+
+    return statuses
+
+
+###############################################################################
+def report(statuses, cache_hits=0, cache_misses=0):
+    """
+    Return a printable summary of the status of each job.
+    """
+
+    lines = ['Job summary: ']
+    lines.append('\t{0:<32} {1:<8} {2:>9} {3:>9} {4:>9} {5:>10}'.
+                 format('file', 'state', 'patients', 'corrupted', 'elapsed s',
+                        'patients/s'))
+    for status in statuses:
+        lines.append('\t{0:<32} {1:<8} {2:>9} {3:>9} {4:>9.3f} {5:>10.1f}'.
+                     format(os.path.basename(status.job.input_file),
+                            status.state, status.patient_count,
+                            len(status.corrupted_line_indices),
+                            status.elapsed(), status.rate()))
+
+    total = cache_hits + cache_misses
+    hit_pct = 0.0
+    if total > 0:
+        hit_pct = 100.0 * cache_hits / total
+    lines.append('\tResult cache : {0} hits, {1} misses, {2:.1f}% hit rate'.
+                 format(cache_hits, cache_misses, hit_pct))
+
+    return '\n'.join(lines)
+
+
+###############################################################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='diagnose several SET-NET CSV files with one worker pool')
+
+    parser.add_argument('-v', '--version',
+                        action='store_true',
+                        help='print version to stdout and then exit')
+    parser.add_argument('files',
+                        nargs='*',
+                        help='input files or glob patterns')
+    parser.add_argument('-o', '--outdir',
+                        default=DEFAULT_OUTDIR,
+                        help='output root directory, default "{0}"'.
+                        format(DEFAULT_OUTDIR))
+    parser.add_argument('--processes',
+                        type=int,
+                        help='number of worker processes, default one per CPU')
+    parser.add_argument('--shard-mb',
+                        type=float,
+                        default=SHARD_BYTES / (1024 * 1024),
+                        help='target shard size in MB, default {0}'.
+                        format(SHARD_BYTES // (1024 * 1024)))
+    parser.add_argument('--backend',
+                        choices=executors.BACKENDS,
+                        default=executors.PROCESS,
+                        help='executor backend, default {0}'.
+                        format(executors.PROCESS))
+    parser.add_argument('--scheduler',
+                        dest='address',
+                        help='address of a running Dask scheduler, for the ' \
+                        '{0} backend; default is a local cluster'.
+                        format(executors.DASK))
+    parser.add_argument('--compress',
+                        choices=list(compression.EXTENSIONS.keys()),
+                        help='compress the output files with this format')
+    parser.add_argument('--metrics-file',
+                        help='write the stage timings and counters to this ' \
+                        'JSON file')
+    parser.add_argument('--prometheus-file',
+                        help='write the stage timings and counters to this ' \
+                        'file in the Prometheus text format')
+    parser.add_argument('--profile-memory',
+                        action='store_true',
+                        help='trace the memory used by each stage and ' \
+                        'report the top allocation sites (slow)')
+    parser.add_argument('--memory-budget-mb',
+                        type=float,
+                        help='stop if the RSS of a worker exceeds this ' \
+                        'many MB')
+    parser.add_argument('-d', '--debug',
+                        action='store_true',
+                        help='print debug information to stdout')
+
+    args = parser.parse_args()
+
+    if args.version:
+        print(get_version())
+        sys.exit(0)
+
+    jobs = find_jobs(args.files, args.outdir)
+    if 0 == len(jobs):
+        print('\n*** No input files found ***')
+        sys.exit(-1)
+
+    if args.debug:
+        enable_debug()
+
+    for job in jobs:
+        print('"{0}" -> "{1}"'.format(job.input_file, job.output_dir))
+
+    # run through the imported module rather than __main__, so that the
+    # worker functions can be found by name in the worker processes
+    from . import jobs as jobs_module
+
+    statuses = jobs_module.run_jobs(jobs, args.processes,
+                        int(args.shard_mb * 1024 * 1024),
+                        compress=args.compress, backend=args.backend,
+                        address=args.address,
+                        metrics_file=args.metrics_file,
+                        prometheus_file=args.prometheus_file,
+                        profile_memory=args.profile_memory,
+                        memory_budget_mb=args.memory_budget_mb)
+
+    if any([jobs_module.STATE_FAILED == status.state for status in statuses]):
+        sys.exit(-1)
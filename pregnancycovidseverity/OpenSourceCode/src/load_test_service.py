@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+
+Load test for the diagnosis service in service.py.
+
+Reads patient records from a SET-NET CSV extract and sends them to a running
+service from a number of concurrent clients. Each client sends requests of
+a fixed number of records, cycling through the file, until it has sent its
+share of the requests. Prints the throughput, the latency percentiles, the
+number of refused requests, and the batch statistics of the service.
+
+Usage:
+
+        python3 -m src.service --port 8642 &
+        python3 -m src.load_test_service -f synthetic_data_20220328.csv \
+                --clients 16 --requests 2000 --records-per-request 1
+
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import socket
+import argparse
+import threading
+import http.client
+
+from . import compression
+
+# these match the defaults of service.py, which is not imported here since it
+# loads the pipeline and the spaCy model
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8642
+
+# key of the patient id in each record sent to the service
+RECORD_ID_KEY = 'id'
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 3
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a Unix socket.
+    """
+
+    def __init__(self, socket_path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+###############################################################################
+def read_records(input_file):
+    """
+    Return the rows of a CSV extract as a list of records for the service,
+    with the first column as the patient id.
+    """
+
+    records = []
+    with compression.open_text(input_file, encoding='latin-1',
+                                 newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        col_names = [name.lower() for name in next(reader)]
+        for line_items in reader:
+            if len(line_items) != len(col_names):
+                continue
+            record = dict(zip(col_names, line_items))
+            record[RECORD_ID_KEY] = line_items[0]
+            records.append(record)
+
+    return records
+
+
+###############################################################################
+def _percentile(sorted_values, pct):
+    """
+    Return the given percentile of a sorted list, by the nearest-rank method.
+    """
+
+    if 0 == len(sorted_values):
+        return 0.0
+    index = max(0, int(round(pct / 100.0 * len(sorted_values))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+###############################################################################
+def _client(make_conn, requests, latencies, counts, lock):
+    """
+    Send each request body in 'requests' and record the latency of each.
+    """
+
+    conn = make_conn()
+    for body in requests:
+        start = time.perf_counter()
+        try:
+            conn.request('POST', '/diagnose', body,
+                         {'Content-Type':'application/json'})
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = make_conn()
+            status = None
+        elapsed = time.perf_counter() - start
+
+        with lock:
+            if 200 == status:
+                latencies.append(elapsed)
+            counts[status] = counts.get(status, 0) + 1
+
+    conn.close()
+
+
+###############################################################################
+def run(make_conn, records, client_count, request_count, records_per_request):
+    """
+    Run the load test and print the results.
+    """
+
+    # split the requests among the clients, cycling through the records
+    bodies = []
+    for i in range(request_count):
+        start = (i * records_per_request) % len(records)
+        batch = [records[(start + j) % len(records)]
+                 for j in range(records_per_request)]
+        bodies.append(json.dumps(batch))
+
+    latencies = []
+    counts = {}
+    lock = threading.Lock()
+    threads = []
+    for k in range(client_count):
+        t = threading.Thread(target=_client,
+                             args=(make_conn, bodies[k::client_count],
+                                   latencies, counts, lock))
+        threads.append(t)
+
+    start_time = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start_time
+
+    latencies.sort()
+    ok_count = counts.get(200, 0)
+    print('Load test summary: ')
+    print('\tClients      : {0:>9}'.format(client_count))
+    print('\tRequests     : {0:>9}'.format(request_count))
+    print('\tSucceeded    : {0:>9}'.format(ok_count))
+    print('\tRefused      : {0:>9}'.format(counts.get(503, 0)))
+    print('\tFailed       : {0:>9}'.
+          format(request_count - ok_count - counts.get(503, 0)))
+    print('\tElapsed      : {0:>9.3f} s'.format(elapsed))
+    print('\tRecords/sec  : {0:>9.1f}'.
+          format(ok_count * records_per_request / elapsed))
+    for pct in [50, 90, 99, 100]:
+        print('\tLatency p{0:<3} : {1:>9.1f} ms'.
+              format(pct, 1000.0 * _percentile(latencies, pct)))
+
+    conn = make_conn()
+    conn.request('GET', '/stats')
+    stats = json.loads(conn.getresponse().read())
+    conn.close()
+    print('Service stats: ')
+    for k,v in stats.items():
+        print('\t{0:<16} : {1}'.format(k, v))
+
+
+###############################################################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='load test for the diagnosis service')
+
+    parser.add_argument('-v', '--version',
+                        action='store_true',
+                        help='print version to stdout and then exit')
+    parser.add_argument('-f', '--file',
+                        dest='filepath',
+                        help='SET-NET CSV file of patient records')
+    parser.add_argument('--host',
+                        default=DEFAULT_HOST,
+                        help='service host, default {0}'.
+                        format(DEFAULT_HOST))
+    parser.add_argument('--port',
+                        type=int,
+                        default=DEFAULT_PORT,
+                        help='service port, default {0}'.
+                        format(DEFAULT_PORT))
+    parser.add_argument('--socket',
+                        dest='socket_path',
+                        help='connect to this Unix socket instead of TCP')
+    parser.add_argument('--clients',
+                        type=int,
+                        default=8,
+                        help='number of concurrent clients, default 8')
+    parser.add_argument('--requests',
+                        type=int,
+                        default=1000,
+                        help='total number of requests, default 1000')
+    parser.add_argument('--records-per-request',
+                        type=int,
+                        default=1,
+                        help='records in each request, default 1')
+
+    args = parser.parse_args()
+
+    if args.version:
+        print(get_version())
+        sys.exit(0)
+
+    if args.filepath is None or not os.path.isfile(args.filepath):
+        print('\n*** Missing or invalid --file argument ***')
+        sys.exit(-1)
+
+    records = read_records(args.filepath)
+    if 0 == len(records):
+        print('\n*** No records found in "{0}" ***'.format(args.filepath))
+        sys.exit(-1)
+
+    if args.socket_path is not None:
+        make_conn = lambda: _UnixHTTPConnection(args.socket_path)
+    else:
+        make_conn = lambda: http.client.HTTPConnection(args.host, args.port,
+                                                       timeout=60)
+
+    run(make_conn, records, args.clients, args.requests,
+        args.records_per_request)
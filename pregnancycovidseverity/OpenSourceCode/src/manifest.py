@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+
+Manifest of processed patients, for incremental runs over monthly extracts.
+
+Each monthly extract contains mostly the same patients as the previous one,
+with only a few edited fields. The manifest records, for each patient id, a
+hash of the row fields used for the diagnosis together with the extracted
+features and the diagnosis. A later run can then skip the finders for any
+row whose hash is unchanged and carry the prior results forward.
+
+The manifest is a JSON lines file. The first line is a header containing the
+versions of all modules that affect the results and the run settings that
+change the saved features; if these do not match those of the running code,
+the manifest is ignored and every row is processed again. Each remaining line
+holds the entry for a single patient.
+
+The raw text fields are not stored in the manifest. A row can only be reused
+if its texts are unchanged, so the 'text_list' field is rebuilt from the row.
+
+All entries are kept in memory for the whole run, so the features of each
+entry are loaded as a tuple of values in FEATURE_FIELDS order rather than as
+a dict, and equal values (such as dates) are shared among all entries.
+
+"""
+
+import os
+import json
+import hashlib
+from collections import namedtuple
+
+from . import diagnose_covid as dc
+
+MANIFEST_ENTRY_FIELDS = [
+    'row_hash',
+    'diagnosis',
+    'features',         # tuple of the values of the FEATURE_FIELDS
+]
+ManifestEntry = namedtuple('ManifestEntry', MANIFEST_ENTRY_FIELDS)
+
+# the PatientData fields stored in the manifest, all except 'text_list'
+FEATURE_FIELDS = [f for f in dc.PATIENT_DATA_FIELDS if 'text_list' != f]
+_TEXT_LIST_INDEX = dc.PATIENT_DATA_FIELDS.index('text_list')
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 4
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def row_hash(values):
+    """
+    Return a hex digest of a sequence of field values from a single row.
+    """
+
+    h = hashlib.blake2b(digest_size=16)
+    for v in values:
+        h.update(v.encode('utf-8'))
+        # separate the fields so that ('ab', 'c') and ('a', 'bc') differ
+        h.update(b'\x00')
+
+    return h.hexdigest()
+
+
+###############################################################################
+def encode_features(patient_data):
+    """
+    Convert a PatientData namedtuple to a JSON-serializable dict.
+    """
+
+    features = {}
+    for k,v in patient_data._asdict().items():
+        if 'text_list' == k:
+            continue
+        features[k] = v
+
+    return features
+
+
+###############################################################################
+def _compact_features(features, shared_values):
+    """
+    Convert a dict of features to a tuple of values in FEATURE_FIELDS order.
+    Each hashable value is replaced by an equal value of the same type from
+    'shared_values', if any, so that repeated values are only stored once.
+    """
+
+    values = []
+    for field in FEATURE_FIELDS:
+        v = features[field]
+        if not isinstance(v, list):
+            # the type is part of the key, since True == 1 == 1.0
+            v = shared_values.setdefault((type(v), v), v)
+        values.append(v)
+
+    return tuple(values)
+
+
+###############################################################################
+def decode_features(features, text_list):
+    """
+    Rebuild a PatientData namedtuple from a tuple of features and the text
+    fields of the current row.
+    """
+
+    values = list(features)
+    values.insert(_TEXT_LIST_INDEX, text_list)
+
+    return dc.PatientData(*values)
+
+
+###############################################################################
+def load(manifest_file, versions):
+    """
+    Load a manifest file and return a dict mapping patient id to a
+    ManifestEntry. Returns an empty dict if the file does not exist or was
+    written by different versions of the code or with different settings.
+    """
+
+    entries = {}
+    if manifest_file is None or not os.path.isfile(manifest_file):
+        return entries
+
+    shared_values = {}
+
+    with open(manifest_file, 'rt', encoding='utf-8') as infile:
+        header = json.loads(infile.readline())
+        if header.get('versions') != versions:
+            print('Manifest "{0}" was written by different module versions ' \
+                  'or settings, all rows will be processed.'.
+                  format(manifest_file))
+            return entries
+
+        for line in infile:
+            d = json.loads(line)
+            entries[d['id']] = ManifestEntry(
+                row_hash  = d['hash'],
+                diagnosis = d['diagnosis'],
+                features  = _compact_features(d['features'], shared_values),
+            )
+
+    if _TRACE:
+        print('Loaded {0} entries from manifest "{1}"'.
+              format(len(entries), manifest_file))
+
+    return entries
+
+
+###############################################################################
+class ManifestWriter(object):
+    """
+    Writes a new manifest to a temporary file, then replaces the manifest file
+    with it on close. An interrupted run leaves the previous manifest intact.
+    """
+
+    def __init__(self, manifest_file, versions):
+        self.manifest_file = manifest_file
+        self.tmp_file = manifest_file + '.tmp'
+
+        manifest_dir = os.path.dirname(manifest_file)
+        if len(manifest_dir) > 0:
+            os.makedirs(manifest_dir, exist_ok=True)
+
+        self.outfile = open(self.tmp_file, 'wt', encoding='utf-8')
+        self.outfile.write(json.dumps({'versions':versions}) + '\n')
+
+    def add(self, user_id, hash_value, diagnosis, patient_data):
+        d = {
+            'id'        : user_id,
+            'hash'      : hash_value,
+            'diagnosis' : diagnosis,
+            'features'  : encode_features(patient_data),
+        }
+        self.outfile.write(json.dumps(d) + '\n')
+
+    def close(self):
+        self.outfile.flush()
+        os.fsync(self.outfile.fileno())
+        self.outfile.close()
+        os.replace(self.tmp_file, self.manifest_file)
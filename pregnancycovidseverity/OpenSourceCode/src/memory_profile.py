@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+
+Opt-in memory accounting for the stages of the SET-NET driver.
+
+A large extract can use more memory than the machine has, and the process is
+then killed without saying which data was responsible: the spaCy docs, the
+text plans of a chunk, the O2 lists kept for the debug output, or the
+results held for the output writer. A MemoryProfile records:
+
+    - For each stage of the work (csv_parse, text_plan, segmentation,
+      finders, diagnosis, output), the number of calls, the memory that
+      is still allocated when the stage ends (net), and the peak above
+      the memory at the start of the stage, from the tracemalloc module.
+      The peak is taken over the calls that ran alone (see below).
+
+    - The peak resident set size (RSS) of each worker process.
+
+    - The memory retained by the main process for each patient written,
+      from the traced memory since the start of the run.
+
+    - The allocation sites that hold the most memory at the end of each
+      shard and of the run, from tracemalloc snapshots taken at the start
+      and the end.
+
+Tracing slows the run down considerably, so it is enabled only if 'trace'
+is True. A profile with a 'budget_mb' but without tracing checks the RSS
+only. The RSS is checked at the end of each stage, and a MemoryBudgetError
+with the memory report is raised as soon as it exceeds the budget.
+
+The stages of the threaded pipeline in pipeline.run overlap in time, so the
+net figures of a stage include allocations made by the other stages while
+it was running. The tracemalloc peak is a single value for the whole
+process, and resetting it for one stage would hide the peaks of the others,
+so the peak is only recorded for a call of a stage if no other stage ran at
+any time during the call. The report shows the number of these calls, and
+'-' for a stage without any; the peak RSS is then the only peak figure for
+the run. The stages of the shard workers do not overlap, since each worker
+diagnoses one shard at a time, so all of their calls have a peak.
+
+Like metrics.py, the figures are recorded into the current MemoryProfile
+of the process (see 'use'). A worker process records each shard into a new
+MemoryProfile, which is returned with the results of the shard and merged
+into the MemoryProfile of the main process.
+
+"""
+
+import os
+import sys
+import platform
+import threading
+import tracemalloc
+from contextlib import nullcontext
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# stage names; csv_parse, segmentation, diagnosis, and output match metrics.py
+STAGE_CSV_PARSE    = 'csv_parse'
+STAGE_TEXT_PLAN    = 'text_plan'
+STAGE_SEGMENTATION = 'segmentation'
+STAGE_FINDERS      = 'finders'
+STAGE_DIAGNOSIS    = 'diagnosis'
+STAGE_OUTPUT       = 'output'
+
+STAGES = [
+    STAGE_CSV_PARSE, STAGE_TEXT_PLAN, STAGE_SEGMENTATION, STAGE_FINDERS,
+    STAGE_DIAGNOSIS, STAGE_OUTPUT,
+]
+
+# number of allocation sites in the report
+TOP_SITES = 10
+
+# number of stack frames kept by tracemalloc for each allocation
+TRACE_FRAMES = 1
+
+_MB = 1024.0 * 1024.0
+
+# the context returned by 'stage' when there is no current MemoryProfile
+_NULL_CONTEXT = nullcontext()
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 2
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+class MemoryBudgetError(RuntimeError):
+    """
+    Raised when the RSS of a process exceeds the memory budget.
+    """
+    pass
+
+
+###############################################################################
+def worker_name():
+    """
+    Return a name for this process that is unique across machines.
+    """
+
+    return '{0}:{1}'.format(platform.node(), os.getpid())
+
+
+###############################################################################
+def peak_rss_bytes():
+    """
+    Return the peak RSS of this process in bytes, or None if unknown.
+    """
+
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in bytes on macOS, kilobytes elsewhere
+    if 'darwin' == sys.platform:
+        return max_rss
+    return max_rss * 1024
+
+
+###############################################################################
+def rss_bytes():
+    """
+    Return the current RSS of this process in bytes, falling back to the
+    peak RSS where the current RSS is not available.
+    """
+
+    try:
+        with open('/proc/self/statm', 'rt') as infile:
+            resident_pages = int(infile.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_rss_bytes()
+
+
+###############################################################################
+def _take_snapshot():
+    snapshot = tracemalloc.take_snapshot()
+    return snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ])
+
+
+###############################################################################
+class MemoryProfile(object):
+    """
+    Memory figures for the stages of the work in one or more processes.
+    Safe to update from several threads.
+    """
+
+    def __init__(self, trace=True, budget_mb=None):
+        self.trace = trace
+        self.budget_mb = budget_mb
+
+        # [calls, net bytes, max peak bytes, calls with a peak] keyed by
+        # stage name
+        self.stages = {}
+
+        # peak RSS in bytes keyed by worker name
+        self.peak_rss = {}
+
+        # (size, count) of the allocations live at the end of a shard or a
+        # run, keyed by 'file:line'; the largest value seen is kept
+        self.sites = {}
+
+        # memory retained by the main process, and the patient count
+        self.retained_bytes = 0
+        self.max_retained_bytes = 0
+        self.patient_count = 0
+
+        self._lock = threading.Lock()
+        # number of stages running, and of the stages begun while another
+        # was running, for telling whether a call of a stage ran alone
+        self._active = 0
+        self._overlaps = 0
+        self._start_current = 0
+        self._start_snapshot = None
+        self._started_tracing = False
+
+    def __getstate__(self):
+        # the lock and the snapshot are not sent to the main process
+        state = dict(self.__dict__)
+        del state['_lock']
+        state['_start_snapshot'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start tracing, if enabled and not already started, and take the
+        snapshot that the allocation sites are compared to.
+        """
+
+        if not self.trace:
+            return
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            self._started_tracing = True
+        self._start_current = tracemalloc.get_traced_memory()[0]
+        self._start_snapshot = _take_snapshot()
+
+    def stop(self):
+        """
+        Record the allocation sites and the peak RSS of this process, and
+        stop tracing if it was started by 'start'.
+        """
+
+        if self._start_snapshot is not None:
+            snapshot = _take_snapshot()
+            diffs = snapshot.compare_to(self._start_snapshot, 'lineno')
+            diffs = [diff for diff in diffs if diff.size_diff > 0]
+            diffs.sort(key=lambda diff: -diff.size_diff)
+            with self._lock:
+                for diff in diffs[:TOP_SITES]:
+                    frame = diff.traceback[0]
+                    self._add_site('{0}:{1}'.format(frame.filename, frame.lineno),
+                                   diff.size_diff, diff.count_diff)
+            self._start_snapshot = None
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        self.record_rss()
+
+    def _add_site(self, site, size, count):
+        prev_size, prev_count = self.sites.get(site, (0, 0))
+        if size > prev_size:
+            self.sites[site] = (size, count)
+
+    def record_rss(self):
+        """
+        Record the peak RSS of this process.
+        """
+
+        peak = peak_rss_bytes()
+        if peak is not None:
+            with self._lock:
+                name = worker_name()
+                self.peak_rss[name] = max(peak, self.peak_rss.get(name, 0))
+
+    def begin(self, stage):
+        """
+        Return the state at the start of a stage, for 'end'. The state is a
+        tuple of the traced memory, the overlap count, and whether no other
+        stage is running, or None if tracing is off.
+        """
+
+        if not self.trace or not tracemalloc.is_tracing():
+            return None
+
+        with self._lock:
+            self._active += 1
+            alone = 1 == self._active
+            if alone:
+                # the peak is only reset when it cannot belong to another stage
+                tracemalloc.reset_peak()
+            else:
+                self._overlaps += 1
+            current = tracemalloc.get_traced_memory()[0]
+            return (current, self._overlaps, alone)
+
+    def _release(self, state):
+        """
+        Return True if the call of a stage with the 'begin' state ran alone.
+        """
+
+        with self._lock:
+            self._active -= 1
+            start_current, overlaps, alone = state
+            return alone and overlaps == self._overlaps
+
+    def cancel(self, stage, state):
+        """
+        Forget a call of a stage that began with 'begin' but did not finish.
+        """
+
+        if state is not None:
+            self._release(state)
+
+    def end(self, stage, state):
+        """
+        Record a call of a stage that began with 'begin', and check the RSS
+        against the budget.
+        """
+
+        net = 0
+        peak = None
+        if state is not None:
+            alone = self._release(state)
+            if tracemalloc.is_tracing():
+                current, traced_peak = tracemalloc.get_traced_memory()
+                net = current - state[0]
+                if alone:
+                    peak = max(0, traced_peak - state[0])
+
+        with self._lock:
+            figures = self.stages.get(stage)
+            if figures is None:
+                figures = [0, 0, 0, 0]
+                self.stages[stage] = figures
+            figures[0] += 1
+            figures[1] += net
+            if peak is not None:
+                figures[2] = max(figures[2], peak)
+                figures[3] += 1
+
+        self.check_budget(stage)
+
+    def record_patients(self, patient_count):
+        """
+        Record the memory retained by this process since 'start' after
+        'patient_count' patients have been written.
+        """
+
+        self.patient_count = patient_count
+        if self.trace and tracemalloc.is_tracing():
+            retained = tracemalloc.get_traced_memory()[0] - self._start_current
+            self.retained_bytes = retained
+            self.max_retained_bytes = max(self.max_retained_bytes, retained)
+
+    def check_budget(self, stage=None):
+        """
+        Raise a MemoryBudgetError if the RSS of this process exceeds the
+        budget.
+        """
+
+        if self.budget_mb is None:
+            return
+
+        rss = rss_bytes()
+        if rss is None or rss <= self.budget_mb * _MB:
+            return
+
+        self.stop()
+        where = ''
+        if stage is not None:
+            where = ' after stage "{0}"'.format(stage)
+        raise MemoryBudgetError(
+            'memory budget of {0} MB exceeded{1}: RSS is {2:.1f} MB in ' \
+            'process {3}\n{4}'.format(self.budget_mb, where, rss / _MB,
+                                      worker_name(), self.report()))
+
+    def merge(self, other):
+        """
+        Add the figures from the MemoryProfile of a worker to this one.
+        """
+
+        with self._lock:
+            for stage, (calls, net, peak, peak_calls) in other.stages.items():
+                figures = self.stages.get(stage)
+                if figures is None:
+                    figures = [0, 0, 0, 0]
+                    self.stages[stage] = figures
+                figures[0] += calls
+                figures[1] += net
+                figures[2] = max(figures[2], peak)
+                figures[3] += peak_calls
+            for name, peak in other.peak_rss.items():
+                self.peak_rss[name] = max(peak, self.peak_rss.get(name, 0))
+            for site, (size, count) in other.sites.items():
+                self._add_site(site, size, count)
+
+    def _stage_names(self):
+        names = [s for s in STAGES if s in self.stages]
+        names.extend(sorted([s for s in self.stages if s not in STAGES]))
+        return names
+
+    def report(self):
+        """
+        Return a printable summary of the memory figures.
+        """
+
+        lines = ['Memory profile summary: ']
+        if self.trace:
+            lines.append('\t{0:<16} {1:>9} {2:>10} {3:>10} {4:>10}'.
+                         format('stage', 'calls', 'net MB', 'peak calls',
+                                'peak MB'))
+            for stage in self._stage_names():
+                calls, net, peak, peak_calls = self.stages[stage]
+                peak_mb = '-'
+                if peak_calls > 0:
+                    peak_mb = '{0:.1f}'.format(peak / _MB)
+                lines.append('\t{0:<16} {1:>9} {2:>10.1f} {3:>10} {4:>10}'.
+                             format(stage, calls, net / _MB, peak_calls,
+                                    peak_mb))
+
+        if self.trace and self.patient_count > 0:
+            per_patient = self.retained_bytes / self.patient_count
+            lines.append('\tRetained     : {0:>9.1f} MB for {1} patients ' \
+                         '({2:.0f} bytes per patient), max {3:.1f} MB'.
+                         format(self.retained_bytes / _MB, self.patient_count,
+                                per_patient, self.max_retained_bytes / _MB))
+
+        for name in sorted(self.peak_rss):
+            lines.append('\tPeak RSS     : {0:>9.1f} MB ({1})'.
+                         format(self.peak_rss[name] / _MB, name))
+
+        if len(self.sites) > 0:
+            lines.append('\tTop allocation sites: ')
+            top = sorted(self.sites.items(), key=lambda item: -item[1][0])
+            for site, (size, count) in top[:TOP_SITES]:
+                lines.append('\t\t{0:>9.1f} MB {1:>9} blocks  {2}'.
+                             format(size / _MB, count, site))
+
+        return '\n'.join(lines)
+
+
+# the MemoryProfile that is updated by 'begin' and 'end', or None
+_current = None
+
+
+###############################################################################
+def current():
+    """
+    Return the current MemoryProfile of this process, or None.
+    """
+
+    return _current
+
+
+###############################################################################
+def use(profile):
+    """
+    Make 'profile' the current MemoryProfile, and return the previous one so
+    that it can be restored. Use None to disable profiling.
+    """
+
+    global _current
+    previous = _current
+    _current = profile
+    return previous
+
+
+###############################################################################
+def begin(stage):
+    """
+    Return the state at the start of a stage of the current MemoryProfile,
+    for 'end'. No state is kept for a 'stage' of None.
+    """
+
+    if _current is None or stage is None:
+        return None
+    return _current.begin(stage)
+
+
+###############################################################################
+def end(stage, state):
+    """
+    Record a call of a stage of the current MemoryProfile.
+    """
+
+    if _current is not None:
+        _current.end(stage, state)
+
+
+###############################################################################
+class _StageContext(object):
+
+    def __init__(self, profile, stage):
+        self.profile = profile
+        self.stage = stage
+
+    def __enter__(self):
+        self.state = self.profile.begin(self.stage)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.profile.end(self.stage, self.state)
+        else:
+            self.profile.cancel(self.stage, self.state)
+        return False
+
+
+###############################################################################
+def stage(name):
+    """
+    Return a context manager that records a call of a stage of the current
+    MemoryProfile, or does nothing if there is none.
+    """
+
+    if _current is None:
+        return _NULL_CONTEXT
+    return _StageContext(_current, name)
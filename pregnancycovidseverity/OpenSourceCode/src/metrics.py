@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+
+Timing and throughput metrics for the stages of the SET-NET driver.
+
+The driver records the time of each call of each stage, and counts of the
+rows, texts, sentences, and result cache lookups:
+
+    csv_parse               reading and parsing a chunk of CSV rows
+    segmentation            segmenting a batch of texts into sentences
+    symptom_finder          running symptom_finder on a single text
+    o2sat_finder            running o2sat_finder on a single text
+    covid_diagnosis_finder  running covid_diagnosis_finder on a single text
+    diagnosis               combining the results for a row and diagnosing it
+    output                  writing the results for a chunk of rows
+
+The times are kept in histograms with fixed bucket bounds from 1 us to 100 s,
+so that the percentiles can be estimated without keeping every sample, the
+metrics from several worker processes can be merged, and the histograms can
+be exported in the Prometheus text format.
+
+The metrics are recorded into the current Metrics object of the process (see
+'use'). A worker process records each shard into a new Metrics object, which
+is returned with the results of the shard and merged into the Metrics of
+the main process.
+
+A Progress object prints a progress line with the rate and the estimated
+time remaining every 'interval_s' seconds.
+
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+
+# stage names
+STAGE_CSV_PARSE    = 'csv_parse'
+STAGE_SEGMENTATION = 'segmentation'
+STAGE_SYMPTOM      = 'symptom_finder'
+STAGE_O2           = 'o2sat_finder'
+STAGE_COVID        = 'covid_diagnosis_finder'
+STAGE_DIAGNOSIS    = 'diagnosis'
+STAGE_OUTPUT       = 'output'
+
+STAGES = [
+    STAGE_CSV_PARSE, STAGE_SEGMENTATION, STAGE_SYMPTOM, STAGE_O2,
+    STAGE_COVID, STAGE_DIAGNOSIS, STAGE_OUTPUT,
+]
+
+# counter names
+COUNTER_ROWS         = 'rows'
+COUNTER_TEXTS        = 'texts'
+COUNTER_SENTENCES    = 'sentences'
+COUNTER_CACHE_HITS   = 'cache_hits'
+COUNTER_CACHE_MISSES = 'cache_misses'
+
+COUNTERS = [
+    COUNTER_ROWS, COUNTER_TEXTS, COUNTER_SENTENCES, COUNTER_CACHE_HITS,
+    COUNTER_CACHE_MISSES,
+]
+
+# upper bounds of the histogram buckets in seconds, 1-2-5 steps per decade
+BUCKET_BOUNDS = [m * 10.0**e for e in range(-6, 2) for m in [1, 2, 5]] + [100.0]
+
+# print a progress line this often, in seconds
+PROGRESS_INTERVAL_S = 30.0
+
+# prefix for the Prometheus metric names
+_PROMETHEUS_PREFIX = 'setnet'
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 1
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+class Histogram(object):
+    """
+    Counts of durations in the BUCKET_BOUNDS buckets, with their sum and max.
+    The last bucket counts the durations above the largest bound.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, pct):
+        """
+        Estimate a percentile by linear interpolation within its bucket.
+        """
+
+        if 0 == self.count:
+            return 0.0
+
+        target = pct / 100.0 * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            if c > 0 and cumulative + c >= target:
+                lower = 0.0
+                if i > 0:
+                    lower = BUCKET_BOUNDS[i - 1]
+                upper = self.max
+                if i < len(BUCKET_BOUNDS):
+                    upper = min(BUCKET_BOUNDS[i], self.max)
+                fraction = (target - cumulative) / c
+                return min(self.max, lower + fraction * max(0.0, upper - lower))
+            cumulative += c
+
+        return self.max
+
+    def to_dict(self):
+        mean = 0.0
+        if self.count > 0:
+            mean = self.total / self.count
+        return {
+            'calls'   : self.count,
+            'total_s' : self.total,
+            'mean_s'  : mean,
+            'p50_s'   : self.percentile(50),
+            'p90_s'   : self.percentile(90),
+            'p99_s'   : self.percentile(99),
+            'max_s'   : self.max,
+        }
+
+
+###############################################################################
+class Metrics(object):
+    """
+    Stage timings and counters. Safe to update from several threads.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {name:0 for name in COUNTERS}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # the lock cannot be pickled, for sending to the main process
+        return {'stages':self.stages, 'counters':self.counters}
+
+    def __setstate__(self, state):
+        self.stages = state['stages']
+        self.counters = state['counters']
+        self._lock = threading.Lock()
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = Histogram()
+                self.stages[stage] = histogram
+            histogram.add(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other):
+        """
+        Add the timings and counts from another Metrics object to this one.
+        """
+
+        with self._lock:
+            for stage, histogram in other.stages.items():
+                if stage not in self.stages:
+                    self.stages[stage] = Histogram()
+                self.stages[stage].merge(histogram)
+            for name, n in other.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def _stage_names(self):
+        # the known stages in pipeline order, then any others
+        names = [s for s in STAGES if s in self.stages]
+        names.extend(sorted([s for s in self.stages if s not in STAGES]))
+        return names
+
+    def to_dict(self, elapsed_s=None):
+        rows = self.counters.get(COUNTER_ROWS, 0)
+        rows_per_s = 0.0
+        if elapsed_s is not None and elapsed_s > 0.0:
+            rows_per_s = rows / elapsed_s
+        return {
+            'version'    : get_version(),
+            'elapsed_s'  : elapsed_s,
+            'rows'       : rows,
+            'rows_per_s' : rows_per_s,
+            'stages'     : {s:self.stages[s].to_dict() for s in self._stage_names()},
+            'counters'   : dict(self.counters),
+        }
+
+    def report(self):
+        """
+        Return a printable summary of the stage timings and counters.
+        """
+
+        lines = ['Stage timing summary: ']
+        lines.append('\t{0:<24} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9}'.
+                     format('stage', 'calls', 'total s', 'p50 ms', 'p90 ms',
+                            'p99 ms', 'max ms'))
+        for stage in self._stage_names():
+            h = self.stages[stage]
+            lines.append('\t{0:<24} {1:>9} {2:>9.3f} {3:>9.3f} {4:>9.3f} ' \
+                         '{5:>9.3f} {6:>9.3f}'.
+                         format(stage, h.count, h.total,
+                                1000.0 * h.percentile(50),
+                                1000.0 * h.percentile(90),
+                                1000.0 * h.percentile(99),
+                                1000.0 * h.max))
+        names = [c for c in COUNTERS if c in self.counters]
+        names.extend(sorted([c for c in self.counters if c not in COUNTERS]))
+        for name in names:
+            label = name.replace('_', ' ').capitalize()
+            lines.append('\t{0:<12} : {1:>9}'.format(label, self.counters[name]))
+
+        return '\n'.join(lines)
+
+
+# the Metrics object that is updated by 'add_time' and 'count'
+_current = Metrics()
+
+
+###############################################################################
+def current():
+    """
+    Return the current Metrics object of this process.
+    """
+
+    return _current
+
+
+###############################################################################
+def use(metrics_obj):
+    """
+    Make 'metrics_obj' the current Metrics object, and return the previous
+    one so that it can be restored.
+    """
+
+    global _current
+    previous = _current
+    _current = metrics_obj
+    return previous
+
+
+###############################################################################
+def add_time(stage, seconds):
+    """
+    Record the duration of a single call of a stage.
+    """
+
+    _current.add_time(stage, seconds)
+
+
+###############################################################################
+def count(name, n=1):
+    """
+    Add 'n' to a counter.
+    """
+
+    _current.count(name, n)
+
+
+###############################################################################
+def _write_atomic(filename, text):
+    """
+    Write a file by renaming a temporary file, so that a reader (such as the
+    node exporter) never sees a partial file.
+    """
+
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, 'wt', encoding='utf-8') as outfile:
+        outfile.write(text)
+    os.replace(tmp_file, filename)
+
+
+###############################################################################
+def write_json(metrics_obj, filename, elapsed_s=None):
+    """
+    Write the metrics to a JSON file.
+    """
+
+    _write_atomic(filename, json.dumps(metrics_obj.to_dict(elapsed_s),
+                                       indent=4) + '\n')
+    print('Wrote metrics file "{0}"'.format(filename))
+
+
+###############################################################################
+def write_prometheus(metrics_obj, filename, elapsed_s=None):
+    """
+    Write the metrics in the Prometheus text format, for the textfile
+    collector of the node exporter.
+    """
+
+    p = _PROMETHEUS_PREFIX
+    lines = []
+
+    lines.append('# HELP {0}_stage_seconds Duration of each call of a pipeline stage.'.format(p))
+    lines.append('# TYPE {0}_stage_seconds histogram'.format(p))
+    for stage in metrics_obj._stage_names():
+        h = metrics_obj.stages[stage]
+        cumulative = 0
+        for bound, c in zip(BUCKET_BOUNDS, h.counts):
+            cumulative += c
+            lines.append('{0}_stage_seconds_bucket{{stage="{1}",le="{2:g}"}} {3}'.
+                         format(p, stage, bound, cumulative))
+        lines.append('{0}_stage_seconds_bucket{{stage="{1}",le="+Inf"}} {2}'.
+                     format(p, stage, h.count))
+        lines.append('{0}_stage_seconds_sum{{stage="{1}"}} {2:.6f}'.
+                     format(p, stage, h.total))
+        lines.append('{0}_stage_seconds_count{{stage="{1}"}} {2}'.
+                     format(p, stage, h.count))
+
+    lines.append('# HELP {0}_events_total Counts of rows, texts, sentences, and cache lookups.'.format(p))
+    lines.append('# TYPE {0}_events_total counter'.format(p))
+    for name, n in metrics_obj.counters.items():
+        lines.append('{0}_events_total{{event="{1}"}} {2}'.format(p, name, n))
+
+    if elapsed_s is not None:
+        d = metrics_obj.to_dict(elapsed_s)
+        lines.append('# HELP {0}_run_seconds Elapsed time of the last run.'.format(p))
+        lines.append('# TYPE {0}_run_seconds gauge'.format(p))
+        lines.append('{0}_run_seconds {1:.3f}'.format(p, elapsed_s))
+        lines.append('# HELP {0}_rows_per_second Throughput of the last run.'.format(p))
+        lines.append('# TYPE {0}_rows_per_second gauge'.format(p))
+        lines.append('{0}_rows_per_second {1:.3f}'.format(p, d['rows_per_s']))
+
+    _write_atomic(filename, '\n'.join(lines) + '\n')
+    print('Wrote Prometheus metrics file "{0}"'.format(filename))
+
+
+###############################################################################
+def _format_duration(seconds):
+    seconds = int(round(seconds))
+    return '{0}:{1:02d}:{2:02d}'.format(seconds // 3600, (seconds // 60) % 60,
+                                        seconds % 60)
+
+
+###############################################################################
+class Progress(object):
+    """
+    Prints a progress line with the rate and the estimated time remaining at
+    most every 'interval_s' seconds. The 'total' is an estimate of the number
+    of rows, or None if unknown.
+    """
+
+    def __init__(self, total=None, interval_s=PROGRESS_INTERVAL_S):
+        self.total = total
+        self.interval_s = interval_s
+        self.start_time = time.perf_counter()
+        self._last_time = self.start_time
+
+    def update(self, done):
+        """
+        Report that 'done' rows are complete, printing a line if due.
+        """
+
+        if self.interval_s is None:
+            return
+
+        now = time.perf_counter()
+        if now - self._last_time < self.interval_s:
+            return
+        self._last_time = now
+
+        elapsed = now - self.start_time
+        rate = done / elapsed
+        line = 'Progress: {0} rows'.format(done)
+        if self.total is not None and self.total > 0:
+            # the total is an estimate, so do not report more than 100%
+            total = max(self.total, done)
+            line += ' of ~{0} ({1:.1f}%)'.format(total, 100.0 * done / total)
+        line += ', {0:.1f} rows/sec, elapsed {1}'.format(rate,
+                                                         _format_duration(elapsed))
+        if self.total is not None and rate > 0.0:
+            remaining = max(0, self.total - done) / rate
+            line += ', ETA {0}'.format(_format_duration(remaining))
+        print(line)
@@ -118,7 +118,9 @@ import os
 import re
 import sys
 import json
+import bisect
 import argparse
+import numpy as np
 from collections import namedtuple
 
 if __name__ == '__main__':
@@ -133,6 +135,7 @@ if __name__ == '__main__':
         sys.exit(0)
 
 from . import finder_overlap as overlap
+from . import explain
 
 # default value for all fields
 EMPTY_FIELD = None
@@ -146,6 +149,20 @@ STR_O2_GTE            = 'GREATER_THAN_OR_EQUAL'
 STR_O2_EQUAL          = 'EQUAL'
 STR_O2_RANGE          = 'RANGE'
 
+# values for the 'device_type' field in the result namedtuple
+DEVICE_TYPE_NONE      = 0
+DEVICE_TYPE_NC        = 1   # nasal cannula
+DEVICE_TYPE_HFNC      = 2   # high-flow nasal cannula
+DEVICE_TYPE_NRB       = 3   # non-rebreather mask
+DEVICE_TYPE_RA        = 4   # room air (r.a.)
+DEVICE_TYPE_VENTURI   = 5   # venturi mask
+DEVICE_TYPE_BVM       = 6   # bag valve mask
+DEVICE_TYPE_BIPAP     = 7
+DEVICE_TYPE_MASK      = 8   # other masks and ventilators
+DEVICE_TYPE_AIR       = 9   # room air
+DEVICE_TYPE_NASOCATH  = 10  # nasopharyngeal catheter
+DEVICE_TYPE_TENT      = 11  # face tent
+
 O2_TUPLE_FIELDS = [
     'sentence',
     'text',
@@ -160,6 +177,7 @@ O2_TUPLE_FIELDS = [
     'flow_rate',        # [L/min]
     'flow_rate2',        
     'device',
+    'device_type',      # DEVICE_TYPE_NC, DEVICE_TYPE_HFNC, etc.
     'condition',        # STR_APPROX, STR_LT, etc.
     'value',            # [%] (O2 saturation value)
     'value2',           # [%] (second O2 saturation value for ranges)
@@ -173,13 +191,18 @@ O2Tuple = namedtuple('O2Tuple', O2_TUPLE_FIELDS)
 ###############################################################################
 
 _VERSION_MAJOR = 0
-_VERSION_MINOR = 9
+_VERSION_MINOR = 20
 
 # set to True to enable debug output
 _TRACE = False
 
-# connectors between portions of the regexes below; either symbols or words
-_str_cond = r'(?P<cond>(~=|>=|<=|[-/:<>=~\s.@^]+|\s[a-z\s]+)+)?'
+# finder name for the explain records
+_FINDER = 'o2sat_finder'
+
+# connectors between portions of the regexes below; either symbols or words,
+# each word following whitespace; every connector string has a single split
+# into these pieces, so a failed match backtracks in linear time
+_str_cond = r'(?P<cond>([-/:<>=~.@^]|\s[a-z]*)+)?'
 
 # words, possibly hyphenated or abbreviated, nongreedy match
 _str_words = r'([-a-z\s./:~]+?)?'
@@ -277,76 +300,72 @@ _str_device_air = r'\b(?P<air>(?<![a-z])(room[-\s]air|(?<!in the )air))(?!way)'
 _str_device_nasocath = r'\b(?P<nasocath>(naso[-\.\s]?(pharyngeal)?'     +\
     r'[-\s]?cath\.?(eter)?))'
 
-##### Functions to convert an O2 flow rate into an estimated FiO2 value. #####
-
-def _to_fio2_nc(flow_rate_l_min):
-    """
-    Convert an O2 flow rate to an estimated FiO2 value for a nasal cannula.
-    Return FiO2 as a percentage.
-    """
-
-    fio2_est = EMPTY_FIELD
-    if flow_rate_l_min >= 1 and flow_rate_l_min <= 10:
-        fio2_est = 24 + 4*(flow_rate_l_min - 1)
-    return fio2_est
-
-def _to_fio2_nrb(flow_rate_l_min):
-    """
-    Convert an O2 flow rate to an estimated FiO2 value for a non-rebreather mask.
-    Return FiO2 as a percentage.
-    """
-
-    fio2_est = EMPTY_FIELD
-    if flow_rate_l_min >= 6 and flow_rate_l_min < 9:
-        fio2_est = 60 + 10 * (flow_rate_l_min - 6)
-    elif flow_rate_l_min >= 9 and flow_rate_l_min <= 10:
-        fio2_est = 90 + 5 * (flow_rate_l_min - 9)
-    return fio2_est
+##### Interpolation tables for estimating FiO2 and PaO2. #####
 
-def _to_fio2_venturi(flow_rate_l_min):
+class _InterpTable(object):
     """
-    Convert an O2 flow rate to an estimated FiO2 value for a venturi mask.
-    Return FiO2 as a percentage.
+    Piecewise-linear function given by its breakpoints, with the slope of
+    each segment precomputed. Lookups evaluate y0 + slope * (x - x0) on the
+    segment containing x, which is the form of the formulas above.
     """
 
-    fio2_est = EMPTY_FIELD
-    if flow_rate_l_min >=2 and flow_rate_l_min < 4:
-        fio2_est = 24 + 2*(flow_rate_l_min - 2)
-    elif flow_rate_l_min >= 4 and flow_rate_l_min < 6:
-        fio2_est = 28 + 1.5*(flow_rate_l_min - 4)
-    elif flow_rate_l_min >= 6 and flow_rate_l_min < 8:
-        fio2_est = 31 + 2 * (flow_rate_l_min - 6)
-    elif flow_rate_l_min >= 8 and flow_rate_l_min < 10:
-        fio2_est = 35 + 2.5 * (flow_rate_l_min - 8)
-    elif flow_rate_l_min >= 10 and flow_rate_l_min <= 15:
-        fio2_est = 40 + 4 * (flow_rate_l_min - 10)
-    return fio2_est
-
-def _to_fio2_mask(flow_rate_l_min):
+    def __init__(self, xs, ys):
+        assert len(xs) == len(ys) and len(xs) >= 2
+        self.xs = [float(x) for x in xs]
+        self.ys = [float(y) for y in ys]
+        self.slopes = [
+            (self.ys[i+1] - self.ys[i]) / (self.xs[i+1] - self.xs[i])
+            for i in range(len(self.xs) - 1)
+        ]
+        self.lo = self.xs[0]
+        self.hi = self.xs[-1]
+
+        self.x_array = np.array(self.xs)
+        self.y_array = np.array(self.ys)
+        self.slope_array = np.array(self.slopes)
+
+    def lookup(self, x):
+        """
+        Evaluate at a single value in the range [lo, hi].
+        """
+
+        i = bisect.bisect_right(self.xs, x) - 1
+        i = max(0, min(i, len(self.slopes) - 1))
+        return self.ys[i] + self.slopes[i] * (x - self.xs[i])
+
+    def lookup_array(self, x):
+        """
+        Evaluate at every value in a numpy array with values in [lo, hi].
+        """
+
+        i = np.searchsorted(self.x_array, x, side='right') - 1
+        i = np.clip(i, 0, len(self.slopes) - 1)
+        return self.y_array[i] + self.slope_array[i] * (x - self.x_array[i])
+
+
+# FiO2 (%) as a function of O2 flow rate (L/min) for each device; no estimate
+# is made for flow rates outside the range of the table
+_FIO2_TABLE_NC       = _InterpTable([1, 10], [24, 60])
+_FIO2_TABLE_NRB      = _InterpTable([6, 9, 10], [60, 90, 95])
+_FIO2_TABLE_VENTURI  = _InterpTable([2, 4, 6, 8, 10, 15], [24, 28, 31, 35, 40, 60])
+_FIO2_TABLE_MASK     = _InterpTable([5, 10], [35, 55])
+_FIO2_TABLE_NASOCATH = _InterpTable([4, 6], [40, 60])
+
+
+def _fio2_from_table(table, flow_rate_l_min):
     """
-    Convert an O2 flow rate to an estimated FiO2 value for a rebreather mask.
+    Convert an O2 flow rate to an estimated FiO2 value with the given table.
     Return FiO2 as a percentage.
     """
 
     fio2_est = EMPTY_FIELD
-    if flow_rate_l_min >= 5 and flow_rate_l_min <= 10:
-        return 35 + 4 * (flow_rate_l_min - 5)
-    return fio2_est
-
-def _to_fio2_nasocath(flow_rate_l_min):
-    """
-    Convert an O2 flow rate to an estimated FiO2 value for a nasopharyngeal
-    catheter.  Return FiO2 as a percentage.
-    """
-
-    fio2_est = EMPTY_FIELD
-    if flow_rate_l_min >= 4 and flow_rate_l_min <= 6:
-        return 40 + 10*(flow_rate_l_min - 4)
+    if flow_rate_l_min >= table.lo and flow_rate_l_min <= table.hi:
+        fio2_est = table.lookup(flow_rate_l_min)
     return fio2_est
 
     
 # all device capture group names are keys
-# each is mapped to an FiO2 conversion function taking O2 flow_rate as arg
+# each is mapped to an FiO2 table taking O2 flow_rate as arg
 _DEVICE_NC  = 'nc'
 _DEVICE_HFNC = 'hfnc'
 _DEVICE_NRB = 'nrb'
@@ -365,22 +384,44 @@ _DEVICES_WITH_FIO2_PCT = {
     _DEVICE_NRB, _DEVICE_VENTURI, _DEVICE_BIPAP, _DEVICE_MASK, _DEVICE_TENT
 }
 
-# maps a device to an FiO2 conversion/estimation function
+# maps a device to an FiO2 estimation table
 _DEVICE_MAP = {
-    _DEVICE_NC       : _to_fio2_nc,
+    _DEVICE_NC       : _FIO2_TABLE_NC,
     _DEVICE_HFNC     : None,
-    _DEVICE_NRB      : _to_fio2_nrb,
+    _DEVICE_NRB      : _FIO2_TABLE_NRB,
     _DEVICE_RA       : None,
-    _DEVICE_VENTURI  : _to_fio2_venturi,
+    _DEVICE_VENTURI  : _FIO2_TABLE_VENTURI,
     _DEVICE_BVM      : None,
     _DEVICE_BIPAP    : None,
-    _DEVICE_MASK     : _to_fio2_mask,
+    _DEVICE_MASK     : _FIO2_TABLE_MASK,
     _DEVICE_AIR      : None,
-    _DEVICE_NASOCATH : _to_fio2_nasocath,
+    _DEVICE_NASOCATH : _FIO2_TABLE_NASOCATH,
     _DEVICE_TENT     : None,
     _DEVICE_TENT2    : None,
 }
 
+# maps a device to its value for the 'device_type' field
+_DEVICE_TYPE_CODES = {
+    _DEVICE_NC       : DEVICE_TYPE_NC,
+    _DEVICE_HFNC     : DEVICE_TYPE_HFNC,
+    _DEVICE_NRB      : DEVICE_TYPE_NRB,
+    _DEVICE_RA       : DEVICE_TYPE_RA,
+    _DEVICE_VENTURI  : DEVICE_TYPE_VENTURI,
+    _DEVICE_BVM      : DEVICE_TYPE_BVM,
+    _DEVICE_BIPAP    : DEVICE_TYPE_BIPAP,
+    _DEVICE_MASK     : DEVICE_TYPE_MASK,
+    _DEVICE_AIR      : DEVICE_TYPE_AIR,
+    _DEVICE_NASOCATH : DEVICE_TYPE_NASOCATH,
+    _DEVICE_TENT     : DEVICE_TYPE_TENT,
+    _DEVICE_TENT2    : DEVICE_TYPE_TENT,
+}
+
+# maps a 'device_type' value to an FiO2 estimation table
+_DEVICE_TYPE_TABLES = {
+    _DEVICE_TYPE_CODES[k] : table for k, table in _DEVICE_MAP.items()
+    if table is not None
+}
+
 # master regex for all devices
 _str_device = r'\(?(o2\s?delivery\sdevice\s?:\s?)?(?P<device>' +\
     r'(' + _str_device_nc + r')'       + r'|' +\
@@ -399,6 +440,9 @@ _str_device = r'\(?(o2\s?delivery\sdevice\s?:\s?)?(?P<device>' +\
     r'\)?'
 _regex_device = re.compile(_str_device, re.IGNORECASE)
 
+# sentence ends for the cheap sentence splitter
+_regex_sentence_end = re.compile(r'(?<=[.!?])\s+')
+
 # character used to encode the device
 _DEVICE_ENC_CHAR = '|'
 
@@ -487,6 +531,16 @@ _SAO2_REGEXES = [
     _regex_device,
 ]
 
+# Keywords, at least one of which is found by every match of the SaO2
+# regexes: a saturation header, a word from one of the devices, or a flow
+# rate. This is a flat alternation of short literals, so the scan is linear
+# in the length of the text, unlike the SaO2 regexes themselves.
+_str_o2_keyword = r'(o2|oxygen|pox|sat|pulse ox|'                      +\
+    r'n\.?[cp](?![a-z])|n/c|cann?ula|prong|n\.?r\.?b|rebreather|'       +\
+    r'(?<![a-z])r\.?a(?![a-z])|radial|vent|b\.?v\.?m|bag|bipap|'         +\
+    r'\bf\.?m|rbm|mask|tent|\bair|naso|\d\s?l)'
+_regex_o2_keyword = re.compile(_str_o2_keyword, re.IGNORECASE)
+
 # o2 partial pressure (prevent captures of 'PaO2 / FiO2')
 _str_pao2 = r'\b(pao2|partial pressure of (oxygen|o2))(?!/)(?! /)' +\
     r'(' + _str_cond+ r')?' +  r'(?P<val>\d+)'
@@ -522,6 +576,78 @@ _str_pf_ratio = r'\b(pao2|p)\s?/\s?(fio2|f)(\s?ratio)?' +\
     r'(' + _str_cond + r')?' + r'(?P<val>\d+(\.\d+)?)'
 _regex_pf_ratio = re.compile(_str_pf_ratio, re.IGNORECASE)
 
+# Flowsheet lines, such as ventilator settings, are sequences of 'key: value'
+# pairs, for instance 'PEEP: 5 cmH2O   FiO2: 70%   SpO2: 98%'. Only the keys
+# in this map are recognized; each is mapped to the kind of value it holds.
+_FS_SPO2  = 'spo2'
+_FS_FIO2  = 'fio2'
+_FS_PAO2  = 'pao2'
+_FS_PF    = 'pf'
+_FS_PEEP  = 'peep'
+_FS_OTHER = 'other'
+_FLOWSHEET_KEYS = {
+    'spo2'             : _FS_SPO2,
+    'sao2'             : _FS_SPO2,
+    'o2'               : _FS_SPO2,
+    'o2 sat'           : _FS_SPO2,
+    'o2sat'            : _FS_SPO2,
+    'o2 sats'          : _FS_SPO2,
+    'o2sats'           : _FS_SPO2,
+    'fio2'             : _FS_FIO2,
+    'pao2'             : _FS_PAO2,
+    'pao2 / fio2'      : _FS_PF,
+    'pao2/fio2'        : _FS_PF,
+    'p/f'              : _FS_PF,
+    'peep'             : _FS_PEEP,
+    'vitals'           : _FS_OTHER,
+    'respiratory'      : _FS_OTHER,
+    'ventilator mode'  : _FS_OTHER,
+    'vt (set)'         : _FS_OTHER,
+    'vt (spontaneous)' : _FS_OTHER,
+    'rr (set)'         : _FS_OTHER,
+    'rr (spontaneous)' : _FS_OTHER,
+    'rr'               : _FS_OTHER,
+    'r'                : _FS_OTHER,
+    'hr'               : _FS_OTHER,
+    'p'                : _FS_OTHER,
+    'bp'               : _FS_OTHER,
+    't'                : _FS_OTHER,
+    'temp'             : _FS_OTHER,
+    'ps'               : _FS_OTHER,
+    'pip'              : _FS_OTHER,
+    'plateau'          : _FS_OTHER,
+    'rsbi'             : _FS_OTHER,
+    'rsbi deferred'    : _FS_OTHER,
+    've'               : _FS_OTHER,
+    'abg'              : _FS_OTHER,
+    'map'              : _FS_OTHER,
+}
+
+# a recognized key followed by a colon, longest keys first
+_str_flowsheet_key = r'(?<!\S)(?P<key>' +\
+    r'|'.join([re.escape(k) for k in
+               sorted(_FLOWSHEET_KEYS, key=len, reverse=True)]) +\
+    r')\s?:\s?'
+_regex_flowsheet_key = re.compile(_str_flowsheet_key, re.IGNORECASE)
+
+# values for each kind of key
+_FLOWSHEET_VALUES = {
+    _FS_SPO2  : re.compile(r'(?P<val>100|\d\d?)%?'),
+    _FS_FIO2  : re.compile(r'(?P<val>100|[2-9]\d)%?'),
+    _FS_PAO2  : re.compile(r'(?P<val>\d+)( mmhg)?', re.IGNORECASE),
+    _FS_PF    : re.compile(r'(?P<val>\d+)'),
+    _FS_PEEP  : re.compile(r'(?P<val>\d+)( cmh2o)?', re.IGNORECASE),
+    _FS_OTHER : re.compile(r'[-\w ./()<>=+]*'),
+}
+
+# anything that the general-purpose regexes could read as O2 information;
+# a flowsheet line with any of these in an 'other' value is not parsed as a
+# flowsheet
+_regex_flowsheet_unsafe = re.compile(
+    r'o2|02|sat|ox|air|%|(?<![.\d])\d+\s?l\b|lpm|nc\b|nrb|ra\b|hfnc|' +\
+    r'cannula|mask|vent|pap|rebreath|trach|tent|intub|bag|need|requir|room',
+    re.IGNORECASE)
+
 # convert SpO2 to PaO2
 # https://www.intensive.org/epic2/Documents/Estimation%20of%20PO2%20and%20FiO2.pdf
 _SPO2_TO_PAO2 = {
@@ -546,6 +672,11 @@ _SPO2_TO_PAO2 = {
     98:112,
     99:145
 }
+_PAO2_TABLE = _InterpTable(sorted(_SPO2_TO_PAO2.keys()),
+                           [_SPO2_TO_PAO2[k] for k in sorted(_SPO2_TO_PAO2.keys())])
+
+# stated FiO2 percentage in a device string, such as '50% venturi mask'
+_regex_fio2_pct = re.compile(r'(?P<pct>\d+)\s?%')
 
 # The minimum acceptable value for SpO2. Some Covid-19 patients have had O2
 # sats this low. Some hemoglobinopathies can cause SpO2 readings in the 70%
@@ -557,6 +688,26 @@ _MIN_SPO2_PCT = 50
 # Sometimes the 'cond' group captures too much.
 _COND_DISCARD_SET = {'sat', 'saturation', 'o2', 'oxygen'}
 
+# O2Tuple fields not repeated in the explain record for a result
+_EXPLAIN_SKIP_FIELDS = {'sentence', 'text', 'start', 'end'}
+
+# group names for the values of _extract_values
+_VALUE_GROUPS = {'val', 'val1', 'val2'}
+
+# Precomputed (group_name, group_index) tables for each regex, used to read
+# the values of the named groups without calling match.groupdict(). The
+# _VALUE_TABLES only have the _VALUE_GROUPS, the _DEVICE_TABLE only has the
+# device groups. The tables are keyed by id(regex), since hashing a compiled
+# regex hashes its entire compiled code.
+_GROUP_TABLES = {
+    id(regex):overlap.group_table(regex) for regex in _SAO2_REGEXES
+}
+_VALUE_TABLES = {
+    id(regex):overlap.group_table(regex, _VALUE_GROUPS)
+    for regex in [_regex_pao2, _regex_pf_ratio] + _FIO2_REGEXES
+}
+_DEVICE_TABLE = overlap.group_table(_regex_device, _DEVICE_MAP)
+
 
 ###############################################################################
 def enable_debug():
@@ -616,7 +767,7 @@ def _cond_to_string(str_cond):
 
 
 ###############################################################################
-def _estimate_fio2(flow_rate, device):
+def _estimate_fio2(flow_rate, device, sink=None):
     """
     Estimate the FiO2 value (fraction of inspired oxygen, as a percentage)
     from the given flow rate in L/min and device.
@@ -630,39 +781,35 @@ def _estimate_fio2(flow_rate, device):
     
     fio2_est = EMPTY_FIELD
     
-    if _TRACE:
-        print('Calling _estimate_fio2...')
-        print('\tflow_rate: {0}'.format(flow_rate))
-        print('\t   device: {0}'.format(device))
-    
     device_str, device_type = device.split('|')
     
-    if _TRACE:
-        print('\t   device_str: {0}'.format(device_str))
-        print('\t  device_type: {0}'.format(device_type))
-        
     if device_type not in _DEVICE_MAP:
-        if _TRACE: print('\tdevice type not in device map')
+        if sink is not None:
+            sink.add(_FINDER, explain.EVENT_NOTE, stage='fio2_est',
+                     text=device_str, reason='device type not in device map')
         return device_str, EMPTY_FIELD
 
     # can get FiO2 from stated percentage of nonrebreather mask
     if device_type in _DEVICES_WITH_FIO2_PCT:
-        match = re.search(r'(?P<pct>\d+)\s?%', device_str)
+        match = _regex_fio2_pct.search(device_str)
         if match:
             fio2_est = float(match.group('pct'))
     
     if fio2_est is None:
         if flow_rate is None:
-            if _TRACE: print('\t  no flow rate available, exiting...')
+            if sink is not None:
+                sink.add(_FINDER, explain.EVENT_NOTE, stage='fio2_est',
+                         text=device_str, reason='no flow rate for the device')
             return device_str, EMPTY_FIELD
         else:
-            for dt in _DEVICE_MAP:
-                if dt == device_type:
-                    # lookup a conversion function
-                    conversion_fn = _DEVICE_MAP[dt]
-                    if conversion_fn is not None:
-                        fio2_est = conversion_fn(flow_rate)
-                        break
+            table = _DEVICE_MAP[device_type]
+            if table is not None:
+                fio2_est = _fio2_from_table(table, flow_rate)
+
+    if sink is not None:
+        sink.add(_FINDER, explain.EVENT_NOTE, stage='fio2_est', text=device_str,
+                 reason='estimated FiO2 {0} from flow rate {1}'.
+                 format(fio2_est, flow_rate))
 
     return device_str, fio2_est
     
@@ -683,29 +830,76 @@ def _estimate_pao2(spo2):
     elif spo2 <= 80:
         p = 44
     else:
-        for s0 in range(80, 99):
-            # find known bounds on the SpO2 value, then linearly interpolate
-            if spo2 >= s0 and spo2 < (s0 + 1.0):
-                p0 = _SPO2_TO_PAO2[s0]
-                p1 = _SPO2_TO_PAO2[s0+1]
-                # slope m = delta_p/delta_s
-                m = (p1 - p0) # denom == (s0+1 - s0) == 1
-                p = p0 + m * (spo2 - s0)
-                break
+        # find known bounds on the SpO2 value, then linearly interpolate
+        p = _PAO2_TABLE.lookup(spo2)
 
     assert p is not None
     return p
 
 
+###############################################################################
+def estimate_pao2(spo2):
+    """
+    Vectorized version of _estimate_pao2. Returns a numpy array of PaO2
+    estimates in mmHg for an array of SpO2 percentages. NaN inputs give NaN.
+    """
+
+    spo2 = np.asarray(spo2, dtype=np.float64)
+    clipped = np.clip(spo2, _PAO2_TABLE.lo, _PAO2_TABLE.hi)
+    return _PAO2_TABLE.lookup_array(clipped)
+
+
+###############################################################################
+def estimate_fio2(flow_rate, device_type):
+    """
+    Vectorized FiO2 estimation. Returns a numpy array of FiO2 percentages for
+    arrays of flow rates in L/min and 'device_type' values (DEVICE_TYPE_NC,
+    etc.), which are broadcast against each other. The result is NaN if the
+    device has no FiO2 table or the flow rate is outside of its range.
+
+    Unlike the per-reading estimate in 'run', stated percentages in the
+    device strings are not considered.
+    """
+
+    flow_rate = np.asarray(flow_rate, dtype=np.float64)
+    device_type = np.asarray(device_type)
+    flow_rate, device_type = np.broadcast_arrays(flow_rate, device_type)
+
+    fio2 = np.full(flow_rate.shape, np.nan)
+    for code, table in _DEVICE_TYPE_TABLES.items():
+        mask = (device_type == code) & (flow_rate >= table.lo) & (flow_rate <= table.hi)
+        if mask.any():
+            fio2[mask] = table.lookup_array(flow_rate[mask])
+
+    return fio2
+
+
+###############################################################################
+def pf_ratio(pao2, fio2):
+    """
+    Vectorized P/F ratio from arrays of PaO2 values in mmHg and FiO2
+    percentages. The result is NaN where either value is NaN or FiO2 is not
+    positive.
+    """
+
+    pao2 = np.asarray(pao2, dtype=np.float64)
+    fio2 = np.asarray(fio2, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = pao2 / (0.01 * fio2)
+    return np.where(fio2 > 0, ratio, np.nan)
+
+
 ###############################################################################
 def _extract_values(match_obj):
     """
-    Find the 'val', 'val1', and 'val2' groups from the matchobj groupdict.
+    Find the 'val', 'val1', and 'val2' groups of the match object.
     """
 
     val1 = None
     val2 = None
-    for k,v in match_obj.groupdict().items():
+    for k, index in _VALUE_TABLES[id(match_obj.re)]:
+        v = match_obj.group(index)
         if v is None:
             continue
         if 'val' == k or 'val1' == k:
@@ -717,15 +911,54 @@ def _extract_values(match_obj):
     
 
 ###############################################################################
-def _regex_match(sentence, regex_list):
+def _finditer(regex, sentence, skip_spans):
     """
+    Generator for the matches of the regex in the sentence that do not
+    overlap any of the [start, end) intervals in 'skip_spans'. After a match
+    that overlaps an interval, the search resumes at the end of the interval.
+    """
+
+    if 0 == len(skip_spans):
+        for match in regex.finditer(sentence):
+            yield match
+        return
+
+    pos = 0
+    while pos <= len(sentence):
+        match = regex.search(sentence, pos)
+        if match is None:
+            break
+
+        skip_end = None
+        for span_start, span_end in skip_spans:
+            if match.start() < span_end and span_start < match.end():
+                if skip_end is None or span_end > skip_end:
+                    skip_end = span_end
+
+        if skip_end is None:
+            yield match
+            pos = match.end()
+            if match.end() == match.start():
+                pos += 1
+        else:
+            pos = max(skip_end, match.start() + 1)
+
+
+###############################################################################
+def _regex_match(sentence, regex_list, skip_spans=(), sink=None, stage=None):
+    """
+    Run each regex in the list on the sentence, skipping any matches that
+    overlap the [start, end) intervals in 'skip_spans', and return the list of
+    surviving candidates after overlap resolution. The matches and discarded
+    candidates are added to the explain sink, if any, for the given stage.
     """
 
     num_regexes = len(regex_list)
     
     candidates = []
     for i, regex in enumerate(regex_list):
-        iterator = regex.finditer(sentence)
+        cond_index = regex.groupindex.get('cond')
+        iterator = _finditer(regex, sentence, skip_spans)
         for match in iterator:
             match_text = match.group().strip()
 
@@ -737,24 +970,32 @@ def _regex_match(sentence, regex_list):
             # a new sentence at "Pt", in which case the match would be correct.
             special_match = re.search(r'\.\s[A-Z][a-z]+', match_text)
             if special_match:
+                if sink is not None:
+                    sink.add(_FINDER, explain.EVENT_DISCARD, stage=stage,
+                             regex_index=i, start=match.start(),
+                             end=match.end(), text=match_text,
+                             reason='match continues into a new sentence')
                 continue
 
             # Special case for regexes with conditions. Prevent a match if
             # the condition captures sat, saturation, etc.
             
             discard_match = False
-            for k,v in match.groupdict().items():
-                if 'cond' == k:
-                    if v is not None:
-                        text = v.lower()
-                        for word in _COND_DISCARD_SET:
-                            if word in text:
-                                if _TRACE:
-                                    print('\tDiscarding match; discard ' \
-                                          'word "{0}" appears in "cond" '  \
-                                          'group "{1}"'.format(word, text))
-                                discard_match = True
-                                break
+            if cond_index is not None:
+                v = match.group(cond_index)
+                if v is not None:
+                    text = v.lower()
+                    for word in _COND_DISCARD_SET:
+                        if word in text:
+                            if sink is not None:
+                                sink.add(_FINDER, explain.EVENT_DISCARD,
+                                         stage=stage, regex_index=i,
+                                         start=match.start(), end=match.end(),
+                                         text=match_text,
+                                         reason='discard word "{0}" appears ' \
+                                         'in "cond" group "{1}"'.format(word, text))
+                            discard_match = True
+                            break
             if discard_match:
                 continue
             
@@ -768,12 +1009,10 @@ def _regex_match(sentence, regex_list):
             end   = start + len(match_text)
             candidates.append(overlap.Candidate(start, end, match_text, regex,
                                                 other=match))
-            if _TRACE:
-                print('[{0:2}]: [{1:3}, {2:3})\tMATCH TEXT: ->{3}<-'.
-                      format(i, start, end, match_text))
-                print('\tmatch.groupdict entries: ')
-                for k,v in match.groupdict().items():
-                    print('\t\t{0} => {1}'.format(k,v))
+            if sink is not None:
+                sink.add(_FINDER, explain.EVENT_MATCH, stage=stage,
+                         regex_index=i, start=start, end=end, text=match_text,
+                         groups=explain.match_groups(match))
                 
 
     if 0 == len(candidates):
@@ -782,15 +1021,6 @@ def _regex_match(sentence, regex_list):
     # sort the candidates in descending order of length, which is needed for
     # one-pass overlap resolution later on
     candidates = sorted(candidates, key=lambda x: x.end-x.start, reverse=True)
-    
-    if _TRACE:
-        print('\tCandidate matches: ')
-        index = 0
-        for c in candidates:
-            print('\t[{0:2}]\t[{1},{2}): {3}'.
-                  format(index, c.start, c.end, c.match_text, c.regex))
-            index += 1
-        print()
 
     # if two overlap exactly, keep candidate with longer device string
     prev_start = candidates[0].start
@@ -799,38 +1029,30 @@ def _regex_match(sentence, regex_list):
     for i in range(1, len(candidates)):
         c = candidates[i]
         if c.start == prev_start and c.end == prev_end:
-            if _TRACE:
-                print('\tCandidates at indices {0} and {1} have ' \
-                      'identical overlap'.format(i-1, i))
             # the regex match object is stored in the 'other' field
             matchobj = c.other
             matchobj_prev = candidates[i-1].other
-            if 'device' in matchobj.groupdict() and 'device' in matchobj_prev.groupdict():
+            if 'device' in matchobj.re.groupindex and 'device' in matchobj_prev.re.groupindex:
                 device = matchobj.group('device')
                 device_prev = matchobj_prev.group('device')
                 if device is not None and device_prev is not None:
                     len_device = len(device)
                     len_device_prev = len(device_prev)
-                    if _TRACE:
-                        print('\t\tdevice string for index {0}: {1}'.
-                              format(i-1, device_prev))
-                        print('\t\tdevice string for index {0}: {1}'.
-                              format(i, device))
                     if len_device > len_device_prev:
                         delete_index = i-1
                     else:
                         delete_index = i
-                    if _TRACE:
-                        print('\t\t\tdelete_index: {0}'.format(delete_index))
                     break
         prev_start = c.start
         prev_end = c.end
 
     if delete_index is not None:
+        if sink is not None:
+            c = candidates[delete_index]
+            sink.add(_FINDER, explain.EVENT_DISCARD, stage=stage,
+                     start=c.start, end=c.end, text=c.match_text,
+                     reason='same span as a match with a longer device string')
         del candidates[delete_index]
-        if _TRACE:
-            print('\tRemoved candidate at index {0} with shorter device string'.
-                  format(delete_index))
 
     # remove any that are proper substrings of another, exploiting the fact
     # that the candidate list is sorted in decreasing order of length
@@ -843,9 +1065,12 @@ def _regex_match(sentence, regex_list):
             prev_end   = candidates[j].end
             if start >= prev_start and end <= prev_end:
                 discard_set.add(i)
-                if _TRACE:
-                    print('\t[{0:2}] is a substring of [{1}], discarding...'.
-                          format(i, j))
+                if sink is not None:
+                    sink.add(_FINDER, explain.EVENT_DISCARD, stage=stage,
+                             start=start, end=end,
+                             text=candidates[i].match_text,
+                             reason='substring of "{0}"'.
+                             format(candidates[j].match_text))
                 break
 
     survivors = []
@@ -862,28 +1087,33 @@ def _regex_match(sentence, regex_list):
     complete_candidates = []
     for c in candidates:
         # match object stored in the 'other' field
-        gd = c.other.groupdict()
+        match = c.other
         count = 0
-        if 'val' in gd and gd['val'] is not None:
+        if overlap.group_value(match, 'val') is not None:
             count += 1
-        if 'flow_rate' in gd and gd['flow_rate'] is not None:
+        if overlap.group_value(match, 'flow_rate') is not None:
             count += 1
-        if 'flow_rate2' in gd and gd['flow_rate2'] is not None:
+        if overlap.group_value(match, 'flow_rate2') is not None:
             count += 1
-        if 'flow_rate3' in gd and gd['flow_rate3'] is not None:
+        if overlap.group_value(match, 'flow_rate3') is not None:
             count += 1
-        if 'device' in gd and gd['device'] is not None:
+        device_str = overlap.group_value(match, 'device')
+        if device_str is not None:
             count += 1
             # room air will not have a flow rate, but it is nontheless complete
-            device_str = gd['device']
             if -1 != device_str.find(' air'):
                 count += 1
         if count >= 3:
             complete_candidates.append(c)
-            if _TRACE:
-                print('\tFound complete candidate "{0}"'.format(c.match_text))
 
     if len(complete_candidates) > 0:
+        if sink is not None:
+            for c in candidates:
+                if c not in complete_candidates:
+                    sink.add(_FINDER, explain.EVENT_DISCARD, stage=stage,
+                             start=c.start, end=c.end, text=c.match_text,
+                             reason='not a complete candidate (value, device, ' \
+                             'and flow rate)')
         candidates = complete_candidates
 
         # Now find the maximum number of non-overlapping candidates. This is an
@@ -904,15 +1134,14 @@ def _regex_match(sentence, regex_list):
 
     else:
         # run the usual overlap resolution
-        pruned_candidates = overlap.remove_overlap(candidates, _TRACE)
+        pruned_candidates = overlap.remove_overlap(candidates)
 
-    if _TRACE:
-        print('\tcandidate count after overlap removal: {0}'.
-              format(len(pruned_candidates)))
-        print('\tPruned candidates: ')
-        for c in pruned_candidates:
-            print('\t\t[{0},{1}): {2}'.format(c.start, c.end, c.match_text))
-        print()
+    if sink is not None:
+        for c in candidates:
+            if c not in pruned_candidates:
+                sink.add(_FINDER, explain.EVENT_DISCARD, stage=stage,
+                         start=c.start, end=c.end, text=c.match_text,
+                         reason='overlaps a longer or earlier candidate')
 
     return pruned_candidates
     
@@ -922,6 +1151,7 @@ def _encode_device(k, v):
     """
     Encode a device string as v|k, where the string 'k' is a key in
     _DEVICE_MAP, and 'v' is the value for that device extracted from the text.
+    Returns the value for the 'device_type' field and the encoded string.
     """
 
     # strip the leading prepositions, if any
@@ -932,72 +1162,116 @@ def _encode_device(k, v):
     elif v.startswith('with '):
         v = v[5:]
 
-    device_type = k
+    device_type = _DEVICE_TYPE_CODES[k]
     # encode as 'v|k'
     device_str = '{0}{1}{2}'.format(v.strip(), _DEVICE_ENC_CHAR, k)
     return device_type, device_str
     
 
 ###############################################################################
-def _erase(sentence, candidates):
+def _parse_flowsheet(cleaned_sentence, sink=None):
     """
-    Erase all candidate matches from the sentence. Only substitute a single
-    whitespace for the region, since this is performed on the previously
-    cleaned sentence.
+    Parse a sentence consisting entirely of flowsheet 'key: value' pairs in a
+    single pass. Returns None if the sentence is not in this format, or if
+    any value could be read as O2 information by the general-purpose regexes.
+    Otherwise returns the same values as '_find_candidates'.
     """
 
-    new_sentence = sentence
-    for c in candidates:
-        start = c.start
-        end = c.end
-        s1 = new_sentence[:start]
-        s2 = ' '
-        s3 = new_sentence[end:]
-        new_sentence = s1 + s2 + s3
-
-    # collapse repeated whitespace, if any
-    new_sentence = re.sub(r'\s+', ' ', new_sentence)
-        
-    return new_sentence
+    # quick rejection of prose
+    if cleaned_sentence.count(':') < 2:
+        return None
+
+    keys = list(_regex_flowsheet_key.finditer(cleaned_sentence))
+    if 0 == len(keys) or 0 != keys[0].start():
+        return None
+
+    sao2_items = []
+    pao2 = EMPTY_FIELD
+    fio2 = EMPTY_FIELD
+    p_to_f_ratio = EMPTY_FIELD
+
+    for i, key_match in enumerate(keys):
+        if i + 1 < len(keys):
+            value_end = keys[i+1].start()
+        else:
+            value_end = len(cleaned_sentence)
+        value = cleaned_sentence[key_match.end():value_end].rstrip()
+        value_end = key_match.end() + len(value)
+
+        kind = _FLOWSHEET_KEYS[key_match.group('key').lower()]
+        value_match = _FLOWSHEET_VALUES[kind].fullmatch(value)
+        if value_match is None:
+            return None
+
+        if _FS_OTHER == kind:
+            if _regex_flowsheet_unsafe.search(value):
+                return None
+        elif _FS_SPO2 == kind:
+            groups = [('val', value_match.group('val'))]
+            sao2_items.append( (key_match.start(), value_end,
+                                cleaned_sentence[key_match.start():value_end],
+                                groups) )
+        # the regexes do not necessarily pick the first of several values,
+        # so lines with repeated FiO2, PaO2, or P/F keys are not parsed
+        elif _FS_FIO2 == kind:
+            if EMPTY_FIELD != fio2:
+                return None
+            fio2 = float(value_match.group('val'))
+        elif _FS_PAO2 == kind:
+            if EMPTY_FIELD != pao2:
+                return None
+            pao2 = float(value_match.group('val'))
+        elif _FS_PF == kind:
+            if EMPTY_FIELD != p_to_f_ratio:
+                return None
+            p_to_f_ratio = float(value_match.group('val'))
+
+    # lines without an SpO2 value are left to the general-purpose regexes
+    if 0 == len(sao2_items):
+        return None
+
+    if sink is not None:
+        for start, end, match_text, groups in sao2_items:
+            sink.add(_FINDER, explain.EVENT_MATCH, stage='flowsheet',
+                     start=start, end=end, text=match_text,
+                     groups=dict(groups))
+
+    return sao2_items, pao2, fio2, p_to_f_ratio
 
 
 ###############################################################################
-def run(sentence):
+def _find_candidates(cleaned_sentence, sink=None):
     """
-    Find values related to oxygen saturation, flow rates, etc. Compute values
-    such as P/F ratio when possible. Returns a JSON array containing info
-    on all values extracted or computed.
+    Run the general-purpose regexes on the sentence. Returns a list of
+    (start, end, match_text, groups) tuples for the SaO2 matches, where
+    'groups' is a list of (group_name, value) pairs for the groups in the
+    match, and the first PaO2, FiO2, and P/F ratio values, or EMPTY_FIELD.
     """
 
-    results = []
-    cleaned_sentence = _cleanup(sentence)
-
     # could have ovelapping SaO2 matches
-    if _TRACE:
-        print('SaO2 candidates: ')
-    sao2_candidates = _regex_match(cleaned_sentence, _SAO2_REGEXES)
+    sao2_candidates = _regex_match(cleaned_sentence, _SAO2_REGEXES,
+                                   sink=sink, stage='sao2')
 
-    # erase these matches from the sentence
-    remaining_sentence = _erase(cleaned_sentence, sao2_candidates)
+    # The matches are not erased from the sentence; instead, the later scans
+    # skip any matches that overlap these [start, end) intervals.
+    erased_spans = [(c.start, c.end) for c in sao2_candidates]
     
     # only a single match for pao2, fio2, p_to_f_ratio
 
-    if _TRACE:
-        print('PaO2 candidates: ')
     pao2 = EMPTY_FIELD
-    pao2_candidates = _regex_match(remaining_sentence, [_regex_pao2])
+    pao2_candidates = _regex_match(cleaned_sentence, [_regex_pao2], erased_spans,
+                                   sink, 'pao2')
     if len(pao2_candidates) > 0:
         # take the first match
         match_obj = pao2_candidates[0].other
         pao2, pao2_2 = _extract_values(match_obj)
 
-    # erase these matches also
-    remaining_sentence = _erase(remaining_sentence, pao2_candidates)
+    # skip these matches also
+    erased_spans.extend([(c.start, c.end) for c in pao2_candidates])
 
-    if _TRACE:
-        print('FiO2 candidates: ')
     fio2 = EMPTY_FIELD
-    fio2_candidates = _regex_match(remaining_sentence, _FIO2_REGEXES)
+    fio2_candidates = _regex_match(cleaned_sentence, _FIO2_REGEXES, erased_spans,
+                                   sink, 'fio2')
     if len(fio2_candidates) > 0:
         # take the first match
         match_obj = fio2_candidates[0].other
@@ -1006,30 +1280,66 @@ def run(sentence):
         if fio2 < 1.0:
             fio2 *= 100.0
 
-    # erase these matches
-    remaining_sentence = _erase(remaining_sentence, fio2_candidates)
             
-    if _TRACE:
-        print('PaO2/FiO2 candidates: ')
     p_to_f_ratio = EMPTY_FIELD
-    pf_candidates = _regex_match(cleaned_sentence, [_regex_pf_ratio])
+    pf_candidates = _regex_match(cleaned_sentence, [_regex_pf_ratio],
+                                 sink=sink, stage='pf')
     if len(pf_candidates) > 0:
         # take the first match
         match_obj = pf_candidates[0].other
         p_to_f_ratio, p_to_f_ratio_2 = _extract_values(match_obj)
 
-    if _TRACE:
-        print('Extracting data from pruned candidates...')
-
+    # recover the regex match objects from the 'other' field and keep only
+    # the groups that are present in the match
+    sao2_items = []
     for pc in sao2_candidates:
-        # recover the regex match object from the 'other' field
         match = pc.other
         assert match is not None
+        groups = []
+        for k, index in _GROUP_TABLES[id(match.re)]:
+            v = match.group(index)
+            if v is not None:
+                groups.append( (k, v) )
+        sao2_items.append( (pc.start, pc.end, pc.match_text, groups) )
+
+    return sao2_items, pao2, fio2, p_to_f_ratio
+
+
+###############################################################################
+def extract(sentence, sink=None):
+    """
+    Find values related to oxygen saturation, flow rates, etc. Compute values
+    such as P/F ratio when possible. Returns a list of O2Tuples, sorted by
+    position, which all share the same cleaned sentence string.
+
+    If 'sink' is an explain.ExplainSink, the matches, discarded candidates,
+    and results are added to it.
+    """
+
+    if sink is None and _TRACE:
+        sink = explain.TraceSink()
+
+    results = []
+    cleaned_sentence = _cleanup(sentence)
+    if sink is not None:
+        sink.add(_FINDER, explain.EVENT_SENTENCE, text=cleaned_sentence)
+
+    # flowsheet lines are parsed directly, all else uses the regexes
+    found = _parse_flowsheet(cleaned_sentence, sink)
+    if found is None:
+        found = _find_candidates(cleaned_sentence, sink)
+    sao2_items, pao2, fio2, p_to_f_ratio = found
+
+    # device-only candidates, found at most once per sentence if needed
+    device_candidates = None
+
+    for start, end, match_text, groups in sao2_items:
                 
         o2_sat           = EMPTY_FIELD
         flow_rate        = EMPTY_FIELD
         flow2            = EMPTY_FIELD
         device           = EMPTY_FIELD
+        device_type      = DEVICE_TYPE_NONE
         value            = EMPTY_FIELD
         value2           = EMPTY_FIELD
         pao2_est         = EMPTY_FIELD
@@ -1046,9 +1356,7 @@ def run(sentence):
         needs_o2_flow    = EMPTY_FIELD
         condition        = STR_O2_EQUAL
 
-        for k,v in match.groupdict().items():
-            if v is None:
-                continue
+        for k,v in groups:
             if 'val1' == k or 'val' == k:
                 value = float(v)
                 o2_sat = value
@@ -1082,37 +1390,49 @@ def run(sentence):
 
         # check oxygen saturation for valid range
         if EMPTY_FIELD != o2_sat and o2_sat < _MIN_SPO2_PCT:
+            if sink is not None:
+                sink.add(_FINDER, explain.EVENT_DISCARD, start=start, end=end,
+                         text=match_text, reason='SpO2 {0} is below {1}'.
+                         format(o2_sat, _MIN_SPO2_PCT))
             continue
 
         # if no device found, check device regex independently
         if EMPTY_FIELD == device:
-            device_candidates = _regex_match(cleaned_sentence, [_regex_device])
+            if device_candidates is None:
+                device_candidates = _regex_match(cleaned_sentence, [_regex_device],
+                                                 sink=sink, stage='device')
             if len(device_candidates) > 0:
                 # take the first match
-                for k,v in device_candidates[0].other.groupdict().items():
-                    if v is None:
-                        continue
-                    if k in _DEVICE_MAP:
+                match = device_candidates[0].other
+                for k, index in _DEVICE_TABLE:
+                    v = match.group(index)
+                    if v is not None:
                         device_type, device = _encode_device(k,v)
                 
         # compute estimated FiO2 from flow rate and device
         if EMPTY_FIELD == fio2 and device is not None:
-            device, fio2_est = _estimate_fio2(flow_rate, device)
+            device, fio2_est = _estimate_fio2(flow_rate, device, sink)
 
         # handle face tent with nasal cannula
         if EMPTY_FIELD == flow_rate and EMPTY_FIELD == fio2_est:
             if EMPTY_FIELD != flow_rate2 and EMPTY_FIELD != nc2:
                 device, fio2_est = _estimate_fio2(flow_rate2,'{0}|{1}'.
-                                                  format(_DEVICE_NC, _DEVICE_NC))
+                                                  format(_DEVICE_NC, _DEVICE_NC),
+                                                  sink)
+                device_type = DEVICE_TYPE_NC
             elif EMPTY_FIELD != flow_rate3 and EMPTY_FIELD != nc3:
                 device, fio2_est = _estimate_fio2(flow_rate3, '{0}|{1}'.
-                                                  format(_DEVICE_NC, _DEVICE_NC))
+                                                  format(_DEVICE_NC, _DEVICE_NC),
+                                                  sink)
+                device_type = DEVICE_TYPE_NC
 
         # unencode the device if no fio2 estimate could be performed
         if EMPTY_FIELD != device:
-            device = device.split(_DEVICE_ENC_CHAR)[0].strip()
+            # device names repeat, so share a single copy of each
+            device = sys.intern(device.split(_DEVICE_ENC_CHAR)[0].strip())
             if 'none' == device.lower():
                 device = EMPTY_FIELD
+                device_type = DEVICE_TYPE_NONE
             
         # Check for the situation of a stated p_to_f, a stated fio2, and no
         # pao2. In this case compute the pao2 value from the p_to_f and fio2
@@ -1164,12 +1484,13 @@ def run(sentence):
             
         o2_tuple = O2Tuple(
             sentence         = cleaned_sentence,
-            text             = pc.match_text,
-            start            = pc.start,
-            end              = pc.end,
+            text             = match_text,
+            start            = start,
+            end              = end,
             flow_rate        = flow_rate,
             flow_rate2       = flow2,
             device           = device,
+            device_type      = device_type,
             condition        = condition,
             value            = value,
             value2           = value2,
@@ -1184,14 +1505,258 @@ def run(sentence):
             needs_o2_flow    = needs_o2_flow,
         )
         results.append(o2_tuple)
+        if sink is not None:
+            sink.add(_FINDER, explain.EVENT_RESULT, start=start, end=end,
+                     text=match_text,
+                     groups={k:v for k,v in o2_tuple._asdict().items()
+                             if k not in _EXPLAIN_SKIP_FIELDS and v is not None})
 
     # sort results to match order of occurrence in sentence
     results = sorted(results, key=lambda x: x.start)
+    return results
+    
+
+###############################################################################
+def has_o2_content(sentence):
+    """
+    Return True if the cleaned sentence contains any of the O2 keywords. If
+    this returns False, 'extract' finds nothing in the sentence, so it does
+    not need to be run. This is a cheap linear scan, for use as a prefilter
+    on whole texts before they are segmented and on single sentences.
+    """
+
+    return _regex_o2_keyword.search(_cleanup(sentence)) is not None
+
+
+###############################################################################
+def split_sentences(text):
+    """
+    Cheap sentence splitter for callers without a sentence segmenter. Splits
+    the text after '.', '!', or '?' followed by whitespace.
+    """
+
+    sentences = [s for s in _regex_sentence_end.split(text) if len(s) > 0]
+    if 0 == len(sentences):
+        sentences = [text]
+    return sentences
+
+
+###############################################################################
+def run(sentence, sink=None):
+    """
+    Find values related to oxygen saturation, flow rates, etc. Compute values
+    such as P/F ratio when possible. Returns a JSON array containing info
+    on all values extracted or computed. The 'sink' argument is passed to
+    'extract'.
+    """
+
+    results = extract(sentence, sink)
 
     # convert to list of dicts to preserve field names in JSON output
     return json.dumps([r._asdict() for r in results], indent=4)
     
 
+###############################################################################
+class O2Summary(object):
+    """
+    Fixed-size summary of the O2Tuples found for a patient. Holds only the
+    facts needed for the diagnosis, so that the O2Tuples themselves do not
+    have to be kept.
+    """
+
+    __slots__ = (
+        'count',                # number of O2Tuples added
+        'max_flow_rate',        # [L/min], or EMPTY_FIELD if none found
+        'has_high_flow_device', # True if any device was DEVICE_TYPE_HFNC
+        'needs_o2',             # True if any statement of needing O2
+        'min_spo2',             # [%], or EMPTY_FIELD if none found
+    )
+
+    def __init__(self):
+        self.count                = 0
+        self.max_flow_rate        = EMPTY_FIELD
+        self.has_high_flow_device = False
+        self.needs_o2             = False
+        self.min_spo2             = EMPTY_FIELD
+
+    def add(self, o2_tuple):
+        """
+        Update the summary with a single O2Tuple.
+        """
+
+        self.count += 1
+
+        flow_rate = o2_tuple.flow_rate
+        if EMPTY_FIELD != flow_rate:
+            if EMPTY_FIELD == self.max_flow_rate or flow_rate > self.max_flow_rate:
+                self.max_flow_rate = flow_rate
+
+        if DEVICE_TYPE_HFNC == o2_tuple.device_type:
+            self.has_high_flow_device = True
+
+        # patient needs O2 if a flow rate is present
+        if o2_tuple.needs_o2 or o2_tuple.needs_o2_device or o2_tuple.needs_o2_flow:
+            self.needs_o2 = True
+
+        spo2 = o2_tuple.value
+        if EMPTY_FIELD != spo2:
+            if EMPTY_FIELD == self.min_spo2 or spo2 < self.min_spo2:
+                self.min_spo2 = spo2
+
+    def merge(self, other):
+        """
+        Update the summary with the contents of another O2Summary.
+        """
+
+        self.count += other.count
+
+        if EMPTY_FIELD != other.max_flow_rate:
+            if EMPTY_FIELD == self.max_flow_rate or other.max_flow_rate > self.max_flow_rate:
+                self.max_flow_rate = other.max_flow_rate
+
+        self.has_high_flow_device = self.has_high_flow_device or other.has_high_flow_device
+        self.needs_o2 = self.needs_o2 or other.needs_o2
+
+        if EMPTY_FIELD != other.min_spo2:
+            if EMPTY_FIELD == self.min_spo2 or other.min_spo2 < self.min_spo2:
+                self.min_spo2 = other.min_spo2
+
+
+# sentences for command-line testing, also used by corpus.py to generate
+# synthetic notes
+SENTENCES = [
+    'Vitals were HR=120, BP=109/44, RR=29, POx=93% on 8L FM',
+    'Vitals: T: 96.0  BP: 90/54 P: 88 R: 16 18 O2:88/NRB',
+    'Vitals: T 98.9 F BP 138/56 P 89 RR 28 SaO2 100% on NRB',
+    'Vitals were T 98 BP 163/64 HR 73 O2 95% on 55% venti mask',
+    'VS: T 95.6 HR 45 BP 75/30 RR 17 98% RA.',
+    'VS T97.3 P84 BP120/56 RR16 O2Sat98 2LNC',
+    'Vitals: T: 99 BP: 115/68 P: 79 R:21 O2: 97',
+    'Vitals - T 95.5 BP 132/65 HR 78 RR 20 SpO2 98%/3L',
+    'VS: T=98 BP= 122/58  HR= 7 RR= 20  O2 sat= 100% 2L NC',
+    'Vitals: T: 97.7 P:100 R:16 BP:126/95 SaO2:100 Ra',
+    'VS:  T-100.6, HR-105, BP-93/46, RR-16, Sats-98% 3L/NC',
+    'VS - Temp. 98.5F, BP115/65 , HR103 , R16 , 96O2-sat % RA',
+    'Vitals: Temp 100.2 HR 72 BP 184/56 RR 16 sats 96% on RA',
+    'PHYSICAL EXAM: O: T: 98.8 BP: 123/60   HR:97    R 16  O2Sats100%',
+    'VS before transfer were 85 BP 99/34 RR 20 SpO2% 99/bipap 10/5 50%.',
+    'Initial vs were: T 98 P 91 BP 122/63 R 20 O2 sat 95%RA.',
+    'Initial vitals were HR 106 BP 88/56 RR 20 O2 Sat 85% 3L.',
+    'Initial vs were: T=99.3 P=120 BP=111/57 RR=24 POx=100%.',        
+    "Vitals as follows: BP 120/80 HR 60-80's RR  SaO2 96% 6L NC.",
+    'Vital signs were T 97.5 HR 62 BP 168/60 RR 18 95% RA.',
+    'T 99.4 P 160 R 56 BP 60/36 mean 44 O2 sat 97% Wt 3025 grams ',
+    'HR 107 RR 28 and SpO2 91% on NRB.',
+    'BP 143/79 RR 16 and O2 sat 92% on room air and 100% on 3 L/min nc',
+    'RR: 28 BP: 84/43 O2Sat: 88 O2 Flow: 100 (Non-Rebreather).',
+    'Vitals were T 97.1 HR 76 BP 148/80 RR 25 SpO2 92%/RA.',
+    'Tm 96.4, BP= 90-109/49-82, HR= paced at 70, RR= 24, O2 sat= 96% on 4L',
+    'Vitals were T 97.1 BP 80/70 AR 80 RR 24 O2 sat 70% on 50% flowmask',
+    'HR 84 bpm RR 13 bpm O2: 100% PS 18/10 FiO2 40%',
+    'BP 91/50, HR 63, RR 12, satting 95% on trach mask',
+    'O2 sats 98-100%',
+    'Pt. desating to 88%',
+    'spo2 difficult to monitor but appeared to remain ~ 96-100% on bipap 8/5',
+    'using BVM w/ o2 sats 74% on 4L',
+    
+    'desat to 83 with 100% face tent and 4 l n.c.',
+    'desat to 83 with 100% face tent and nc of approximately 4l',
+
+    'Ventilator mode: CMV/ASSIST/AutoFlow   Vt (Set): 550 (550 - 550) mL ' +\
+    'Vt (Spontaneous): 234 (234 - 234) mL   RR (Set): 16 ' +\
+    'RR (Spontaneous): 0   PEEP: 5 cmH2O   FiO2: 70%   RSBI: 140 ' +\
+    'PIP: 25 cmH2O   SpO2: 98%   Ve: 14.6 L/min',
+
+    'Vt (Spontaneous): 608 (565 - 793) mL   PS : 15 cmH2O   ' +\
+    'RR (Spontaneous): 27   PEEP: 10 cmH2O   FiO2: 50%   '    +\
+    'RSBI Deferred: PEEP > 10   PIP: 26 cmH2O   SpO2: 99%   ' +\
+    'ABG: 7.41/39/81/21/0   Ve: 17.4 L/min   PaO2 / FiO2: 164',
+
+    'Respiratory: Vt (Set): 600 (600 - 600) mL   Vt (Spontaneous): 743 ' +\
+    '(464 - 816) mL  PS : 5 cmH2O   RR (Set): 14   RR (Spontaneous): 19' +\
+    ' PEEP: 5 cmH2O   FiO2: 50%   RSBI: 49   PIP: 11 cmH2O   '           +\
+    'Plateau: 20 cmH2O   SPO2: 99%   ABG: 7.34/51/109/25/0   '           +\
+    'Ve: 10.3 L/min   PaO2 / FiO2: 218',
+    
+    'an oxygen saturation of 96% on 2 liters',
+    'an oxygen saturation of 96% on 2 liters with a nasal cannula',
+    
+    'the respiratory rate was 21,\nand the oxygen saturation was 80% ' +\
+    'to 92% on a 100% nonrebreather mask',
+
+    'temperature 100 F., orally.  O2 saturation 98% on room air',
+
+    'o2 sat 93% on 5l',
+    'O2 sat were 90-95.',
+    'O2 sat then decreased again to 89 - 90% while on 50% face tent',
+
+    'O2sat >93',
+    'patient spo2 < 93 % all night',
+    'an oxygen saturation ~=90 for prev. 5 hrs',
+
+    'This morning SpO2 values began to improve again able to wean ' +\
+    'back peep to 5 SpO2 holding at 94%',
+    'O2 sats ^ 96%.',
+    'O2 sats ^ back to 96-98%.',
+    'O2 sats improving over course of shift and O2 further weaned ' +\
+    'to 5lpm nasal prongs: O2 sats 99%.',
+    'O2 sats 93-94% on 50% face tent.',
+    
+    'O2 SATS WERE BELOW 86',
+    'O2 sats down to 88',
+    'She arrived with B/P 182/80, O2 sats on 100% NRB were 100&.',
+    'Plan:  Wean o2 to maintain o2 sats >85%',
+    'At start of shift, LS with rhonchi throughout and ' +\
+    'O2 sats > 94% on 5  liters.',
+    'O2 sats are 92-94% on 3L NP & 91-93% on room air.',
+    'Pt. taken off mask ventilation and put on NRM with ' +\
+    '6lpm nasal prongs. O2 sats 96%.',
+    'Oxygen again weaned in   evening to 6L n.c. while pt ' +\
+    'eating dinner O2 sats 91-92%.',
+    
+    'episodes of desaturation overnoc to O2 Sat 80%, on RBM & O2 NC 8L',        
+    'Pt initially put on nasal prongs, O2 sats low @ 89% and patient changed over to NRM.',
+    'O2 at 2 l nc, o2 sats 98 %, resp rate 16-24, Lungs diminished throughout',
+    'Changed to 4 liters n/c O2 sats   86%,  increased to 6 liters n/c ~ O2 sats 88%',
+    'Pt with trach mask 50% FiO2 and oxygen saturation 98-100%  Lungs rhonchorous.',
+
+    # negative example - don't capture the 'ra' in 'keppra'
+    'Upon arrival left pupil blown to 6mm mannitol 100gm given along with keppra.',
+
+    # negative example - don't capture the 'air' in 'repair'
+    '78 yo F s/p laparoscopic paraesophageal hernia repair with Collis gastroplasty',
+    
+    # note the zero '0' character in Fi02
+    'Fi02 also weaned to 40% as 02 sat ~100%.',
+
+    'Respiratory support O2 Delivery Device: Nasal cannula SpO2: 95%',
+    'found with O2 sat of 65% on RA. Pt was initially satting 95% on NRB',
+
+    # negative example - don't capture the 'NC' in 'HEENT: NC'
+    # only capture "SpO2: 98%'
+    'SpO2: 98% Physical Examination General: sleeping in NAD easily ' \
+    'arousable HEENT: NC',
+
+    '- Pressors for MAP >60 - Mechanical ventilation daily SBT wean vent settings as tolerat',
+
+    "LFT's nl. - IVF boluses to keep MAP >65 - Vanc Zosyn Levofloxacin",
+
+    # fix this - device is NC not 50% face tent
+    'Pt has weaned to nasal cannula from 50% face tent and still sats are 95-100%.',
+
+    'the patient is experiencing increased O2 demand',
+    'pt started having increased o2 requirements',
+    'needing supplemental oxygen',
+    'the patient required oxygen',
+    'tachypneic requiring o2',
+    'placed on oxygen for pulse ox 94%',
+    'continued on hfnc',
+    'pt was at 40l hfnc prior to inubation',
+    'now with sob o2 sat 94% requiring 2l o2 to maintain sat to > 95%',
+    'pt treated with 2-3l o2 nc',
+]
+
+
 ###############################################################################
 if __name__ == '__main__':
 
@@ -1216,137 +1781,6 @@ if __name__ == '__main__':
         print(get_version())
         sys.exit(0)
 
-    SENTENCES = [
-        'Vitals were HR=120, BP=109/44, RR=29, POx=93% on 8L FM',
-        'Vitals: T: 96.0  BP: 90/54 P: 88 R: 16 18 O2:88/NRB',
-        'Vitals: T 98.9 F BP 138/56 P 89 RR 28 SaO2 100% on NRB',
-        'Vitals were T 98 BP 163/64 HR 73 O2 95% on 55% venti mask',
-        'VS: T 95.6 HR 45 BP 75/30 RR 17 98% RA.',
-        'VS T97.3 P84 BP120/56 RR16 O2Sat98 2LNC',
-        'Vitals: T: 99 BP: 115/68 P: 79 R:21 O2: 97',
-        'Vitals - T 95.5 BP 132/65 HR 78 RR 20 SpO2 98%/3L',
-        'VS: T=98 BP= 122/58  HR= 7 RR= 20  O2 sat= 100% 2L NC',
-        'Vitals: T: 97.7 P:100 R:16 BP:126/95 SaO2:100 Ra',
-        'VS:  T-100.6, HR-105, BP-93/46, RR-16, Sats-98% 3L/NC',
-        'VS - Temp. 98.5F, BP115/65 , HR103 , R16 , 96O2-sat % RA',
-        'Vitals: Temp 100.2 HR 72 BP 184/56 RR 16 sats 96% on RA',
-        'PHYSICAL EXAM: O: T: 98.8 BP: 123/60   HR:97    R 16  O2Sats100%',
-        'VS before transfer were 85 BP 99/34 RR 20 SpO2% 99/bipap 10/5 50%.',
-        'Initial vs were: T 98 P 91 BP 122/63 R 20 O2 sat 95%RA.',
-        'Initial vitals were HR 106 BP 88/56 RR 20 O2 Sat 85% 3L.',
-        'Initial vs were: T=99.3 P=120 BP=111/57 RR=24 POx=100%.',        
-        "Vitals as follows: BP 120/80 HR 60-80's RR  SaO2 96% 6L NC.",
-        'Vital signs were T 97.5 HR 62 BP 168/60 RR 18 95% RA.',
-        'T 99.4 P 160 R 56 BP 60/36 mean 44 O2 sat 97% Wt 3025 grams ',
-        'HR 107 RR 28 and SpO2 91% on NRB.',
-        'BP 143/79 RR 16 and O2 sat 92% on room air and 100% on 3 L/min nc',
-        'RR: 28 BP: 84/43 O2Sat: 88 O2 Flow: 100 (Non-Rebreather).',
-        'Vitals were T 97.1 HR 76 BP 148/80 RR 25 SpO2 92%/RA.',
-        'Tm 96.4, BP= 90-109/49-82, HR= paced at 70, RR= 24, O2 sat= 96% on 4L',
-        'Vitals were T 97.1 BP 80/70 AR 80 RR 24 O2 sat 70% on 50% flowmask',
-        'HR 84 bpm RR 13 bpm O2: 100% PS 18/10 FiO2 40%',
-        'BP 91/50, HR 63, RR 12, satting 95% on trach mask',
-        'O2 sats 98-100%',
-        'Pt. desating to 88%',
-        'spo2 difficult to monitor but appeared to remain ~ 96-100% on bipap 8/5',
-        'using BVM w/ o2 sats 74% on 4L',
-        
-        'desat to 83 with 100% face tent and 4 l n.c.',
-        'desat to 83 with 100% face tent and nc of approximately 4l',
-
-        'Ventilator mode: CMV/ASSIST/AutoFlow   Vt (Set): 550 (550 - 550) mL ' +\
-        'Vt (Spontaneous): 234 (234 - 234) mL   RR (Set): 16 ' +\
-        'RR (Spontaneous): 0   PEEP: 5 cmH2O   FiO2: 70%   RSBI: 140 ' +\
-        'PIP: 25 cmH2O   SpO2: 98%   Ve: 14.6 L/min',
-
-        'Vt (Spontaneous): 608 (565 - 793) mL   PS : 15 cmH2O   ' +\
-        'RR (Spontaneous): 27   PEEP: 10 cmH2O   FiO2: 50%   '    +\
-        'RSBI Deferred: PEEP > 10   PIP: 26 cmH2O   SpO2: 99%   ' +\
-        'ABG: 7.41/39/81/21/0   Ve: 17.4 L/min   PaO2 / FiO2: 164',
-
-        'Respiratory: Vt (Set): 600 (600 - 600) mL   Vt (Spontaneous): 743 ' +\
-        '(464 - 816) mL  PS : 5 cmH2O   RR (Set): 14   RR (Spontaneous): 19' +\
-        ' PEEP: 5 cmH2O   FiO2: 50%   RSBI: 49   PIP: 11 cmH2O   '           +\
-        'Plateau: 20 cmH2O   SPO2: 99%   ABG: 7.34/51/109/25/0   '           +\
-        'Ve: 10.3 L/min   PaO2 / FiO2: 218',
-        
-        'an oxygen saturation of 96% on 2 liters',
-        'an oxygen saturation of 96% on 2 liters with a nasal cannula',
-        
-        'the respiratory rate was 21,\nand the oxygen saturation was 80% ' +\
-        'to 92% on a 100% nonrebreather mask',
-
-        'temperature 100 F., orally.  O2 saturation 98% on room air',
-
-        'o2 sat 93% on 5l',
-        'O2 sat were 90-95.',
-        'O2 sat then decreased again to 89 - 90% while on 50% face tent',
-
-        'O2sat >93',
-        'patient spo2 < 93 % all night',
-        'an oxygen saturation ~=90 for prev. 5 hrs',
-
-        'This morning SpO2 values began to improve again able to wean ' +\
-        'back peep to 5 SpO2 holding at 94%',
-        'O2 sats ^ 96%.',
-        'O2 sats ^ back to 96-98%.',
-        'O2 sats improving over course of shift and O2 further weaned ' +\
-        'to 5lpm nasal prongs: O2 sats 99%.',
-        'O2 sats 93-94% on 50% face tent.',
-        
-        'O2 SATS WERE BELOW 86',
-        'O2 sats down to 88',
-        'She arrived with B/P 182/80, O2 sats on 100% NRB were 100&.',
-        'Plan:  Wean o2 to maintain o2 sats >85%',
-        'At start of shift, LS with rhonchi throughout and ' +\
-        'O2 sats > 94% on 5  liters.',
-        'O2 sats are 92-94% on 3L NP & 91-93% on room air.',
-        'Pt. taken off mask ventilation and put on NRM with ' +\
-        '6lpm nasal prongs. O2 sats 96%.',
-        'Oxygen again weaned in   evening to 6L n.c. while pt ' +\
-        'eating dinner O2 sats 91-92%.',
-        
-        'episodes of desaturation overnoc to O2 Sat 80%, on RBM & O2 NC 8L',        
-        'Pt initially put on nasal prongs, O2 sats low @ 89% and patient changed over to NRM.',
-        'O2 at 2 l nc, o2 sats 98 %, resp rate 16-24, Lungs diminished throughout',
-        'Changed to 4 liters n/c O2 sats   86%,  increased to 6 liters n/c ~ O2 sats 88%',
-        'Pt with trach mask 50% FiO2 and oxygen saturation 98-100%  Lungs rhonchorous.',
-
-        # negative example - don't capture the 'ra' in 'keppra'
-        'Upon arrival left pupil blown to 6mm mannitol 100gm given along with keppra.',
-
-        # negative example - don't capture the 'air' in 'repair'
-        '78 yo F s/p laparoscopic paraesophageal hernia repair with Collis gastroplasty',
-        
-        # note the zero '0' character in Fi02
-        'Fi02 also weaned to 40% as 02 sat ~100%.',
-
-        'Respiratory support O2 Delivery Device: Nasal cannula SpO2: 95%',
-        'found with O2 sat of 65% on RA. Pt was initially satting 95% on NRB',
-
-        # negative example - don't capture the 'NC' in 'HEENT: NC'
-        # only capture "SpO2: 98%'
-        'SpO2: 98% Physical Examination General: sleeping in NAD easily ' \
-        'arousable HEENT: NC',
-
-        '- Pressors for MAP >60 - Mechanical ventilation daily SBT wean vent settings as tolerat',
-
-        "LFT's nl. - IVF boluses to keep MAP >65 - Vanc Zosyn Levofloxacin",
-
-        # fix this - device is NC not 50% face tent
-        'Pt has weaned to nasal cannula from 50% face tent and still sats are 95-100%.',
-
-        'the patient is experiencing increased O2 demand',
-        'pt started having increased o2 requirements',
-        'needing supplemental oxygen',
-        'the patient required oxygen',
-        'tachypneic requiring o2',
-        'placed on oxygen for pulse ox 94%',
-        'continued on hfnc',
-        'pt was at 40l hfnc prior to inubation',
-        'now with sob o2 sat 94% requiring 2l o2 to maintain sat to > 95%',
-        'pt treated with 2-3l o2 nc',
-    ]
 
     for i, sentence in enumerate(SENTENCES):
         print('\n[[{0:2d}]]: {1}'.format(i, sentence))
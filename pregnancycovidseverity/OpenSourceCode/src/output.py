@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+
+Streaming output files for the SET-NET driver.
+
+The results for each patient are written as soon as the patient has been
+diagnosed, so that memory use does not grow with the size of the cohort:
+
+    debug_<diagnosis>.txt   the PatientData fields for up to
+                            MAX_DEBUG_PATIENTS patients per diagnosis, plus
+                            a file for all patients on dexamethasone; the
+                            patients appear in the order in which they
+                            were processed
+
+    diagnoses_<date>.csv    one 'patient_id,diagnosis' line per patient
+
+Only counters are kept for the diagnosis summary. If the diagnoses file is to
+be sorted by patient id, the lines are written to sorted run files of at most
+SORT_RUN_SIZE lines, which are merged into the final file on close.
+
+If a compression format from compression.py is given, the debug files and
+the diagnoses file are compressed as they are written, and the extension
+for the format is appended to their names. The sort run files are temporary
+and are not compressed.
+
+The files are written under names with the prefix PARTIAL_PREFIX, and are
+renamed to their final names when the writer is closed. A run that fails
+can call 'discard' instead, which removes the partial files, so that an
+output file with its final name is always complete.
+
+"""
+
+import os
+import heapq
+import tempfile
+
+from . import compression
+from . import diagnose_covid as dc
+
+# write up to this many patients per debug file
+MAX_DEBUG_PATIENTS = 1000
+
+# max number of lines sorted in memory when sorting the diagnoses file
+SORT_RUN_SIZE = 100000
+
+# file name suffix for the patients on dexamethasone
+_STR_DEXAMETHASONE = 'dexamethasone'
+
+# prefix of the names of the output files while they are written
+PARTIAL_PREFIX = 'partial_'
+
+# width of the field names in the debug files, for aligning output
+_DEBUG_FIELD_WIDTH = max([len(f) for f in dc.PATIENT_DATA_FIELDS])
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 3
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def _write_sorted_run(lines, run_dir, run_files):
+    """
+    Sort a list of lines and write them to a new run file in 'run_dir'.
+    """
+
+    lines.sort()
+    fd, run_file = tempfile.mkstemp(suffix='.txt', dir=run_dir)
+    with os.fdopen(fd, 'w') as outfile:
+        outfile.writelines(lines)
+    run_files.append(run_file)
+
+    if _TRACE:
+        print('\twrote sort run file "{0}" with {1} lines'.
+              format(run_file, len(lines)))
+
+
+###############################################################################
+def _merge_runs(run_files, filename):
+    """
+    Merge sorted run files into a single sorted file.
+    """
+
+    infiles = [open(run_file, 'r') for run_file in run_files]
+    try:
+        with compression.open_text(filename, 'wt') as outfile:
+            outfile.writelines(heapq.merge(*infiles))
+    finally:
+        for infile in infiles:
+            infile.close()
+
+
+###############################################################################
+def _partial_name(filename):
+    """
+    Return the name under which an output file is written until it is
+    complete. The extension is kept, since it selects the compression.
+    """
+
+    output_dir, name = os.path.split(filename)
+    return os.path.join(output_dir, PARTIAL_PREFIX + name)
+
+
+###############################################################################
+class OutputWriter(object):
+    """
+    Writes the debug files and the diagnoses file for a single input file.
+    """
+
+    def __init__(self, output_dir, date, sort_by_id=True,
+                 max_debug_patients=MAX_DEBUG_PATIENTS, compress=None):
+
+        # create the output dir if it doesn't already exist
+        os.makedirs(output_dir, exist_ok=True)
+
+        self.output_dir = output_dir
+        self.sort_by_id = sort_by_id
+        self.max_debug_patients = max_debug_patients
+
+        # number of patients with each diagnosis
+        self.counts = {code:0 for code in dc.DIAGNOSIS_CODE_TO_TEXT}
+        self.dexa_count = 0
+
+        # one debug file per diagnosis, keyed by the text of the diagnosis
+        self.debug_names = [
+            dc.DIAGNOSIS_CODE_TO_TEXT[code] for code in [
+                dc.DIAG_CRITICAL, dc.DIAG_SEVERE, dc.DIAG_MILD, dc.DIAG_ASYMP,
+                dc.DIAG_UNKNOWN
+            ]
+        ]
+        self.debug_names.append(_STR_DEXAMETHASONE)
+
+        # extension for the compression format, if any
+        ext = ''
+        if compress is not None:
+            ext = compression.EXTENSIONS[compress]
+
+        self.debug_filenames = {}
+        self.debug_files = {}
+        for name in self.debug_names:
+            filename = os.path.join(output_dir,
+                                    'debug_{0}.txt{1}'.format(name, ext))
+            self.debug_filenames[name] = filename
+            self.debug_files[name] = compression.open_text(
+                _partial_name(filename), 'wt')
+
+        self.diagnoses_file = os.path.join(output_dir,
+                                           'diagnoses_{0}.csv{1}'.format(date, ext))
+        if self.sort_by_id:
+            self.run_dir = tempfile.mkdtemp(dir=output_dir)
+            self.run_files = []
+            self.lines = []
+        else:
+            self.outfile = compression.open_text(
+                _partial_name(self.diagnoses_file), 'wt')
+
+    def _write_debug(self, name, index, patient_id, patient_data):
+        if index >= self.max_debug_patients:
+            return
+        outfile = self.debug_files[name]
+        outfile.write('[{0}]: {1}\n'.format(index, patient_id))
+        for field, value in patient_data._asdict().items():
+            outfile.write('\t{0:>{1}} : {2}\n'.
+                          format(field, _DEBUG_FIELD_WIDTH, value))
+        outfile.write('\n')
+
+    def add(self, patient_id, diagnosis, patient_data):
+        """
+        Write the results for a single patient.
+        """
+
+        # the unknown diagnosis is the default
+        if diagnosis not in self.counts:
+            diagnosis = dc.DIAG_UNKNOWN
+        diagnosis_text = dc.DIAGNOSIS_CODE_TO_TEXT[diagnosis]
+
+        self._write_debug(diagnosis_text, self.counts[diagnosis],
+                          patient_id, patient_data)
+        self.counts[diagnosis] += 1
+
+        # special handling for all patients on dexamethasone
+        if patient_data.on_dexamethasone:
+            self._write_debug(_STR_DEXAMETHASONE, self.dexa_count,
+                              patient_id, patient_data)
+            self.dexa_count += 1
+
+        line = '{0},{1}\n'.format(patient_id, diagnosis_text)
+        if self.sort_by_id:
+            self.lines.append(line)
+            if len(self.lines) >= SORT_RUN_SIZE:
+                _write_sorted_run(self.lines, self.run_dir, self.run_files)
+                self.lines = []
+        else:
+            self.outfile.write(line)
+
+    def patient_count(self):
+        return sum(self.counts.values())
+
+    def close(self):
+        """
+        Close all files, sorting the diagnoses file if required, and give
+        them their final names.
+        """
+
+        for name in self.debug_names:
+            self.debug_files[name].close()
+            filename = self.debug_filenames[name]
+            os.replace(_partial_name(filename), filename)
+            print('Wrote file "{0}"'.format(filename))
+
+        partial_file = _partial_name(self.diagnoses_file)
+        if self.sort_by_id:
+            if len(self.lines) > 0:
+                _write_sorted_run(self.lines, self.run_dir, self.run_files)
+                self.lines = []
+            _merge_runs(self.run_files, partial_file)
+            self._remove_runs()
+        else:
+            self.outfile.close()
+        os.replace(partial_file, self.diagnoses_file)
+
+        print('Wrote output file "{0}"'.format(self.diagnoses_file))
+
+    def discard(self):
+        """
+        Close and remove all files, for a run that failed.
+        """
+
+        filenames = [self.debug_filenames[name] for name in self.debug_names]
+        for name in self.debug_names:
+            self.debug_files[name].close()
+
+        if self.sort_by_id:
+            self.lines = []
+            self._remove_runs()
+        else:
+            self.outfile.close()
+            filenames.append(self.diagnoses_file)
+
+        for filename in filenames:
+            partial_file = _partial_name(filename)
+            if os.path.isfile(partial_file):
+                os.remove(partial_file)
+
+        if _TRACE:
+            print('\tdiscarded the output files in "{0}"'.
+                  format(self.output_dir))
+
+    def _remove_runs(self):
+        for run_file in self.run_files:
+            os.remove(run_file)
+        self.run_files = []
+        os.rmdir(self.run_dir)
+
+    def summary(self):
+        """
+        Return a printable summary of the number of patients per diagnosis.
+        """
+
+        lines = ['Diagnosis summary: ']
+        lines.append('\tCritical     : {0:>9}'.format(self.counts[dc.DIAG_CRITICAL]))
+        lines.append('\tSevere       : {0:>9}'.format(self.counts[dc.DIAG_SEVERE]))
+        lines.append('\tMild         : {0:>9}'.format(self.counts[dc.DIAG_MILD]))
+        lines.append('\tAsymptomatic : {0:>9}'.format(self.counts[dc.DIAG_ASYMP]))
+        lines.append('\tUnknown      : {0:>9}'.format(self.counts[dc.DIAG_UNKNOWN]))
+        lines.append('\t       Total : {0:>9}'.format(self.patient_count()))
+        lines.append('')
+        lines.append('Found {0} patients on dexamethasone.'.format(self.dexa_count))
+
+        return '\n'.join(lines)
@@ -0,0 +1,1637 @@
+#!/usr/bin/env python3
+"""
+
+Driver for diagnosing the severity of Covid-19 from a SET-NET CSV extract.
+
+The supporting functions in this module were moved here from the SetNet_csv
+notebook. The driver works in three stages:
+
+    1. Read a chunk of rows from the CSV file. Add the text fields of each
+       row to a TextPlan, which assigns an id to each distinct text in each
+       text column, and keep a compact record of the other fields needed
+       for each row.
+
+    2. Run segmentation and the finders once per distinct text, column by
+       column. Segmentation is done in batches with spaCy's 'pipe' method.
+
+    3. Fan the text results back out to the rows, combine them with the
+       radio-button values, and diagnose each patient. The results are
+       passed to an output.OutputWriter as each patient is completed, so
+       only the rows of the current chunk are held in memory.
+
+The work for each chunk is split into stages, run on separate threads and
+connected by bounded queues (see stages.py), so that reading and writing
+overlap with the NLP work:
+
+    read     read and parse a chunk of rows from the CSV file
+    segment  build the TextPlan for the chunk and segment its texts
+    find     run the finders and diagnose the patients
+    write    pass the results to the output writer, manifest, and checkpoint
+
+Each chunk has its own TextPlan, so that one chunk can be segmented while the
+finders run on the previous one. A summary of the time spent in each stage
+and the depth of each queue is printed when the run completes.
+
+A large file can instead be split into byte-range shards (see shards.py),
+which are read, segmented, and diagnosed by the workers of an executor (see
+executors.py). Each worker is given only the byte offsets of its shard, and
+returns the results for the rows of the shard. The results are written in
+file order by the main process, so the output is the same as for a single
+reader. The module versions and the spaCy model name are sent to the
+workers, which refuse to run if theirs differ.
+
+The input file may be compressed with gzip, xz, or zstd (see compression.py),
+in which case it is decompressed as it is read and is not split into shards.
+
+If a manifest file is given, rows whose fields are unchanged since the run
+that wrote the manifest are not added to the plan. Their features and
+diagnoses are carried forward from the manifest instead.
+
+If a checkpoint directory is given, the results for each chunk are saved
+there when the chunk is complete. An interrupted run can then be resumed,
+and the rows in the checkpoint are carried forward in the same way.
+
+The manifest and checkpoint headers record the settings that change the saved
+results (segmentation, debug fields, text budget) along with the module
+versions, so that results are only carried forward into a run with the same
+settings.
+
+The time spent in each stage and the counts of rows, texts, and sentences
+are recorded in a metrics.Metrics object (see metrics.py), which is printed
+at the end of the run and can be written to a JSON file and to a Prometheus
+text file. A progress line with the estimated time remaining is printed
+periodically during a long run.
+
+Memory profiling is opt-in. If enabled, the memory used by each stage, the
+peak RSS of each worker, the memory retained for each patient, and the top
+allocation sites are reported at the end of the run (see memory_profile.py).
+A run with a memory budget stops with a MemoryBudgetError as soon as the
+RSS of any of its processes exceeds the budget.
+
+The work done on any single text is bounded by a text_budget.TextBudget.
+Every finder is run on capped windows of bounded length, and texts that
+exceed the budget are flagged in the 'budget_flags' field of the
+PatientData. The results for rows with truncated texts are not saved to the
+manifest, checkpoint, or result cache, so these rows are processed again by
+the next run.
+
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import time
+from collections import namedtuple
+
+from . import segmentation
+from . import fields
+from . import manifest
+from . import checkpoint
+from . import text_plan
+from . import text_budget
+from . import stages
+from . import shards
+from . import executors
+from . import metrics
+from . import memory_profile
+from . import compression
+from . import o2sat_finder as o2f
+from . import symptom_finder as sf
+from . import diagnose_covid as dc
+from . import covid_diagnosis_finder as cf
+
+# attempt to segment texts longer than this into sentences
+SEG_CHECK_LEN = 100  # length in characters
+
+# number of rows to process between checkpoints
+CHUNK_SIZE = 20000
+
+# max number of chunks waiting between two stages of 'run'
+STAGE_QUEUE_SIZE = 2
+
+# text columns, in the order in which they are stored in each RowRecord
+TEXT_COLS = [
+    'mg_notes',         # abstractor notes
+    'mv_comp_oth_sp',   # description of other complications
+    'mg_death_dx',      # cause of death
+    'mv_sx_oth_sp',     # other symptoms specified
+    'mv_tx_oth_sp1',    # medication 1
+    'mv_tx_oth_sp2',    # medication 2
+    'mv_tx_oth_sp3',    # medication 3
+]
+
+# date columns; the diagnosis only needs the difference, so order is unimportant
+DATE_COLS = [
+    'mg_decon_icuadm_dt',   # date of ICU admission
+    'cv_sn_pos_spec1',      # date of positive Covid test
+]
+
+# radio-button columns; values are 1=Yes, 0=No, 88=not reported
+USER_RADIO_COLS = [
+    'mv_comp_mv',        # mechanical ventilation
+    'mv_comp_ecmo',      # ECMO machine
+    'mv_icu',            # admitted to ICU for Covid-19
+    'mv_comp_ards',      # has ARDS
+    'mv_comp_pna',       # pneumonia
+    'mv_sx',             # symptoms present during course of illness
+    'mv_sx_fever',       # fever
+    'mv_sx_sfever',      # subjective fever, felt feverish
+    'mv_sx_chills',      # chills
+    'mv_sx_rigors',      # rigors
+    'mv_sx_myalgia',     # muscle aches (myalgias)
+    'mv_sx_runnose',     # runny nose (rhinorrhea)
+    'mv_sx_sthroat',     # sore throat
+    'mv_sx_taste',       # new olfactory and taste disorder
+    'mv_sx_fatigue',     # fatigue
+    'mv_sx_cough',       # cough
+    'mv_sx_wheezing',    # wheezing
+    'mv_sx_sob',         # shortness of breath (dyspnea)
+    'mv_sx_breath',      # difficulty breathing
+    'mv_sx_chest',       # chest pain
+    'mv_sx_nauvom',      # nausea or vomiting
+    'mv_sx_head',        # headache
+    'mv_sx_abdom',       # abdominal pain
+    'mv_sx_diarrhea',    # diarrhea
+    'mv_sx_oth',         # other symptoms
+    'mv_tx_rem',         # remdesivir
+]
+
+# maps a radio column name to its index in RowRecord.radio and the radio
+# Boolean lists from 'convert_fields'
+RADIO_COL_MAP = {col_name:i for i, col_name in enumerate(USER_RADIO_COLS)}
+
+# the fields of a CSV row that are needed to diagnose the patient
+ROW_RECORD_FIELDS = [
+    'index',            # line index in the file, header is line 0
+    'user_id',
+    'radio',            # tuple of radio values, in USER_RADIO_COLS order
+    'dates',            # tuple of date strings, in DATE_COLS order
+    'texts',            # tuple of text fields, in TEXT_COLS order
+    'text_ids',         # tuple of TextPlan ids, in TEXT_COLS order
+    'row_hash',         # hash of the radio, date, and text fields
+    'prior',            # (diagnosis, PatientData) from the manifest, or None
+]
+RowRecord = namedtuple('RowRecord', ROW_RECORD_FIELDS)
+
+# the finder tasks to run on the texts of a given column
+COLUMN_TASK_FIELDS = [
+    'ignore_common',    # ignore nausea, vomiting, and abdominal pain
+    'pneumonia',        # check for pneumonia
+    'o2',               # check for O2 devices, flow rates, and O2 needs
+    'death',            # check for Covid as a cause of death
+]
+ColumnTasks = namedtuple('ColumnTasks', COLUMN_TASK_FIELDS)
+
+TEXT_COL_TASKS = {
+    'mg_notes'       : ColumnTasks(True,  True,  True,  False),
+    'mv_comp_oth_sp' : ColumnTasks(True,  True,  True,  False),
+    # do not need to scan the death text for O2 devices or flow rates
+    'mg_death_dx'    : ColumnTasks(True,  True,  False, True),
+    'mv_sx_oth_sp'   : ColumnTasks(True,  True,  True,  False),
+    # sometimes O2 use is listed with the medications
+    'mv_tx_oth_sp1'  : ColumnTasks(False, False, True,  False),
+    'mv_tx_oth_sp2'  : ColumnTasks(False, False, True,  False),
+    'mv_tx_oth_sp3'  : ColumnTasks(False, False, True,  False),
+}
+
+# the results of running the finders on a single distinct text
+TEXT_RESULT_FIELDS = [
+    'symptoms',         # sf.SymptomTuple or None
+    'has_pneumonia',
+    'o2_summary',       # o2f.O2Summary, shared by all rows with the text
+    'o2_lists',         # O2Lists namedtuple in debug mode, otherwise None
+    'died_from_covid',
+    'budget_flag',      # a text_budget FLAG_ string, or None
+]
+TextResult = namedtuple('TextResult', TEXT_RESULT_FIELDS)
+
+# the results for a chunk or a shard, for the write stage of 'run'
+CHUNK_RESULT_FIELDS = [
+    'plan_stats',       # list of text_plan.DedupStats
+    'rows',             # list of (user_id, row_hash, diagnosis, PatientData)
+]
+ChunkResult = namedtuple('ChunkResult', CHUNK_RESULT_FIELDS)
+
+# the settings for the shard worker processes
+SHARD_OPTIONS_FIELDS = [
+    'input_file',
+    'col_names',
+    'col_map',
+    'entries',          # manifest and checkpoint entries keyed by patient id
+    'do_segmentation',
+    'keep_debug_fields',
+    'budget',
+    'chunk_size',
+    'profile_memory',   # True to trace the memory used by the stages
+    'memory_budget_mb', # max RSS of a worker in MB, or None
+]
+ShardOptions = namedtuple('ShardOptions', SHARD_OPTIONS_FIELDS)
+
+# the settings that must match between the main process and the workers
+WORKER_CONFIG_FIELDS = [
+    'versions',         # from 'get_versions'
+    'model_name',       # the spaCy model used for segmentation
+]
+WorkerConfig = namedtuple('WorkerConfig', WORKER_CONFIG_FIELDS)
+
+# the results of a shard worker
+SHARD_RESULT_FIELDS = [
+    'chunk_result',             # ChunkResult for all rows of the shard
+    'budget_stats',             # text_budget.BudgetStats
+    'corrupted_line_indices',
+    'metrics',                  # metrics.Metrics for the shard
+    'memory_profile',           # memory_profile.MemoryProfile, or None
+]
+ShardResult = namedtuple('ShardResult', SHARD_RESULT_FIELDS)
+
+# the individual O2 results, kept only for the debug output
+O2_LISTS_FIELDS = [
+    'flow_rates',       # each list has one entry per O2Tuple
+    'devices',
+    'device_types',     # o2f.DEVICE_TYPE_NC, o2f.DEVICE_TYPE_HFNC, etc.
+    'needs_o2',
+]
+O2Lists = namedtuple('O2Lists', O2_LISTS_FIELDS)
+
+EMPTY_TEXT_RESULT = TextResult(
+    symptoms        = None,
+    has_pneumonia   = False,
+    o2_summary      = o2f.O2Summary(),
+    o2_lists        = None,
+    died_from_covid = False,
+    budget_flag     = None,
+)
+
+# recognize mentions of Covid-19 in the cause of death
+_str_covid_death = r'\b(covid([- ]?19)?|sars-cov-2|(novel )?coronavirus)'
+_regex_covid_death = re.compile(_str_covid_death, re.IGNORECASE)
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 25
+
+# set to True to enable debug output
+_TRACE = False
+
+# the sentence segmentor
+_seg_obj = segmentation.Segmentation()
+
+# the ShardOptions in a shard worker process, see '_init_shard_worker'
+_shard_options = None
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def get_versions():
+    """
+    Return a list of the versions of all modules that affect the results.
+    """
+
+    return [
+        get_version(),
+        fields.get_version(),
+        segmentation.get_version(),
+        o2f.get_version(),
+        sf.get_version(),
+        cf.get_version(),
+        dc.get_version(),
+        text_budget.get_version(),
+    ]
+
+
+###############################################################################
+def get_settings(do_segmentation, keep_debug_fields, budget):
+    """
+    Return a list of the run settings that affect the saved results, for the
+    manifest and checkpoint headers.
+    """
+
+    budget_setting = None
+    if budget is not None:
+        budget_setting = list(budget)
+
+    return [
+        'do_segmentation {0}'.format(do_segmentation),
+        'keep_debug_fields {0}'.format(keep_debug_fields),
+        'budget {0}'.format(budget_setting),
+    ]
+
+
+###############################################################################
+def extract_fields(sentence, run_fn, decode_type):
+    """
+    Run a finder function and decode the json result to the specified type.
+    """
+
+    json_result = run_fn(sentence)
+    json_data = json.loads(json_result)
+    computed_values = [decode_type(**d) for d in json_data]
+
+    return computed_values
+
+
+###############################################################################
+def extract_symptoms_from_text(text, ignore_common=False):
+    """
+    Run the symptom finding code on the given text and return a SymptomTuple
+    object, or None if the text is empty. The symptom finder is run on the
+    entire text, so no sentence segmentation is needed.
+    """
+
+    if text is None or 0 == len(text) or text.isspace():
+        return None
+
+    json_result = sf.run(text, ignore_common)
+    json_data = json.loads(json_result)
+    obj_list = [sf.SymptomTuple(**d) for d in json_data]
+    assert 1 == len(obj_list)
+    return obj_list[0]
+
+
+###############################################################################
+def has_symptom(symptom_key, symptom_obj_list):
+    """
+    Scan the sf.SymptomTuple objects in the list and determine whether any have the named symptom.
+    """
+
+    for obj in symptom_obj_list:
+        for k,v in obj._asdict().items():
+            if k == symptom_key:
+                assert v is not None
+                if v:
+                    return True
+
+    return False
+
+
+###############################################################################
+def covid_caused_death(death_text):
+    """
+    Determine whether Covid is stated as a cause of death in the given text.
+    This function should only operate on the 'mg_death_dx' text field.
+    """
+
+    # collapse repeated whitespace
+    text = re.sub(r'\s+', ' ', death_text)
+
+    match = _regex_covid_death.search(text)
+    if match:
+        return True
+    else:
+        return False
+
+
+###############################################################################
+def has_pneumonia_from_txt(text):
+    """
+    Check a text field to determine whether the patient has pneumonia.
+    """
+
+    if 0 == len(text) or text.isspace():
+        return False
+
+    cf_list = extract_fields(text, cf.run, cf.CovidDiagnosisTuple)
+    assert 1 == len(cf_list)
+    return cf_list[0].has_pneumonia
+
+
+###############################################################################
+def extract_o2_info(text, sentences, keep_lists=False, budget=None):
+    """
+    Search the sentences of a text for statements about Oxygen usage and
+    extract flow rates and devices. Returns an o2f.O2Summary, and an O2Lists
+    namedtuple with the individual results if 'keep_lists' is True, or None.
+    If 'sentences' is None the text is split with the O2 finder's sentence
+    splitter. The O2 finder is only run on sentences with O2 keywords, and
+    sentences longer than the window length of the text_budget.TextBudget
+    'budget' are split first.
+    """
+
+    o2_summary = o2f.O2Summary()
+    o2_lists = None
+    if keep_lists:
+        o2_lists = O2Lists([], [], [], [])
+
+    if sentences is None:
+        sentences = []
+        if o2f.has_o2_content(text):
+            sentences = o2f.split_sentences(text)
+
+    for sentence in text_budget.split_sentences(sentences, budget):
+        if not o2f.has_o2_content(sentence):
+            continue
+        # use the O2Tuples directly, no need for a JSON round trip
+        o2_list = o2f.extract(sentence)
+        for item in o2_list:
+            o2_summary.add(item)
+            if keep_lists:
+                # patient needs O2 if a flow rate is present
+                needs_o2 = item.needs_o2 or item.needs_o2_device or item.needs_o2_flow
+                o2_lists.flow_rates.append(item.flow_rate)
+                o2_lists.devices.append(item.device)
+                o2_lists.device_types.append(item.device_type)
+                o2_lists.needs_o2.append(needs_o2)
+
+    return o2_summary, o2_lists
+
+
+###############################################################################
+def segment_texts(texts, do_segmentation=True):
+    """
+    Return a list of sentence lists, one for each text. Texts without any O2
+    content are not segmented and get an empty list, since the O2 finder
+    would not find anything in them. Only texts longer than SEG_CHECK_LEN are
+    segmented, and these are segmented as a single batch.
+    """
+
+    start_time = time.perf_counter()
+
+    sentence_lists = []
+    for text in texts:
+        if o2f.has_o2_content(text):
+            sentence_lists.append([text])
+        else:
+            sentence_lists.append([])
+    if do_segmentation:
+        long_indices = [i for i, text in enumerate(texts)
+                        if len(text) > SEG_CHECK_LEN and len(sentence_lists[i]) > 0]
+        if len(long_indices) > 0:
+            long_texts = [texts[i] for i in long_indices]
+            batch = _seg_obj.parse_sentences_batch(long_texts)
+            for i, sentences in zip(long_indices, batch):
+                sentence_lists[i] = sentences
+
+    metrics.add_time(metrics.STAGE_SEGMENTATION, time.perf_counter() - start_time)
+    metrics.count(metrics.COUNTER_SENTENCES,
+                  sum([len(sentences) for sentences in sentence_lists]))
+
+    return sentence_lists
+
+
+###############################################################################
+def _run_text(text, sentences, tasks, keep_debug_fields, budget):
+    """
+    Run the finders on a single text and return a TextResult. The 'sentences'
+    argument is the list of sentences from 'segment_texts', or None to split
+    the text with the O2 finder's sentence splitter. The 'budget' caps the
+    text and limits the length of the windows given to the symptom, covid,
+    and death finders and of the sentences given to the O2 finder.
+    """
+
+    windows = text_budget.split_sentences([text], budget)
+
+    t0 = time.perf_counter()
+    symptom_list = [extract_symptoms_from_text(w, tasks.ignore_common)
+                    for w in windows]
+    symptoms = _merge_symptoms(symptom_list)
+    t1 = time.perf_counter()
+    metrics.add_time(metrics.STAGE_SYMPTOM, t1 - t0)
+
+    has_pneumonia = False
+    if tasks.pneumonia:
+        has_pneumonia = any([has_pneumonia_from_txt(w) for w in windows])
+        t2 = time.perf_counter()
+        metrics.add_time(metrics.STAGE_COVID, t2 - t1)
+        t1 = t2
+
+    o2_summary, o2_lists = EMPTY_TEXT_RESULT.o2_summary, None
+    if tasks.o2:
+        o2_summary, o2_lists = extract_o2_info(text, sentences,
+                                               keep_debug_fields, budget)
+        metrics.add_time(metrics.STAGE_O2, time.perf_counter() - t1)
+
+    died_from_covid = False
+    if tasks.death:
+        died_from_covid = any([covid_caused_death(w) for w in windows])
+
+    return TextResult(
+        symptoms        = symptoms,
+        has_pneumonia   = has_pneumonia,
+        o2_summary      = o2_summary,
+        o2_lists        = o2_lists,
+        died_from_covid = died_from_covid,
+        budget_flag     = None,
+    )
+
+
+###############################################################################
+def _merge_symptoms(symptom_list):
+    """
+    Combine the SymptomTuples (or None) for the windows of a single text. A
+    symptom is present in the text if it is present in any window.
+    """
+
+    symptom_list = [obj for obj in symptom_list if obj is not None]
+    if 0 == len(symptom_list):
+        return None
+    if 1 == len(symptom_list):
+        return symptom_list[0]
+
+    values = {'sentence':' '.join([obj.sentence for obj in symptom_list])}
+    for field in sf.SYMPTOM_TUPLE_FIELDS[1:]:
+        values[field] = any([getattr(obj, field) for obj in symptom_list])
+    return sf.SymptomTuple(**values)
+
+
+###############################################################################
+def _merge_text_results(window_results, flag):
+    """
+    Combine the TextResults for the windows of a single text. A symptom or
+    condition is present in the text if it is present in any window.
+    """
+
+    symptoms = _merge_symptoms([r.symptoms for r in window_results])
+
+    o2_summary = o2f.O2Summary()
+    o2_lists = None
+    for r in window_results:
+        o2_summary.merge(r.o2_summary)
+        if r.o2_lists is not None:
+            if o2_lists is None:
+                o2_lists = O2Lists([], [], [], [])
+            for dest, src in zip(o2_lists, r.o2_lists):
+                dest.extend(src)
+
+    return TextResult(
+        symptoms        = symptoms,
+        has_pneumonia   = any([r.has_pneumonia for r in window_results]),
+        o2_summary      = o2_summary,
+        o2_lists        = o2_lists,
+        died_from_covid = any([r.died_from_covid for r in window_results]),
+        budget_flag     = flag,
+    )
+
+
+###############################################################################
+def _segment_column(texts, do_segmentation=True, budget=None):
+    """
+    Return the sentence lists from 'segment_texts' for the distinct texts of
+    a column. Texts over the budget are not given to the segmenter, since
+    their windows are split into sentences with the regex splitter instead.
+    """
+
+    seg_texts = [text if text_budget.split_windows(text, budget) is None else ''
+                 for text in texts]
+    return segment_texts(seg_texts, do_segmentation)
+
+
+###############################################################################
+def run_texts(texts, tasks, do_segmentation=True, keep_debug_fields=False,
+              budget=None, budget_stats=None, sentence_lists=None):
+    """
+    Run the finders on a list of distinct texts from a single column. The
+    'tasks' argument is a ColumnTasks namedtuple. Returns a list of TextResult
+    namedtuples, one for each text. The individual O2 results are kept only
+    if 'keep_debug_fields' is True.
+
+    The finders are run on capped windows of each text within the
+    text_budget.TextBudget 'budget', and texts that exceed it are flagged.
+    The time taken for each text is recorded in the text_budget.BudgetStats
+    'budget_stats', if given.
+
+    The 'sentence_lists' for the O2 finder are computed if not given; see
+    'segment_plan'.
+    """
+
+    window_lists = [text_budget.split_windows(text, budget) for text in texts]
+    metrics.count(metrics.COUNTER_TEXTS, len(texts))
+
+    if tasks.o2 and sentence_lists is None:
+        sentence_lists = _segment_column(texts, do_segmentation, budget)
+
+    results = []
+    for i, text in enumerate(texts):
+        start_time = time.perf_counter()
+
+        windows = window_lists[i]
+        if windows is None:
+            sentences = None
+            if tasks.o2:
+                sentences = sentence_lists[i]
+            result = _run_text(text, sentences, tasks, keep_debug_fields,
+                               budget)
+            if text_budget.cap_text(text, budget) != text:
+                result = result._replace(budget_flag=text_budget.FLAG_CAPPED)
+        else:
+            run_fn = lambda w: _run_text(w, None, tasks, keep_debug_fields,
+                                         budget)
+            window_results, flag = text_budget.run_windows(windows, run_fn,
+                                                           budget)
+            result = _merge_text_results(window_results, flag)
+            if _TRACE:
+                print('\t{0} text of {1} chars, {2} of {3} windows processed'.
+                      format(flag, len(text), len(window_results),
+                             len(windows)))
+
+        if budget_stats is not None:
+            window_count = 0
+            if windows is not None:
+                window_count = len(windows)
+            budget_stats.add(len(text), time.perf_counter() - start_time,
+                             result.budget_flag, window_count)
+
+        results.append(result)
+
+    return results
+
+
+###############################################################################
+def _is_truncated(patient_data):
+    """
+    Return True if any text of the PatientData was truncated by the budget.
+    """
+
+    if patient_data.budget_flags is None:
+        return False
+
+    suffix = ':' + text_budget.FLAG_TRUNCATED
+    return any([flag.endswith(suffix) for flag in patient_data.budget_flags])
+
+
+###############################################################################
+def read_header(input_file):
+    """
+    Read the column names from the first line of the CSV file. Returns the
+    list of lowercase column names and a dict mapping name to column index.
+    """
+
+    with compression.open_text(input_file, newline='') as csvfile:
+        line = csvfile.readline()
+
+    reader = csv.reader([line])
+    col_names = list(reader)[0]
+    # convert all column names to lowercase
+    col_names = [name.lower() for name in col_names]
+
+    col_map = {}
+    for j, col_name in enumerate(col_names):
+        col_map[col_name] = j
+
+    return col_names, col_map
+
+
+###############################################################################
+def _parse_line(line):
+    """
+    Return the fields of a single line of the CSV file, or None if the csv
+    module cannot parse it.
+    """
+
+    try:
+        reader = csv.reader([line])
+        return list(reader)[0]
+    except csv.Error:
+        return None
+
+
+###############################################################################
+def _is_record(raw_lines, col_count):
+    """
+    Return True if the lines of a multi-line record hold a single well-formed
+    record. Two stray quotes in different rows can join the rows between them
+    into one record with the right number of fields, but then the closing
+    quote is usually not followed by a comma or a line end, or the lines in
+    between are complete rows by themselves.
+    """
+
+    try:
+        records = list(csv.reader(raw_lines, strict=True))
+    except csv.Error:
+        return False
+
+    if 1 != len(records) or col_count != len(records[0]):
+        return False
+
+    for line in raw_lines[1:]:
+        line_items = _parse_line(line)
+        if line_items is not None and col_count == len(line_items):
+            return False
+
+    return True
+
+
+###############################################################################
+def _parsed_lines(line_index, line_items, raw_lines, col_count):
+    """
+    Return a list of (line_index, line_items) for a record from
+    shards.read_records. A record that spans several lines is only kept if
+    it is a single well-formed record; otherwise it is probably the result of
+    a stray quote, so its lines are parsed separately instead, as are the
+    lines of a record that could not be parsed at all. The 'line_items' of a
+    line that cannot be parsed by itself are None.
+    """
+
+    if line_items is not None:
+        if len(raw_lines) <= 1:
+            return [(line_index, line_items)]
+        if len(line_items) == col_count and _is_record(raw_lines, col_count):
+            return [(line_index, line_items)]
+
+    parsed = []
+    for i, line in enumerate(raw_lines):
+        parsed.append( (line_index + i, _parse_line(line)) )
+
+    return parsed
+
+
+###############################################################################
+def read_rows(input_file, col_names, col_map, corrupted_line_indices,
+              shard=None):
+    """
+    Generator yielding a RowRecord namedtuple for each data row in the CSV
+    file. The 'text_ids' and 'prior' fields are filled in by 'build_plan'.
+    The indices of corrupted lines are appended to 'corrupted_line_indices'.
+    Only the rows in the shards.Shard 'shard' are read, if given. Quoted
+    fields may contain newlines.
+    """
+
+    col_indices = column_indices(col_map)
+
+    for i, line_items in read_lines(input_file, col_names,
+                                    corrupted_line_indices, shard):
+        yield row_from_items(i, line_items, col_indices)
+
+
+###############################################################################
+def read_lines(input_file, col_names, corrupted_line_indices, shard=None):
+    """
+    Generator yielding a (line_index, line_items) tuple for each data row in
+    the CSV file, or in the shards.Shard 'shard' if given, without converting
+    it to a RowRecord. The indices of corrupted lines are appended to
+    'corrupted_line_indices'.
+    """
+
+    if shard is None:
+        shard = shards.whole_file(input_file)
+
+    for record in shards.read_records(input_file, shard):
+        for i, line_items in _parsed_lines(*record, len(col_names)):
+            # skip line if unexpected number of items present, probably decode error
+            if line_items is None or len(line_items) != len(col_names):
+                corrupted_line_indices.append(i)
+                continue
+            yield i, line_items
+
+
+###############################################################################
+def column_indices(col_map):
+    """
+    Return the lists of the radio, date, and text column indices in the CSV
+    file, for 'row_from_items'.
+    """
+
+    radio_col_indices = [col_map[col_name] for col_name in USER_RADIO_COLS]
+    date_col_indices  = [col_map[col_name] for col_name in DATE_COLS]
+    text_col_indices  = [col_map[col_name] for col_name in TEXT_COLS]
+
+    return radio_col_indices, date_col_indices, text_col_indices
+
+
+###############################################################################
+def row_from_items(index, line_items, col_indices):
+    """
+    Return a RowRecord for the parsed fields of a CSV row, given the column
+    indices from 'column_indices'.
+    """
+
+    radio_col_indices, date_col_indices, text_col_indices = col_indices
+
+    radio = tuple([line_items[j] for j in radio_col_indices])
+    dates = tuple([line_items[j] for j in date_col_indices])
+    texts = tuple([line_items[j] for j in text_col_indices])
+
+    return RowRecord(
+        index    = index,
+        # 0th col is the user id
+        user_id  = line_items[0],
+        radio    = radio,
+        dates    = dates,
+        texts    = texts,
+        text_ids = None,
+        row_hash = manifest.row_hash(radio + dates + texts),
+        prior    = None,
+    )
+
+
+###############################################################################
+def row_from_record(index, user_id, record):
+    """
+    Return a RowRecord for a single patient record given as a dict mapping
+    column name to value, such as a record received as JSON. Column names are
+    not case sensitive. Missing columns and None values are treated as empty
+    fields, and all other values are converted to strings, so that a radio
+    value may be given as either 1 or '1'.
+    """
+
+    values = {}
+    for k,v in record.items():
+        if v is None:
+            v = ''
+        values[k.lower()] = str(v)
+
+    radio = tuple([values.get(col_name, '') for col_name in USER_RADIO_COLS])
+    dates = tuple([values.get(col_name, '') for col_name in DATE_COLS])
+    texts = tuple([values.get(col_name, '') for col_name in TEXT_COLS])
+
+    return RowRecord(
+        index    = index,
+        user_id  = user_id,
+        radio    = radio,
+        dates    = dates,
+        texts    = texts,
+        text_ids = None,
+        row_hash = manifest.row_hash(radio + dates + texts),
+        prior    = None,
+    )
+
+
+###############################################################################
+def build_plan(plan, rows, prior_entries=None, keep_debug_fields=False):
+    """
+    Add the texts of a list of RowRecords to a TextPlan. Returns a new list of
+    RowRecords with the 'text_ids' field filled in.
+
+    The 'prior_entries' argument is a dict of manifest entries keyed by
+    patient id. The texts of rows that match their entry are not added to
+    the plan; instead the 'prior' field is set to the (diagnosis, PatientData)
+    tuple from the entry. The texts are only kept in the PatientData if
+    'keep_debug_fields' is True.
+    """
+
+    if prior_entries is None:
+        prior_entries = {}
+
+    planned_rows = []
+    for row in rows:
+        entry = prior_entries.get(row.user_id)
+        if entry is not None and entry.row_hash == row.row_hash:
+            # unchanged since the entry was written, carry forward
+            text_list = None
+            if keep_debug_fields:
+                text_list = make_text_list(*row.texts)
+            patient_data = manifest.decode_features(entry.features, text_list)
+            planned_rows.append(row._replace(
+                text_ids = (text_plan.EMPTY_ID,) * len(TEXT_COLS),
+                prior    = (entry.diagnosis, patient_data),
+            ))
+        else:
+            text_ids = tuple([
+                plan.add(col_name, text)
+                for col_name, text in zip(TEXT_COLS, row.texts)
+            ])
+            planned_rows.append(row._replace(text_ids=text_ids))
+
+    return planned_rows
+
+
+###############################################################################
+def segment_plan(plan, do_segmentation=True, budget=None):
+    """
+    Segment the distinct texts of each column of the plan that is searched by
+    the O2 finder. Returns a dict mapping the column name to the list of
+    sentence lists for its texts, for 'run_plan'.
+    """
+
+    sentence_lists = {}
+    for col_name in TEXT_COLS:
+        if TEXT_COL_TASKS[col_name].o2:
+            sentence_lists[col_name] = _segment_column(plan.texts(col_name),
+                                                       do_segmentation, budget)
+
+    return sentence_lists
+
+
+###############################################################################
+def _cached_run_fn(col_name, run_fn, cache):
+    """
+    Wrap the function 'run_fn' from 'run_plan', which takes a list of texts
+    and their sentence lists, so that only the texts that are not in the
+    result_cache.ResultCache 'cache' are run.
+    """
+
+    def cached_run_fn(texts, sentence_list):
+        def run_missing(indices):
+            missing_sentences = None
+            if sentence_list is not None:
+                missing_sentences = [sentence_list[i] for i in indices]
+            return run_fn([texts[i] for i in indices], missing_sentences)
+        return cache.run(col_name, texts, run_missing)
+
+    return cached_run_fn
+
+
+###############################################################################
+def run_plan(plan, do_segmentation=True, keep_debug_fields=False,
+             budget=None, budget_stats=None, sentence_lists=None, cache=None):
+    """
+    Run the finders once for each distinct text in the plan. Returns a dict
+    mapping each text column name to a function that maps a text id to its
+    TextResult. The texts are segmented here unless the 'sentence_lists'
+    from 'segment_plan' are given. The results for texts in the
+    result_cache.ResultCache 'cache' are taken from the cache, if given.
+    """
+
+    if sentence_lists is None:
+        sentence_lists = {}
+
+    lookups = {}
+    for col_name in TEXT_COLS:
+        tasks = TEXT_COL_TASKS[col_name]
+        run_fn = lambda texts, sentence_list: run_texts(texts, tasks,
+                                                        do_segmentation,
+                                                        keep_debug_fields,
+                                                        budget, budget_stats,
+                                                        sentence_list)
+        if cache is not None:
+            run_fn = _cached_run_fn(col_name, run_fn, cache)
+        sentence_list = sentence_lists.get(col_name)
+        lookups[col_name] = plan.run(col_name,
+                                     lambda texts: run_fn(texts, sentence_list),
+                                     EMPTY_TEXT_RESULT)
+        if _TRACE:
+            print('\tran finders on {0} texts from column {1}'.
+                  format(len(plan.texts(col_name)), col_name))
+
+    return lookups
+
+
+###############################################################################
+def convert_fields(rows, date_cols):
+    """
+    Convert the radio-button and date fields of a list of RowRecords. The
+    'date_cols' argument is a list of fields.DateColumn objects in DATE_COLS
+    order. Returns, for each row, a list of radio-button Booleans that are
+    True for 'yes', a list that is True for an explicit 'no', and the two
+    dates as day numbers or None.
+    """
+
+    radio = fields.parse_radio([row.radio for row in rows])
+    radio_yes = (fields.RADIO_YES == radio).tolist()
+    radio_no  = (fields.RADIO_NO  == radio).tolist()
+
+    days = []
+    for j, date_col in enumerate(date_cols):
+        day_array = date_col.parse([row.dates[j] for row in rows])
+        days.append(fields.days_to_list(day_array))
+
+    return radio_yes, radio_no, days[0], days[1]
+
+
+###############################################################################
+def make_text_list(txt_notes, txt_other_comp, txt_death, txt_other_symptoms,
+                   txt_med1, txt_med2, txt_med3):
+    """
+    Return the list of text fields saved in PatientData (mainly for debugging).
+    The texts must be given in TEXT_COLS order.
+    """
+
+    # combine medication texts together for later output
+    txt_med = ' '.join([txt_med1, txt_med2, txt_med3])
+    if txt_med.isspace():
+        # replace with empty string if only whitespace
+        txt_med = ''
+    else:
+        # collapse repeated whitespace
+        txt_med = re.sub(r'\s+', ' ', txt_med)
+
+    return [txt_notes, txt_other_comp, txt_death, txt_other_symptoms, txt_med]
+
+
+###############################################################################
+def make_patient_data(row, lookups, radio_yes, radio_no, day1, day2,
+                      keep_debug_fields=False):
+    """
+    Combine the radio-button values and dates of a row, as converted by
+    'convert_fields', with the results for its texts and return a
+    dc.PatientData namedtuple. The 'text_list' field and the O2 list fields
+    are None unless 'keep_debug_fields' is True.
+    """
+
+    # extract desired discrete fields; 'r' prefix means from a radio button
+    r_vent        = radio_yes[RADIO_COL_MAP['mv_comp_mv']]
+    r_ecmo        = radio_yes[RADIO_COL_MAP['mv_comp_ecmo']]
+    r_icu         = radio_yes[RADIO_COL_MAP['mv_icu']]
+    r_ards        = radio_yes[RADIO_COL_MAP['mv_comp_ards']]
+    r_pna         = radio_yes[RADIO_COL_MAP['mv_comp_pna']]
+    r_sx          = radio_yes[RADIO_COL_MAP['mv_sx']]
+    r_fever1      = radio_yes[RADIO_COL_MAP['mv_sx_fever']]
+    r_fever2      = radio_yes[RADIO_COL_MAP['mv_sx_sfever']]
+    r_cough       = radio_yes[RADIO_COL_MAP['mv_sx_cough']]
+    r_sob         = radio_yes[RADIO_COL_MAP['mv_sx_sob']]
+    r_breath      = radio_yes[RADIO_COL_MAP['mv_sx_breath']]
+    r_rem         = radio_yes[RADIO_COL_MAP['mv_tx_rem']]
+    r_chills      = radio_yes[RADIO_COL_MAP['mv_sx_chills']]
+    r_rigors      = radio_yes[RADIO_COL_MAP['mv_sx_rigors']]
+    r_myalgia     = radio_yes[RADIO_COL_MAP['mv_sx_myalgia']]
+    r_runnose     = radio_yes[RADIO_COL_MAP['mv_sx_runnose']]
+    r_sthroat     = radio_yes[RADIO_COL_MAP['mv_sx_sthroat']]
+    r_smell_taste = radio_yes[RADIO_COL_MAP['mv_sx_taste']]
+    r_fatigue     = radio_yes[RADIO_COL_MAP['mv_sx_fatigue']]
+    r_wheezing    = radio_yes[RADIO_COL_MAP['mv_sx_wheezing']]
+    r_chest       = radio_yes[RADIO_COL_MAP['mv_sx_chest']]
+    r_nauvom      = radio_yes[RADIO_COL_MAP['mv_sx_nauvom']]
+    r_head        = radio_yes[RADIO_COL_MAP['mv_sx_head']]
+    r_abdom       = radio_yes[RADIO_COL_MAP['mv_sx_abdom']]
+    r_diarrhea    = radio_yes[RADIO_COL_MAP['mv_sx_diarrhea']]
+    r_sx_other    = radio_yes[RADIO_COL_MAP['mv_sx_oth']]
+
+    # the symptom Boolean must be explicitly zero to qualify as asymptomatic
+    r_asymptomatic = radio_no[RADIO_COL_MAP['mv_sx']]
+
+    # look up the finder results for each text column
+    results = {}
+    for col_name, text_id in zip(TEXT_COLS, row.text_ids):
+        results[col_name] = lookups[col_name](text_id)
+
+    # combine all symptom objects that are not None
+    symptom_obj_list = []
+    for col_name in TEXT_COLS:
+        if results[col_name].symptoms is not None:
+            symptom_obj_list.append(results[col_name].symptoms)
+
+    has_pneumonia_txt = False
+    for col_name in TEXT_COLS:
+        if results[col_name].has_pneumonia:
+            has_pneumonia_txt = True
+            break
+
+    # O2 info in the same order as the original text list: notes, other
+    # complications, other symptoms, then the three medications
+    o2_summary = o2f.O2Summary()
+    o2_lists = None
+    if keep_debug_fields:
+        o2_lists = O2Lists([], [], [], [])
+    for col_name in ['mg_notes', 'mv_comp_oth_sp', 'mv_sx_oth_sp',
+                     'mv_tx_oth_sp1', 'mv_tx_oth_sp2', 'mv_tx_oth_sp3']:
+        o2_summary.merge(results[col_name].o2_summary)
+        if o2_lists is not None and results[col_name].o2_lists is not None:
+            for dest, src in zip(o2_lists, results[col_name].o2_lists):
+                dest.extend(src)
+
+    # check to see if the patient died from covid
+    died_from_covid = results['mg_death_dx'].died_from_covid
+
+    # columns whose texts exceeded the text budget
+    budget_flags = None
+    for col_name in TEXT_COLS:
+        flag = results[col_name].budget_flag
+        if flag is not None:
+            if budget_flags is None:
+                budget_flags = []
+            budget_flags.append('{0}:{1}'.format(col_name, flag))
+
+    # the raw texts are only needed for debugging
+    text_list = None
+    if keep_debug_fields:
+        text_list = make_text_list(*row.texts)
+
+    if o2_lists is None:
+        o2_lists = O2Lists(None, None, None, None)
+
+    # all data has been extracted, so fill in data object for this patient
+    patient_data = dc.PatientData(
+
+        has_pneumonia       = has_pneumonia_txt or r_pna,
+        has_symptoms        = r_sx,
+        has_other_symptoms  = r_sx_other,
+
+        # covid-relevant symptoms
+        has_fever           = has_symptom('has_fever',           symptom_obj_list) or r_fever1 or r_fever2,
+        has_dyspnea         = has_symptom('has_dyspnea',         symptom_obj_list) or r_sob or r_breath,
+        has_cough           = has_symptom('has_cough',           symptom_obj_list) or r_cough,
+        is_intubated        = has_symptom('is_intubated',        symptom_obj_list),
+        is_ventilated       = has_symptom('is_ventilated',       symptom_obj_list) or r_vent,
+        in_icu              = has_symptom('in_icu',              symptom_obj_list) or r_icu,
+        has_ards_or_rf      = has_symptom('has_ards_or_rf',      symptom_obj_list) or r_ards,
+        on_ecmo             = has_symptom('on_ecmo',             symptom_obj_list) or r_ecmo,
+        has_septic_shock    = has_symptom('has_septic_shock',    symptom_obj_list),
+        has_mod             = has_symptom('has_mod',             symptom_obj_list),
+        on_remdesivir       = has_symptom('on_remdesivir',       symptom_obj_list) or r_rem,
+        on_plasma           = has_symptom('on_plasma',           symptom_obj_list),
+        on_plaquenil        = has_symptom('on_plaquenil',        symptom_obj_list),
+        on_azithromycin     = has_symptom('on_azithromycin',     symptom_obj_list),
+        on_other_drugs      = has_symptom('on_other_drugs',      symptom_obj_list),
+        on_dexamethasone    = has_symptom('on_dexamethasone',    symptom_obj_list),
+
+        # other symptoms
+        has_chills          = has_symptom('has_chills',          symptom_obj_list) or r_chills,
+        has_rigors          = has_symptom('has_rigors',          symptom_obj_list) or r_rigors,
+        has_myalgia         = has_symptom('has_myalgia',         symptom_obj_list) or r_myalgia,
+        has_runny_nose      = has_symptom('has_runny_nose',      symptom_obj_list) or r_runnose,
+        has_sore_throat     = has_symptom('has_sore_throat',     symptom_obj_list) or r_sthroat,
+        has_prob_with_taste = has_symptom('has_prob_with_taste', symptom_obj_list) or r_smell_taste,
+        has_prob_with_smell = has_symptom('has_prob_with_smell', symptom_obj_list) or r_smell_taste,
+        has_fatigue         = has_symptom('has_fatigue',         symptom_obj_list) or r_fatigue,
+        has_wheezing        = has_symptom('has_wheezing',        symptom_obj_list) or r_wheezing,
+        has_chest_pain      = has_symptom('has_chest_pain',      symptom_obj_list) or r_chest,
+        has_nausea          = has_symptom('has_nausea',          symptom_obj_list) or r_nauvom,
+        has_vomiting        = has_symptom('has_vomiting',        symptom_obj_list) or r_nauvom,
+        has_headache        = has_symptom('has_headache',        symptom_obj_list) or r_head,
+        has_abdominal_pain  = has_symptom('has_abdominal_pain',  symptom_obj_list) or r_abdom,
+        has_diarrhea        = has_symptom('has_diarrhea',        symptom_obj_list) or r_diarrhea,
+
+        is_asymptomatic     = has_symptom('is_asymptomatic',     symptom_obj_list) or r_asymptomatic,
+
+        # whether died from covid or not
+        died_from_covid     = died_from_covid,
+
+        # from o2sat finder
+        o2_count            = o2_summary.count,
+        o2_max_flow_rate    = o2_summary.max_flow_rate, # L/min
+        o2_high_flow_device = o2_summary.has_high_flow_device,
+        o2_needs_o2         = o2_summary.needs_o2,
+        o2_min_spo2         = o2_summary.min_spo2,
+        o2_flow_rate_list   = o2_lists.flow_rates, # L/min
+        o2_device_list      = o2_lists.devices,
+        o2_device_type_list = o2_lists.device_types,
+        needs_o2_list       = o2_lists.needs_o2,
+
+        # save all text fields (mainly for debugging)
+        text_list = text_list,
+
+        budget_flags = budget_flags,
+
+        day1 = day1,
+        day2 = day2
+    )
+
+    return patient_data
+
+
+###############################################################################
+def diagnose_chunk(plan, chunk, date_cols, do_segmentation=True,
+                   keep_debug_fields=False, budget=None, budget_stats=None,
+                   sentence_lists=None, cache=None):
+    """
+    Run the finders on the texts in the plan and diagnose each row of a chunk
+    of RowRecords from 'build_plan'. The 'date_cols' argument is a list of
+    fields.DateColumn objects in DATE_COLS order. Returns a list of
+    (diagnosis, PatientData) tuples, one for each row. Rows with a 'prior'
+    result are not diagnosed again. The finder results are taken from and
+    added to the result_cache.ResultCache 'cache', if given.
+    """
+
+    with memory_profile.stage(memory_profile.STAGE_FINDERS):
+        lookups = run_plan(plan, do_segmentation, keep_debug_fields, budget,
+                           budget_stats, sentence_lists, cache)
+
+    with memory_profile.stage(memory_profile.STAGE_DIAGNOSIS):
+        return _diagnose_rows(chunk, lookups, date_cols, keep_debug_fields)
+
+
+###############################################################################
+def _diagnose_rows(chunk, lookups, date_cols, keep_debug_fields):
+
+    radio_yes, radio_no, days1, days2 = convert_fields(chunk, date_cols)
+
+    diagnosed = []
+    for i, row in enumerate(chunk):
+        if row.prior is not None:
+            diagnosed.append(row.prior)
+            continue
+
+        start_time = time.perf_counter()
+        patient_data = make_patient_data(row, lookups,
+                                         radio_yes[i], radio_no[i],
+                                         days1[i], days2[i],
+                                         keep_debug_fields)
+
+        # diagnose the severity of the Covid-19 infection
+        diagnosis = dc.diagnose_covid_severity(patient_data)
+        diagnosed.append( (diagnosis, patient_data) )
+        metrics.add_time(metrics.STAGE_DIAGNOSIS, time.perf_counter() - start_time)
+
+    return diagnosed
+
+
+###############################################################################
+def _chunks(rows, chunk_size, stage=None):
+    """
+    Generator yielding lists of at most 'chunk_size' rows. If a metrics
+    'stage' is given, the time and memory taken to produce each chunk are
+    recorded.
+    """
+
+    chunk = []
+    start_time = time.perf_counter()
+    memory_state = memory_profile.begin(stage)
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            if stage is not None:
+                metrics.add_time(stage, time.perf_counter() - start_time)
+                memory_profile.end(stage, memory_state)
+            yield chunk
+            chunk = []
+            start_time = time.perf_counter()
+            memory_state = memory_profile.begin(stage)
+
+    if len(chunk) > 0:
+        if stage is not None:
+            metrics.add_time(stage, time.perf_counter() - start_time)
+            memory_profile.end(stage, memory_state)
+        yield chunk
+
+
+###############################################################################
+def worker_config():
+    """
+    Return the WorkerConfig of this process, to send to the workers.
+    """
+
+    return WorkerConfig(get_versions(), segmentation.MODEL_NAME)
+
+
+###############################################################################
+def check_worker_config(config):
+    """
+    Raise a RuntimeError if the WorkerConfig 'config' from the main process
+    does not match this worker, which would give different results.
+    """
+
+    if config.versions != get_versions():
+        raise RuntimeError('worker module versions {0} do not match {1}'.
+                           format(get_versions(), config.versions))
+    if config.model_name != segmentation.MODEL_NAME:
+        raise RuntimeError('worker spaCy model "{0}" does not match "{1}"'.
+                           format(segmentation.MODEL_NAME, config.model_name))
+
+
+###############################################################################
+def _init_shard_worker(config, options):
+    """
+    Initializer for the shard workers. The options, which include all
+    manifest entries, are sent once to each worker rather than with each
+    shard.
+    """
+
+    global _shard_options
+    check_worker_config(config)
+    _shard_options = options
+
+
+###############################################################################
+def _diagnose_shard(shard):
+    """
+    Read and diagnose the rows of a shards.Shard in a worker process, and
+    return a ShardResult.
+    """
+
+    return diagnose_shard(_shard_options, shard)
+
+
+###############################################################################
+def diagnose_shard(options, shard, cache=None):
+    """
+    Read and diagnose the rows of a shards.Shard of the file given by the
+    ShardOptions 'options', and return a ShardResult. The finder results are
+    taken from and added to the result_cache.ResultCache 'cache', if given.
+    """
+
+    # the metrics and memory profile for the shard are returned to the
+    # main process
+    shard_metrics = metrics.Metrics()
+    shard_profile = None
+    if options.profile_memory or options.memory_budget_mb is not None:
+        shard_profile = memory_profile.MemoryProfile(options.profile_memory,
+                                                     options.memory_budget_mb)
+    previous_metrics = metrics.use(shard_metrics)
+    previous_profile = memory_profile.use(shard_profile)
+    try:
+        if shard_profile is not None:
+            shard_profile.start()
+        result = _diagnose_shard_rows(options, shard, cache, shard_metrics)
+        if shard_profile is not None:
+            shard_profile.stop()
+        return result._replace(memory_profile=shard_profile)
+    finally:
+        metrics.use(previous_metrics)
+        memory_profile.use(previous_profile)
+
+
+###############################################################################
+def _diagnose_shard_rows(options, shard, cache, shard_metrics):
+
+    plan = text_plan.TextPlan(TEXT_COLS)
+    budget_stats = text_budget.BudgetStats()
+    date_cols = [fields.DateColumn(col_name) for col_name in DATE_COLS]
+    corrupted_line_indices = []
+    rows = read_rows(options.input_file, options.col_names, options.col_map,
+                     corrupted_line_indices, shard)
+
+    results = []
+    for chunk in _chunks(rows, options.chunk_size, metrics.STAGE_CSV_PARSE):
+        with memory_profile.stage(memory_profile.STAGE_TEXT_PLAN):
+            chunk = build_plan(plan, chunk, options.entries,
+                               options.keep_debug_fields)
+        diagnosed = diagnose_chunk(plan, chunk, date_cols,
+                                   options.do_segmentation,
+                                   options.keep_debug_fields, options.budget,
+                                   budget_stats, cache=cache)
+        for row, (diagnosis, patient_data) in zip(chunk, diagnosed):
+            results.append( (row.user_id, row.row_hash, diagnosis, patient_data) )
+        plan.clear()
+
+    return ShardResult(
+        chunk_result           = ChunkResult(plan.stats(), results),
+        budget_stats           = budget_stats,
+        corrupted_line_indices = corrupted_line_indices,
+        metrics                = shard_metrics,
+        memory_profile         = None,
+    )
+
+
+###############################################################################
+def run(input_file, output_writer, do_segmentation=True, keep_debug_fields=False,
+        manifest_file=None, full_rebuild=False, checkpoint_dir=None,
+        resume=False, chunk_size=CHUNK_SIZE,
+        budget=text_budget.DEFAULT_BUDGET, queue_size=STAGE_QUEUE_SIZE,
+        shard_count=1, processes=None, backend=executors.PROCESS,
+        address=None, metrics_file=None, prometheus_file=None,
+        progress_interval=metrics.PROGRESS_INTERVAL_S, profile_memory=False,
+        memory_budget_mb=None):
+    """
+    Diagnose all patients in the CSV file and pass the patient id, diagnosis,
+    and PatientData for each to the 'add' method of 'output_writer'. Returns
+    the number of patients and a list of the indices of the corrupted lines
+    in the file. A ValueError is raised if a patient id occurs more than once.
+
+    The raw texts and the individual O2 results are only kept in the
+    PatientData if 'keep_debug_fields' is True.
+
+    If 'manifest_file' is given, results for rows that are unchanged since the
+    manifest was written are carried forward, unless 'full_rebuild' is True.
+    A new manifest is written for all rows in the file, except those with
+    texts truncated by the budget.
+
+    If 'checkpoint_dir' is given, the results are saved there after every
+    'chunk_size' rows. If 'resume' is True, the rows saved by an interrupted
+    run over the same file are carried forward. The checkpoint is removed
+    when the run completes.
+
+    The finders are run on each text within the text_budget.TextBudget
+    'budget'; if None, texts of any length are processed in full.
+
+    At most 'queue_size' chunks wait between any two stages of the run.
+
+    If 'shard_count' is greater than 1, the file is split into that many
+    shards, which are diagnosed by an executor from executors.py with the
+    given 'backend' and 'processes' workers (by default, one per shard up to
+    the number of CPUs). The 'address' of a Dask scheduler is used by the
+    DASK backend only. Up to two shards per worker are held in memory until
+    written, so for a large file the shard count should be several times
+    the number of processes.
+
+    The stage timings and counters are printed at the end of the run, and
+    are written to 'metrics_file' as JSON and to 'prometheus_file' in the
+    Prometheus text format, if given. A progress line is printed every
+    'progress_interval' seconds, or never if None.
+
+    If 'profile_memory' is True, the memory used by each stage is traced and
+    a memory report is printed at the end of the run. If 'memory_budget_mb'
+    is given, a memory_profile.MemoryBudgetError is raised as soon as the
+    RSS of the main process or of a worker exceeds that many MB.
+    """
+
+    run_metrics = metrics.Metrics()
+    run_profile = None
+    if profile_memory or memory_budget_mb is not None:
+        run_profile = memory_profile.MemoryProfile(profile_memory,
+                                                   memory_budget_mb)
+    previous_metrics = metrics.use(run_metrics)
+    previous_profile = memory_profile.use(run_profile)
+    try:
+        if run_profile is not None:
+            run_profile.start()
+        return _run(input_file, output_writer, do_segmentation,
+                    keep_debug_fields, manifest_file, full_rebuild,
+                    checkpoint_dir, resume, chunk_size, budget, queue_size,
+                    shard_count, processes, backend, address, metrics_file,
+                    prometheus_file, progress_interval, run_metrics,
+                    run_profile)
+    finally:
+        if run_profile is not None:
+            run_profile.stop()
+        metrics.use(previous_metrics)
+        memory_profile.use(previous_profile)
+
+
+###############################################################################
+def _run(input_file, output_writer, do_segmentation, keep_debug_fields,
+         manifest_file, full_rebuild, checkpoint_dir, resume, chunk_size,
+         budget, queue_size, shard_count, processes, backend, address,
+         metrics_file, prometheus_file, progress_interval, run_metrics,
+         run_profile):
+
+    start_time = time.perf_counter()
+    col_names, col_map = read_header(input_file)
+
+    # results are only carried forward into a run with the same settings
+    versions = get_versions() + get_settings(do_segmentation,
+                                             keep_debug_fields, budget)
+    prior_entries = {}
+    if manifest_file is not None and not full_rebuild:
+        prior_entries = manifest.load(manifest_file, versions)
+
+    ckpt = None
+    resumed_entries = {}
+    if checkpoint_dir is not None:
+        ckpt = checkpoint.Checkpoint(checkpoint_dir, input_file, versions)
+        if resume:
+            resumed_entries = ckpt.load()
+            print('Resuming with {0} rows from checkpoint "{1}"'.
+                  format(len(resumed_entries), checkpoint_dir))
+        ckpt.start(resume and len(resumed_entries) > 0)
+
+    # checkpoint entries take precedence over the manifest
+    entries = dict(prior_entries)
+    entries.update(resumed_entries)
+
+    writer = None
+    if manifest_file is not None:
+        writer = manifest.ManifestWriter(manifest_file, versions)
+
+    # the counts of the plans for all chunks, for the summary
+    plan_totals = text_plan.TextPlan(TEXT_COLS)
+    budget_stats = text_budget.BudgetStats()
+    date_cols = [fields.DateColumn(col_name) for col_name in DATE_COLS]
+    corrupted_line_indices = []
+
+    # counts for the manifest summary
+    counts = {'reused':0, 'changed':0, 'new':0, 'patients':0}
+
+    # the results, manifest, and checkpoint are keyed by patient id
+    seen_ids = set()
+
+    progress = metrics.Progress(shards.estimate_row_count(input_file),
+                                progress_interval)
+
+    def segment_stage(chunk):
+        plan = text_plan.TextPlan(TEXT_COLS)
+        with memory_profile.stage(memory_profile.STAGE_TEXT_PLAN):
+            chunk = build_plan(plan, chunk, entries, keep_debug_fields)
+        with memory_profile.stage(memory_profile.STAGE_SEGMENTATION):
+            sentence_lists = segment_plan(plan, do_segmentation, budget)
+        return plan, chunk, sentence_lists
+
+    def find_stage(item):
+        plan, chunk, sentence_lists = item
+        diagnosed = diagnose_chunk(plan, chunk, date_cols, do_segmentation,
+                                   keep_debug_fields, budget, budget_stats,
+                                   sentence_lists)
+        results = []
+        for row, (diagnosis, patient_data) in zip(chunk, diagnosed):
+            results.append( (row.user_id, row.row_hash, diagnosis, patient_data) )
+        return ChunkResult(plan.stats(), results)
+
+    def write_stage(chunk_result):
+        with memory_profile.stage(memory_profile.STAGE_OUTPUT):
+            write_rows(chunk_result)
+        if run_profile is not None:
+            run_profile.record_patients(counts['patients'])
+
+    def write_rows(chunk_result):
+        write_start_time = time.perf_counter()
+        ckpt_writer = None
+        if ckpt is not None:
+            ckpt_writer = ckpt.writer()
+
+        for user_id, row_hash, diagnosis, patient_data in chunk_result.rows:
+            if user_id in seen_ids:
+                raise ValueError('duplicate patient id "{0}" in file "{1}"'.
+                                 format(user_id, input_file))
+            seen_ids.add(user_id)
+
+            output_writer.add(user_id, diagnosis, patient_data)
+            counts['patients'] += 1
+
+            # truncated results are processed again rather than reused
+            reusable = not _is_truncated(patient_data)
+
+            if writer is not None and reusable:
+                writer.add(user_id, row_hash, diagnosis, patient_data)
+
+            # rows already in the checkpoint do not need to be saved again
+            if ckpt_writer is not None and reusable and \
+               user_id not in resumed_entries:
+                ckpt_writer.add(user_id, row_hash, diagnosis, patient_data)
+
+            entry = prior_entries.get(user_id)
+            if entry is None:
+                counts['new'] += 1
+            elif entry.row_hash == row_hash:
+                counts['reused'] += 1
+            else:
+                counts['changed'] += 1
+
+        if ckpt_writer is not None:
+            ckpt_writer.close()
+
+        plan_totals.add_stats(chunk_result.plan_stats)
+        metrics.count(metrics.COUNTER_ROWS, len(chunk_result.rows))
+        metrics.add_time(metrics.STAGE_OUTPUT,
+                         time.perf_counter() - write_start_time)
+        progress.update(counts['patients'])
+        if _TRACE:
+            print('\tcompleted {0} rows'.format(counts['patients']))
+
+    if shard_count > 1:
+        shard_list = shards.find_shards(input_file, shard_count)
+        if processes is None:
+            processes = min(len(shard_list), os.cpu_count())
+        options = ShardOptions(
+            input_file        = input_file,
+            col_names         = col_names,
+            col_map           = col_map,
+            entries           = entries,
+            do_segmentation   = do_segmentation,
+            keep_debug_fields = keep_debug_fields,
+            budget            = budget,
+            chunk_size        = chunk_size,
+            profile_memory    = run_profile is not None and run_profile.trace,
+            memory_budget_mb  = None if run_profile is None else run_profile.budget_mb,
+        )
+
+        def shard_results(executor):
+            # the results are returned in shard order
+            for result in executors.map_ordered(executor, _diagnose_shard,
+                                                shard_list):
+                corrupted_line_indices.extend(result.corrupted_line_indices)
+                budget_stats.merge(result.budget_stats)
+                run_metrics.merge(result.metrics)
+                if result.memory_profile is not None:
+                    run_profile.merge(result.memory_profile)
+                yield result.chunk_result
+
+        pipe = stages.StagePipeline([
+            stages.Stage('write', write_stage),
+        ], queue_size, source_name='shards')
+        with executors.make_executor(backend, processes, _init_shard_worker,
+                                     (worker_config(), options),
+                                     address) as executor:
+            pipe.run(shard_results(executor))
+    else:
+        rows = read_rows(input_file, col_names, col_map,
+                         corrupted_line_indices)
+        pipe = stages.StagePipeline([
+            stages.Stage('segment', segment_stage),
+            stages.Stage('find',    find_stage),
+            stages.Stage('write',   write_stage),
+        ], queue_size, source_name='read')
+        pipe.run(_chunks(rows, chunk_size, metrics.STAGE_CSV_PARSE))
+
+    elapsed_s = time.perf_counter() - start_time
+    print(plan_totals.report())
+    print(budget_stats.report())
+    print(pipe.report())
+    print(run_metrics.report())
+    if run_profile is not None:
+        run_profile.stop()
+        print(run_profile.report())
+    if metrics_file is not None:
+        metrics.write_json(run_metrics, metrics_file, elapsed_s)
+    if prometheus_file is not None:
+        metrics.write_prometheus(run_metrics, prometheus_file, elapsed_s)
+
+    if writer is not None:
+        writer.close()
+        _print_reuse_summary(counts['reused'], counts['changed'], counts['new'])
+
+    if ckpt is not None:
+        ckpt.remove()
+
+    return counts['patients'], corrupted_line_indices
+
+
+###############################################################################
+def _print_reuse_summary(reused_count, changed_count, new_count):
+    """
+    Print the number of rows carried forward from the manifest.
+    """
+
+    total = reused_count + changed_count + new_count
+
+    pct = 0.0
+    if total > 0:
+        pct = 100.0 * reused_count / total
+
+    print('Manifest summary: ')
+    print('\tReused       : {0:>9} ({1:.1f}%)'.format(reused_count, pct))
+    print('\tChanged      : {0:>9}'.format(changed_count))
+    print('\tNew          : {0:>9}'.format(new_count))
+    print('\t       Total : {0:>9}'.format(total))
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+
+Quick preview of the diagnoses for a SET-NET extract, from a random sample.
+
+Before starting a full run on a new extract, the expected proportion of each
+diagnosis can be estimated from a sample of a few thousand rows:
+
+    1. Stream the rows of the file and draw a uniform random sample of them
+       by reservoir sampling (Li's Algorithm L), which needs a single pass
+       and memory for the sample only. Only the sampled rows are converted
+       to RowRecords. The sample is reproducible for a given seed.
+
+    2. Run the full pipeline (segmentation, finders, and diagnosis) on the
+       sampled rows.
+
+    3. Report the proportion of each diagnosis with a confidence interval,
+       and a projection of the time for a full run.
+
+The sample can be post-stratified on a column, such as the 'mv_icu' radio
+button, which is closely related to the diagnosis. The rows for each value
+of the column are counted during the scan, and the proportions are then
+estimated as weighted means over the strata, which narrows the confidence
+intervals when the column separates the diagnoses well. The sample itself
+is drawn from a single reservoir, so it never holds more than the requested
+number of rows, and only the first MAX_STRATA values of the column are
+counted separately. A stratum with fewer than MIN_STRATUM_SAMPLE sampled
+rows says nothing about the variance within it, so such strata are
+collapsed into a single OTHER_STRATUM.
+
+The confidence intervals are Wilson score intervals. For a stratified sample
+the Wilson interval uses the effective sample size, which is the sample size
+for which a simple random sample would have the same variance as the
+stratified estimate. Both include the finite population correction, so the
+intervals shrink to a point when every row is sampled.
+
+The projected run time is the time to scan the file plus the measured cost
+per sampled row times the number of rows. A full run shares the results for
+texts repeated in a chunk, which a small sample rarely does, so the
+projection is usually an overestimate.
+
+Usage:
+
+        python3 -m src.preview -f synthetic_data_20220328.csv --sample 2000 \\
+                --seed 1 --stratify mv_icu
+
+"""
+
+import os
+import sys
+import math
+import time
+import random
+import argparse
+import statistics
+from collections import namedtuple
+
+from . import pipeline
+from . import fields
+from . import text_plan
+from . import text_budget
+from . import diagnose_covid as dc
+
+# default number of rows to sample
+DEFAULT_SAMPLE_SIZE = 1000
+
+# default seed for the random number generator
+DEFAULT_SEED = 0
+
+# default confidence level for the intervals
+DEFAULT_CONFIDENCE = 0.95
+
+# values of the stratification column counted separately; the rows with any
+# later value are counted in OTHER_STRATUM
+MAX_STRATA = 20
+
+# strata with fewer sampled rows are collapsed into OTHER_STRATUM
+MIN_STRATUM_SAMPLE = 2
+
+OTHER_STRATUM = '(other)'
+
+# diagnoses in report order
+_DIAGNOSES = [
+    dc.DIAG_CRITICAL, dc.DIAG_SEVERE, dc.DIAG_MILD, dc.DIAG_ASYMP,
+    dc.DIAG_UNKNOWN,
+]
+
+# the estimated proportion of a single diagnosis
+PROPORTION_FIELDS = [
+    'diagnosis',        # a dc.DIAG_ code
+    'count',            # number of sampled rows with the diagnosis
+    'estimate',         # estimated proportion in the file
+    'lower',            # lower bound of the confidence interval
+    'upper',            # upper bound of the confidence interval
+]
+Proportion = namedtuple('Proportion', PROPORTION_FIELDS)
+
+# the results of a preview run
+PREVIEW_RESULT_FIELDS = [
+    'row_count',            # number of valid rows in the file
+    'sample_size',          # number of rows sampled
+    'strata',               # dict of stratum value to (row count, sample size)
+    'proportions',          # list of Proportions, in _DIAGNOSES order
+    'confidence',
+    'scan_seconds',         # time to read and sample the file
+    'diagnose_seconds',     # time to diagnose the sampled rows
+    'corrupted_count',      # number of corrupted lines in the file
+]
+PreviewResult = namedtuple('PreviewResult', PREVIEW_RESULT_FIELDS)
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 2
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def _random_open(rng):
+    """
+    Return a random number in the open interval (0, 1).
+    """
+
+    while True:
+        u = rng.random()
+        if u > 0.0:
+            return u
+
+
+###############################################################################
+class Reservoir(object):
+    """
+    Uniform random sample of a fixed size from a stream of items, by Li's
+    Algorithm L. The number of items to skip before the next replacement is
+    drawn directly, so the cost per skipped item is a single comparison.
+    """
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.items = []
+        self.count = 0          # number of items offered
+
+        self._w = 1.0
+        self._next = size       # count at which the next item is taken
+        if size > 0:
+            self._advance()
+
+    def _advance(self):
+        self._w *= math.exp(math.log(_random_open(self.rng)) / self.size)
+        skip = math.floor(math.log(_random_open(self.rng)) /
+                          math.log(1.0 - self._w))
+        self._next += skip + 1
+
+    def offer(self, item):
+        """
+        Offer the next item of the stream to the reservoir.
+        """
+
+        self.count += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        elif self.count == self._next:
+            self.items[self.rng.randrange(self.size)] = item
+            self._advance()
+
+
+###############################################################################
+def _collapse_strata(sample_counts):
+    """
+    Return a dict mapping each value of the stratification column to its
+    stratum. The 'sample_counts' argument is a dict of value to the number
+    of sampled rows with the value, including values with none. Values with
+    fewer than MIN_STRATUM_SAMPLE sampled rows are mapped to OTHER_STRATUM.
+    If that stratum is itself too small, it is merged into the smallest of
+    the remaining strata.
+    """
+
+    strata = {}
+    for value, n in sample_counts.items():
+        if n < MIN_STRATUM_SAMPLE:
+            strata[value] = OTHER_STRATUM
+        else:
+            strata[value] = value
+
+    other_n = sum([n for value, n in sample_counts.items()
+                   if OTHER_STRATUM == strata[value]])
+    others = [value for value in strata if OTHER_STRATUM != strata[value]]
+    if 0 < other_n < MIN_STRATUM_SAMPLE or \
+       (0 == other_n and len(others) < len(strata)):
+        if len(others) > 0:
+            smallest = min(others,
+                           key=lambda v: (sample_counts[v], str(v)))
+            for value in strata:
+                if OTHER_STRATUM == strata[value]:
+                    strata[value] = smallest
+
+    return strata
+
+
+###############################################################################
+def _wilson(p, n, z):
+    """
+    Return the Wilson score interval for a proportion 'p' with sample size
+    'n', which need not be an integer.
+    """
+
+    z2 = z * z
+    denom = 1.0 + z2 / n
+    center = (p + z2 / (2.0 * n)) / denom
+    half = z * math.sqrt(p * (1.0 - p) / n + z2 / (4.0 * n * n)) / denom
+
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+###############################################################################
+def estimate_proportion(strata_counts, z):
+    """
+    Estimate a proportion from a stratified sample, with the finite
+    population correction. The 'strata_counts' argument is a list of
+    (row count, sample size, hit count) tuples, one for each stratum.
+    Returns the estimate and the bounds of the confidence interval.
+    """
+
+    row_count = sum([N for N, n, x in strata_counts])
+    sample_size = sum([n for N, n, x in strata_counts])
+
+    p = 0.0
+    variance = 0.0
+    for N, n, x in strata_counts:
+        w = N / row_count
+        p_h = x / n
+        p += w * p_h
+        variance += w * w * (1.0 - n / N) * p_h * (1.0 - p_h) / n
+
+    if sample_size >= row_count:
+        # every row was sampled
+        return p, p, p
+
+    if variance > 0.0:
+        n_eff = p * (1.0 - p) / variance
+    else:
+        # no variation within the strata, so use the finite population
+        # correction of a simple random sample
+        n_eff = sample_size * (row_count - 1) / (row_count - sample_size)
+
+    lower, upper = _wilson(p, n_eff, z)
+    return p, lower, upper
+
+
+###############################################################################
+def sample_lines(input_file, col_names, col_map, sample_size, seed=DEFAULT_SEED,
+                 stratify_col=None, corrupted_line_indices=None):
+    """
+    Draw a uniform random sample of at most 'sample_size' data rows of the
+    CSV file, post-stratified on the column 'stratify_col' if given. Returns
+    a list of the (line_index, line_items, stratum) tuples of the sample in
+    file order, and a dict of stratum to (row count, sample size).
+    """
+
+    if corrupted_line_indices is None:
+        corrupted_line_indices = []
+
+    strata_index = None
+    if stratify_col is not None:
+        strata_index = col_map[stratify_col.lower()]
+
+    rng = random.Random(seed)
+    reservoir = Reservoir(sample_size, rng)
+
+    # row counts for each value of the stratification column
+    row_counts = {}
+    for i, line_items in pipeline.read_lines(input_file, col_names,
+                                             corrupted_line_indices):
+        value = None
+        if strata_index is not None:
+            value = line_items[strata_index]
+            if value not in row_counts and len(row_counts) >= MAX_STRATA:
+                value = OTHER_STRATUM
+        row_counts[value] = row_counts.get(value, 0) + 1
+        reservoir.offer( (i, line_items, value) )
+
+    if 0 == len(row_counts):
+        return [], {}
+
+    sample_counts = {value:0 for value in row_counts}
+    for i, line_items, value in reservoir.items:
+        sample_counts[value] += 1
+    value_strata = _collapse_strata(sample_counts)
+
+    strata = {}
+    for value, N in row_counts.items():
+        stratum = value_strata[value]
+        row_count, n = strata.get(stratum, (0, 0))
+        strata[stratum] = (row_count + N, n + sample_counts[value])
+
+    if _TRACE:
+        for stratum, (N, n) in strata.items():
+            print('\tstratum {0}: {1} rows, {2} sampled'.format(stratum, N, n))
+
+    sample = [(i, line_items, value_strata[value])
+              for i, line_items, value in reservoir.items]
+    sample.sort(key=lambda item: item[0])
+    return sample, strata
+
+
+###############################################################################
+def run(input_file, sample_size=DEFAULT_SAMPLE_SIZE, seed=DEFAULT_SEED,
+        stratify_col=None, confidence=DEFAULT_CONFIDENCE,
+        do_segmentation=True, budget=text_budget.DEFAULT_BUDGET):
+    """
+    Diagnose a random sample of the rows of the CSV file, and return a
+    PreviewResult with the estimated proportion of each diagnosis.
+    """
+
+    col_names, col_map = pipeline.read_header(input_file)
+
+    start_time = time.perf_counter()
+    corrupted_line_indices = []
+    sample, strata = sample_lines(input_file, col_names, col_map, sample_size,
+                                  seed, stratify_col, corrupted_line_indices)
+    scan_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    col_indices = pipeline.column_indices(col_map)
+    rows = [pipeline.row_from_items(i, line_items, col_indices)
+            for i, line_items, stratum in sample]
+
+    plan = text_plan.TextPlan(pipeline.TEXT_COLS)
+    date_cols = [fields.DateColumn(col_name) for col_name in pipeline.DATE_COLS]
+    rows = pipeline.build_plan(plan, rows)
+    diagnosed = pipeline.diagnose_chunk(plan, rows, date_cols, do_segmentation,
+                                        False, budget)
+    diagnose_seconds = time.perf_counter() - start_time
+
+    # count the hits for each diagnosis in each stratum
+    strata_values = list(strata.keys())
+    hits = {(value, d):0 for value in strata_values for d in _DIAGNOSES}
+    for (i, line_items, stratum), (diagnosis, patient_data) in zip(sample,
+                                                                   diagnosed):
+        if diagnosis not in dc.DIAGNOSIS_CODE_TO_TEXT:
+            diagnosis = dc.DIAG_UNKNOWN
+        hits[(stratum, diagnosis)] += 1
+
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2.0)
+    proportions = []
+    for d in _DIAGNOSES:
+        count = sum([hits[(value, d)] for value in strata_values])
+        if 0 == len(sample):
+            proportions.append(Proportion(d, 0, 0.0, 0.0, 0.0))
+            continue
+        strata_counts = [(strata[value][0], strata[value][1], hits[(value, d)])
+                         for value in strata_values]
+        p, lower, upper = estimate_proportion(strata_counts, z)
+        proportions.append(Proportion(d, count, p, lower, upper))
+
+    return PreviewResult(
+        row_count        = sum([N for N, n in strata.values()]),
+        sample_size      = len(sample),
+        strata           = strata,
+        proportions      = proportions,
+        confidence       = confidence,
+        scan_seconds     = scan_seconds,
+        diagnose_seconds = diagnose_seconds,
+        corrupted_count  = len(corrupted_line_indices),
+    )
+
+
+###############################################################################
+def report(result):
+    """
+    Return a printable summary of a PreviewResult.
+    """
+
+    lines = ['Sample summary: ']
+    lines.append('\tRows         : {0:>9}'.format(result.row_count))
+    lines.append('\tCorrupted    : {0:>9}'.format(result.corrupted_count))
+    lines.append('\tSampled      : {0:>9}'.format(result.sample_size))
+    if len(result.strata) > 1:
+        for value, (N, n) in sorted(result.strata.items(),
+                                    key=lambda item: str(item[0])):
+            lines.append('\t  stratum {0:<4}: {1:>9} of {2} rows'.
+                         format(repr(value), n, N))
+
+    lines.append('Diagnosis estimate ({0:.0f}% confidence): '.
+                 format(100.0 * result.confidence))
+    for prop in result.proportions:
+        label = dc.DIAGNOSIS_CODE_TO_TEXT[prop.diagnosis].capitalize()
+        lines.append('\t{0:<12} : {1:>9} {2:>7.1f}%  [{3:5.1f}%, {4:5.1f}%]'.
+                     format(label, prop.count, 100.0 * prop.estimate,
+                            100.0 * prop.lower, 100.0 * prop.upper))
+
+    per_row = 0.0
+    if result.sample_size > 0:
+        per_row = result.diagnose_seconds / result.sample_size
+    projected = result.scan_seconds + per_row * result.row_count
+    lines.append('Projected run time: ')
+    lines.append('\tScan time    : {0:>9.3f} s'.format(result.scan_seconds))
+    lines.append('\tSample time  : {0:>9.3f} s'.format(result.diagnose_seconds))
+    lines.append('\tPer row      : {0:>9.3f} ms'.format(1000.0 * per_row))
+    lines.append('\tFull run     : {0:>9.1f} s'.format(projected))
+
+    return '\n'.join(lines)
+
+
+###############################################################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='estimate the diagnosis proportions from a random sample')
+
+    parser.add_argument('-v', '--version',
+                        action='store_true',
+                        help='print version to stdout and then exit')
+    parser.add_argument('-f', '--file',
+                        dest='filepath',
+                        help='SET-NET CSV file of patient records')
+    parser.add_argument('--sample',
+                        type=int,
+                        default=DEFAULT_SAMPLE_SIZE,
+                        help='number of rows to sample, default {0}'.
+                        format(DEFAULT_SAMPLE_SIZE))
+    parser.add_argument('--seed',
+                        type=int,
+                        default=DEFAULT_SEED,
+                        help='random seed, default {0}'.format(DEFAULT_SEED))
+    parser.add_argument('--stratify',
+                        dest='stratify_col',
+                        help='stratify the sample on this column, such as mv_icu')
+    parser.add_argument('--confidence',
+                        type=float,
+                        default=DEFAULT_CONFIDENCE,
+                        help='confidence level, default {0}'.
+                        format(DEFAULT_CONFIDENCE))
+    parser.add_argument('-d', '--debug',
+                        action='store_true',
+                        help='print debug information to stdout')
+
+    args = parser.parse_args()
+
+    if args.version:
+        print(get_version())
+        sys.exit(0)
+
+    if args.filepath is None or not os.path.isfile(args.filepath):
+        print('\n*** Missing or invalid --file argument ***')
+        sys.exit(-1)
+
+    if args.sample < 1:
+        print('\n*** The --sample argument must be positive ***')
+        sys.exit(-1)
+
+    if not 0.0 < args.confidence < 1.0:
+        print('\n*** The --confidence argument must be between 0 and 1 ***')
+        sys.exit(-1)
+
+    if args.debug:
+        enable_debug()
+
+    col_names, col_map = pipeline.read_header(args.filepath)
+    if args.stratify_col is not None and args.stratify_col.lower() not in col_map:
+        print('\n*** Unknown --stratify column "{0}" ***'.
+              format(args.stratify_col))
+        sys.exit(-1)
+
+    result = run(args.filepath, args.sample, args.seed, args.stratify_col,
+                 args.confidence)
+    print(report(result))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+
+Cache of finder results for distinct texts, shared across chunks and files.
+
+A TextPlan shares the work for the texts repeated within a single chunk of
+rows. Many texts (medication names, stock phrases in the notes) are also
+repeated across chunks, and across the extracts for different months and
+jurisdictions. A ResultCache keeps the TextResult for each recently seen
+(column, text) pair, so that the finders are not run again on a text that
+was processed for an earlier chunk or file in the same process.
+
+The least recently used entries are dropped when the cache holds more than
+'max_entries' results. The cached results must come from runs with the same
+settings (segmentation, debug fields, text budget), since these are not
+part of the key. Results for texts truncated by the text budget are not
+cached.
+
+"""
+
+import os
+from collections import OrderedDict
+
+from . import metrics
+from . import text_budget
+
+# default maximum number of cached results
+DEFAULT_MAX_ENTRIES = 200000
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 3
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+class ResultCache(object):
+    """
+    Least recently used cache of results keyed by column name and text.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def run(self, col_name, texts, run_fn):
+        """
+        Return the list of results for a list of distinct texts from a
+        single column. The results for texts not in the cache are computed
+        by calling 'run_fn' with the list of their indices in 'texts', which
+        must return their results in the same order.
+        """
+
+        results = [None] * len(texts)
+        missing = []
+        for i, text in enumerate(texts):
+            key = (col_name, text)
+            result = self._entries.get(key)
+            if result is None:
+                missing.append(i)
+            else:
+                self._entries.move_to_end(key)
+                results[i] = result
+
+        self.hit_count  += len(texts) - len(missing)
+        self.miss_count += len(missing)
+        metrics.count(metrics.COUNTER_CACHE_HITS, len(texts) - len(missing))
+        metrics.count(metrics.COUNTER_CACHE_MISSES, len(missing))
+
+        if 0 == len(missing):
+            return results
+
+        for i, result in zip(missing, run_fn(missing)):
+            results[i] = result
+            if text_budget.FLAG_TRUNCATED != result.budget_flag:
+                self._entries[(col_name, texts[i])] = result
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        if _TRACE:
+            print('\tcache {0}: {1} hits, {2} misses, {3} entries'.
+                  format(col_name, len(texts) - len(missing), len(missing),
+                         len(self._entries)))
+
+        return results
+
+    def report(self):
+        """
+        Return a printable summary of the cache statistics.
+        """
+
+        total = self.hit_count + self.miss_count
+        hit_pct = 0.0
+        if total > 0:
+            hit_pct = 100.0 * self.hit_count / total
+
+        lines = ['Result cache summary: ']
+        lines.append('\tHits         : {0:>9}'.format(self.hit_count))
+        lines.append('\tMisses       : {0:>9}'.format(self.miss_count))
+        lines.append('\tHit rate     : {0:>9.1f}%'.format(hit_pct))
+        lines.append('\tEntries      : {0:>9}'.format(len(self._entries)))
+
+        return '\n'.join(lines)
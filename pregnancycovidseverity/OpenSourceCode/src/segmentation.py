@@ -65,20 +65,26 @@ import time
 import argparse
 #import en_core_web_sm as english_model
 
+# the spaCy language model
+MODEL_NAME = 'en_core_web_md'
+
 print('Loading Spacy language model...', end='')
 import spacy
-_nlp = spacy.load("en_core_web_md")
+_nlp = spacy.load(MODEL_NAME)
 print('done.')
 
 from . import segmentation_helper as seg_helper
 
 _VERSION_MAJOR = 0
-_VERSION_MINOR = 3
+_VERSION_MINOR = 4
 _MODULE_NAME = 'segmentation.py'
 
 _data = {}
 _loading_status = 'none'
 
+# number of texts that spaCy processes at a time in the batch segmenter
+_BATCH_SIZE = 64
+
 
 # ###############################################################################
 # def segmentation_init(tries=0):
@@ -124,7 +130,43 @@ def parse_sentences_spacy(text): #, spacy=None):
     doc = _nlp(text)
     sentences = [sent.text.strip() for sent in doc.sents]
 
-    # fix various problems and undo the substitutions
+    return _finish_sentences(sentences)
+
+
+###############################################################################
+def parse_sentences_spacy_batch(texts, batch_size=_BATCH_SIZE):
+    """
+    Segment a list of texts with a single call to spaCy's 'pipe' method,
+    which amortizes the pipeline overhead across the batch. Returns a list
+    of sentence lists, one for each text, in the same order as 'texts'.
+    """
+
+    # the substitutions for each text must be saved, since the helper module
+    # only keeps a single set of substitution lists
+    prepared_texts = []
+    saved_subs = []
+    for text in texts:
+        text = seg_helper.cleanup_report(text)
+        text = seg_helper.do_substitutions(text)
+        prepared_texts.append(text)
+        saved_subs.append(seg_helper.save_substitutions())
+
+    results = []
+    docs = _nlp.pipe(prepared_texts, batch_size=batch_size)
+    for doc, subs in zip(docs, saved_subs):
+        sentences = [sent.text.strip() for sent in doc.sents]
+        seg_helper.restore_substitutions(subs)
+        results.append(_finish_sentences(sentences))
+
+    return results
+
+
+###############################################################################
+def _finish_sentences(sentences):
+    """
+    Fix various problems in the spaCy sentences and undo the substitutions.
+    """
+
     sentences = seg_helper.split_concatenated_sentences(sentences)
 
     # do this, if at all, BEFORE undoing the substitutions
@@ -156,6 +198,9 @@ class Segmentation(object):
     def parse_sentences(self, text, spacy=None):
         return parse_sentences_spacy(text)
 
+    def parse_sentences_batch(self, texts, batch_size=_BATCH_SIZE):
+        return parse_sentences_spacy_batch(texts, batch_size)
+
 
 ###############################################################################
 def get_version():
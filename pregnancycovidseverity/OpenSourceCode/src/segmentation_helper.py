@@ -18,7 +18,7 @@ import json
 #import lab_value_matcher as lvm
 
 _VERSION_MAJOR = 0
-_VERSION_MINOR = 8
+_VERSION_MINOR = 9
 _MODULE_NAME = 'segmentation_helper.py'
 
 # set to True to enable debug output
@@ -571,6 +571,28 @@ def undo_substitutions(sentence_list):
     return sentence_list
         
 
+###############################################################################
+def save_substitutions():
+    """
+    Return a copy of the current substitution lists. The batch segmenter
+    must run 'do_substitutions' on every report in the batch before any of
+    them can be restored, so it saves a copy for each report.
+    """
+
+    return [list(sub_list) for sub_list in _all_subs]
+
+
+###############################################################################
+def restore_substitutions(saved_subs):
+    """
+    Reload the substitution lists from a copy made by 'save_substitutions',
+    prior to calling 'undo_substitutions' for that report.
+    """
+
+    for sub_list, saved_list in zip(_all_subs, saved_subs):
+        sub_list[:] = saved_list
+
+
 ###############################################################################
 def _erase_spans(report, span_list):
     """
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+
+Long-running local service that diagnoses patient records as they arrive.
+
+Loading the spaCy model and compiling the finder regexes takes far longer
+than diagnosing a single patient, so starting a new process for each record
+is very slow. The service loads everything once and keeps it warm. It accepts
+patient records over HTTP, on a TCP port or on a Unix socket, and returns the
+diagnosis and the extracted features for each.
+
+Requests are not processed one at a time. They are placed in a bounded queue,
+and a single worker thread takes as many as are waiting, up to a maximum
+number of records, waiting at most a fixed time for more to arrive. The
+records of all requests in the batch then go through the same steps as a
+chunk of rows in pipeline.run: the distinct texts are collected in a
+TextPlan, the long texts are segmented in a single call to spaCy's 'pipe'
+method, and the finders are run once per distinct text. If the queue is
+full, new requests are refused with status 503, so that the latency of the
+accepted requests stays bounded.
+
+Endpoints:
+
+    POST /diagnose      The body is a JSON record or a list of records. A
+                        record is an object mapping the column names of a
+                        SET-NET extract to their values, and the patient id
+                        to the key 'id'. Missing columns are empty. The
+                        response is a list with one object per record:
+
+                            {
+                                "id"             : patient id
+                                "diagnosis"      : dc.DIAG_ code
+                                "diagnosis_text" : "critical", "severe", ...
+                                "features"       : the PatientData fields
+                            }
+
+    GET /stats          Counts of the requests, records, and batches.
+
+Usage:
+
+        python3 -m src.service --port 8642
+        python3 -m src.service --socket /tmp/setnet.sock
+
+See load_test_service.py for a load test.
+
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import socketserver
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import fields
+from . import manifest
+from . import pipeline
+from . import text_plan
+from . import text_budget
+from . import diagnose_covid as dc
+
+SERVICE_CONFIG_FIELDS = [
+    'max_batch_records',    # max number of records in a batch
+    'max_wait_ms',          # max time to wait for a batch to fill
+    'queue_size',           # max number of requests waiting for the worker
+    'request_timeout_s',    # max time a request waits for its results
+    'budget',               # text_budget.TextBudget for each text, or None
+]
+ServiceConfig = namedtuple('ServiceConfig', SERVICE_CONFIG_FIELDS)
+
+DEFAULT_CONFIG = ServiceConfig(
+    max_batch_records = 64,
+    max_wait_ms       = 10,
+    queue_size        = 256,
+    request_timeout_s = 60.0,
+    budget            = text_budget.DEFAULT_BUDGET,
+)
+
+# the key of the patient id in each record
+RECORD_ID_KEY = 'id'
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8642
+
+# a record with a long O2 statement, to load everything before the first request
+_WARMUP_RECORD = {
+    RECORD_ID_KEY : 'warmup',
+    'mg_notes'    : 'Pt admitted with fever and cough. Dyspnea worsened and ' \
+                    'she was placed on 4L NC with SpO2 91%. Transferred to ' \
+                    'the ICU for respiratory failure.',
+}
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 1
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+class _Request(object):
+    """
+    A list of records waiting for the worker, and their results.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+###############################################################################
+class DiagnosisService(object):
+    """
+    Queues the incoming records and diagnoses them in batches on a single
+    worker thread.
+    """
+
+    def __init__(self, config=DEFAULT_CONFIG):
+        self.config = config
+        self._queue = queue.Queue(maxsize=config.queue_size)
+
+        # the worker thread is the only user of these
+        self._plan = text_plan.TextPlan(pipeline.TEXT_COLS)
+        self._date_cols = [fields.DateColumn(col_name)
+                           for col_name in pipeline.DATE_COLS]
+        self.budget_stats = text_budget.BudgetStats()
+
+        self._lock = threading.Lock()
+        self.request_count  = 0
+        self.rejected_count = 0
+        self.record_count   = 0
+        self.batch_count    = 0
+        self.max_batch_size = 0
+
+        self._worker = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """
+        Diagnose a warm-up record, then start the worker thread.
+        """
+
+        self._diagnose([_WARMUP_RECORD])
+        self._worker.start()
+
+    def stop(self):
+        """
+        Stop the worker thread after the queued requests are done.
+        """
+
+        self._queue.put(None)
+        self._worker.join()
+
+    def diagnose(self, records):
+        """
+        Queue a list of records and wait for the results. Returns a list with
+        a result dict for each record. Raises queue.Full if the queue is
+        full, or TimeoutError if the results are not ready in time.
+        """
+
+        request = _Request(records)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            with self._lock:
+                self.rejected_count += 1
+            raise
+
+        with self._lock:
+            self.request_count += 1
+
+        if not request.done.wait(self.config.request_timeout_s):
+            raise TimeoutError('request not completed in {0} s'.
+                               format(self.config.request_timeout_s))
+        if request.error is not None:
+            raise request.error
+
+        return request.results
+
+    def stats(self):
+        """
+        Return a dict of the service statistics.
+        """
+
+        with self._lock:
+            mean_batch = 0.0
+            if self.batch_count > 0:
+                mean_batch = self.record_count / self.batch_count
+            return {
+                'requests'        : self.request_count,
+                'rejected'        : self.rejected_count,
+                'records'         : self.record_count,
+                'batches'         : self.batch_count,
+                'mean_batch_size' : mean_batch,
+                'max_batch_size'  : self.max_batch_size,
+                'queue_depth'     : self._queue.qsize(),
+                'windowed_texts'  : self.budget_stats.windowed_count,
+                'truncated_texts' : self.budget_stats.truncated_count,
+            }
+
+    def _next_batch(self):
+        """
+        Wait for a request, then take any others that arrive within the max
+        wait time, up to the max number of records. Returns the list of
+        requests and False if the service is stopping.
+        """
+
+        request = self._queue.get()
+        if request is None:
+            return [], False
+
+        batch = [request]
+        record_count = len(request.records)
+        deadline = time.monotonic() + self.config.max_wait_ms / 1000.0
+        while record_count < self.config.max_batch_records:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, False
+            batch.append(request)
+            record_count += len(request.records)
+
+        return batch, True
+
+    def _diagnose(self, records):
+        """
+        Diagnose a list of records as a single chunk and return the result
+        dicts.
+        """
+
+        rows = [pipeline.row_from_record(i, r.get(RECORD_ID_KEY), r)
+                for i, r in enumerate(records)]
+        try:
+            chunk = pipeline.build_plan(self._plan, rows)
+            diagnosed = pipeline.diagnose_chunk(self._plan, chunk,
+                                                self._date_cols,
+                                                budget=self.config.budget,
+                                                budget_stats=self.budget_stats)
+        finally:
+            self._plan.clear()
+
+        results = []
+        for row, (diagnosis, patient_data) in zip(rows, diagnosed):
+            results.append({
+                'id'             : row.user_id,
+                'diagnosis'      : diagnosis,
+                'diagnosis_text' : dc.DIAGNOSIS_CODE_TO_TEXT[diagnosis],
+                'features'       : manifest.encode_features(patient_data),
+            })
+
+        return results
+
+    def _run(self):
+        """
+        Worker thread: diagnose the queued requests in batches.
+        """
+
+        running = True
+        while running:
+            batch, running = self._next_batch()
+            if 0 == len(batch):
+                continue
+
+            records = []
+            for request in batch:
+                records.extend(request.records)
+
+            try:
+                results = self._diagnose(records)
+            except Exception as exc:
+                # fail every request in the batch, but keep serving
+                for request in batch:
+                    request.error = exc
+                    request.done.set()
+                continue
+
+            with self._lock:
+                self.record_count += len(records)
+                self.batch_count += 1
+                self.max_batch_size = max(self.max_batch_size, len(records))
+
+            if _TRACE:
+                print('\tbatch of {0} records from {1} requests'.
+                      format(len(records), len(batch)))
+
+            start = 0
+            for request in batch:
+                end = start + len(request.records)
+                request.results = results[start:end]
+                start = end
+                request.done.set()
+
+
+###############################################################################
+class _Handler(BaseHTTPRequestHandler):
+    """
+    HTTP request handler; the server has a 'service' attribute.
+    """
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if '/stats' == self.path:
+            self._send_json(200, self.server.service.stats())
+        else:
+            self._send_json(404, {'error':'unknown path "{0}"'.format(self.path)})
+
+    def do_POST(self):
+        if '/diagnose' != self.path:
+            self._send_json(404, {'error':'unknown path "{0}"'.format(self.path)})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            records = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._send_json(400, {'error':'request body is not valid JSON'})
+            return
+
+        if isinstance(records, dict):
+            records = [records]
+        if not isinstance(records, list) or \
+           not all([isinstance(r, dict) for r in records]):
+            self._send_json(400, {'error':'expected a record or a list of records'})
+            return
+
+        try:
+            results = self.server.service.diagnose(records)
+        except queue.Full:
+            self._send_json(503, {'error':'service busy, queue is full'})
+            return
+        except TimeoutError as exc:
+            self._send_json(504, {'error':str(exc)})
+            return
+        except Exception as exc:
+            self._send_json(500, {'error':repr(exc)})
+            return
+
+        self._send_json(200, results)
+
+    def log_message(self, format, *args):
+        # client_address is not a (host, port) tuple for a Unix socket
+        if _TRACE:
+            sys.stderr.write(format % args + '\n')
+
+
+# listen backlog; the socketserver default of 5 makes concurrent clients
+# wait for TCP connection retries
+_REQUEST_QUEUE_SIZE = 128
+
+
+###############################################################################
+class _TCPHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = _REQUEST_QUEUE_SIZE
+
+
+###############################################################################
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = _REQUEST_QUEUE_SIZE
+
+
+###############################################################################
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    """
+    Return an HTTP server for the service, listening on the Unix socket
+    'socket_path' if given, otherwise on the TCP host and port.
+    """
+
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = _UnixHTTPServer(socket_path, _Handler)
+    else:
+        server = _TCPHTTPServer((host, port), _Handler)
+
+    server.service = service
+    return server
+
+
+###############################################################################
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='serve Covid-19 severity diagnoses over HTTP')
+
+    parser.add_argument('-v', '--version',
+                        action='store_true',
+                        help='print version to stdout and then exit')
+    parser.add_argument('-d', '--debug',
+                        action='store_true',
+                        help='print debugging information')
+    parser.add_argument('--host',
+                        default=DEFAULT_HOST,
+                        help='TCP host to listen on, default {0}'.
+                        format(DEFAULT_HOST))
+    parser.add_argument('--port',
+                        type=int,
+                        default=DEFAULT_PORT,
+                        help='TCP port to listen on, default {0}'.
+                        format(DEFAULT_PORT))
+    parser.add_argument('--socket',
+                        dest='socket_path',
+                        help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--max-batch',
+                        type=int,
+                        default=DEFAULT_CONFIG.max_batch_records,
+                        help='max records per batch, default {0}'.
+                        format(DEFAULT_CONFIG.max_batch_records))
+    parser.add_argument('--max-wait-ms',
+                        type=float,
+                        default=DEFAULT_CONFIG.max_wait_ms,
+                        help='max time to wait for a batch to fill, ' \
+                        'default {0} ms'.format(DEFAULT_CONFIG.max_wait_ms))
+    parser.add_argument('--queue-size',
+                        type=int,
+                        default=DEFAULT_CONFIG.queue_size,
+                        help='max queued requests, default {0}'.
+                        format(DEFAULT_CONFIG.queue_size))
+
+    args = parser.parse_args()
+
+    if args.version:
+        print(get_version())
+        sys.exit(0)
+
+    if args.debug:
+        enable_debug()
+
+    config = DEFAULT_CONFIG._replace(
+        max_batch_records = args.max_batch,
+        max_wait_ms       = args.max_wait_ms,
+        queue_size        = args.queue_size,
+    )
+
+    service = DiagnosisService(config)
+    service.start()
+
+    server = make_server(service, args.host, args.port, args.socket_path)
+    if args.socket_path is not None:
+        print('Listening on Unix socket "{0}"'.format(args.socket_path))
+    else:
+        print('Listening on http://{0}:{1}'.format(args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        if args.socket_path is not None and os.path.exists(args.socket_path):
+            os.remove(args.socket_path)
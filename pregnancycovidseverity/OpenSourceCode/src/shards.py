@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+
+Byte-range shards of a CSV file, for reading a large file in parallel.
+
+The file is memory-mapped and split into shards, each a range of bytes that
+begins and ends on a record boundary, so that each shard can be parsed by a
+separate worker without reading the rest of the file. Only the byte offsets
+of a shard need to be sent to a worker, not the rows themselves.
+
+A field in double quotes may contain newlines, so not every newline ends a
+record. Quotes within a quoted field are doubled, so a newline ends a record
+if and only if an even number of quotes precede it in the file. The shard
+boundaries are found by counting the quotes and newlines in large blocks
+with numpy, which is much faster than parsing the file.
+
+A stray quote in an unquoted field (such as 5'2" for a height) is read as a
+literal character by the csv module, but it upsets the count, so that every
+later boundary might fall inside a record. The count is only used if every
+quote is where a quoted field can start or end: a quote that the count takes
+to open a field must follow a comma, a newline, or another quote, and one
+that it takes to close a field must precede a comma, a line end, another
+quote, or the end of the file. Otherwise the file is read as a single shard.
+
+The files are read as bytes and decoded as latin-1, which maps each byte to
+a single character.
+
+A compressed file (see compression.py) cannot be read from an arbitrary
+offset, so it is always a single shard, with offsets in the uncompressed
+data. Its 'end' is None, meaning the end of the file.
+
+"""
+
+import os
+import csv
+import mmap
+import numpy as np
+from collections import namedtuple
+
+from . import compression
+
+SHARD_FIELDS = [
+    'start',        # offset of the first byte of the shard
+    'end',          # offset one past the last byte of the shard, or None
+    'first_line',   # line index of the first line, the header is line 0
+]
+Shard = namedtuple('Shard', SHARD_FIELDS)
+
+# the files are decoded as latin-1, as in pipeline.read_rows
+ENCODING = 'latin-1'
+
+_QUOTE   = ord('"')
+_NEWLINE = ord('\n')
+
+# bytes per block for counting quotes and newlines
+_BLOCK_BYTES = 1 << 24
+
+# bytes allowed before a quote that opens a quoted field, and after a quote
+# that closes one
+_OPEN_BYTES  = np.array([ord(','), _NEWLINE, _QUOTE], dtype=np.uint8)
+_CLOSE_BYTES = np.array([ord(','), ord('\r'), _NEWLINE, _QUOTE], dtype=np.uint8)
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 5
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def _count(data, start, end):
+    """
+    Return the number of quotes and newlines in data[start:end].
+    """
+
+    quotes = 0
+    newlines = 0
+    for block_start in range(start, end, _BLOCK_BYTES):
+        block = data[block_start : min(end, block_start + _BLOCK_BYTES)]
+        quotes   += int(np.count_nonzero(_QUOTE == block))
+        newlines += int(np.count_nonzero(_NEWLINE == block))
+
+    return quotes, newlines
+
+
+###############################################################################
+def _quotes_paired(data):
+    """
+    Return True if every quote in 'data' is at the start or end of a quoted
+    field, when the quotes are paired in order, so that counting quotes finds
+    the same record boundaries as parsing with the csv module.
+    """
+
+    size = len(data)
+    quotes = 0
+    for block_start in range(0, size, _BLOCK_BYTES):
+        block = data[block_start : min(size, block_start + _BLOCK_BYTES)]
+        pos = np.flatnonzero(_QUOTE == block) + block_start
+        if 0 == len(pos):
+            continue
+
+        # even quotes open a quoted field, odd quotes close it
+        is_open = 0 == (quotes + np.arange(len(pos))) % 2
+        quotes += len(pos)
+
+        open_pos = pos[is_open]
+        open_pos = open_pos[open_pos > 0]
+        if not np.isin(data[open_pos - 1], _OPEN_BYTES).all():
+            return False
+
+        close_pos = pos[~is_open]
+        close_pos = close_pos[close_pos + 1 < size]
+        if not np.isin(data[close_pos + 1], _CLOSE_BYTES).all():
+            return False
+
+    return True
+
+
+###############################################################################
+def find_shards(input_file, shard_count):
+    """
+    Split the data rows of a CSV file (all lines after the header line) into
+    at most 'shard_count' Shards of about equal size. Returns a list of
+    Shards in file order, which is empty if the file has no data rows.
+    A compressed file, or a file with quotes that cannot be paired (see
+    '_quotes_paired'), is returned as a single Shard.
+    """
+
+    if compression.detect(input_file) is not None:
+        if _TRACE:
+            print('\t"{0}" is compressed, not split into shards'.
+                  format(input_file))
+        return [whole_file(input_file)]
+
+    size = os.path.getsize(input_file)
+    if 0 == size:
+        return []
+
+    shards = []
+    with open(input_file, 'rb') as infile:
+        mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            data = np.frombuffer(mm, dtype=np.uint8)
+
+            header_end = mm.find(b'\n') + 1
+            if 0 == header_end:
+                return []
+
+            if shard_count > 1 and not _quotes_paired(data):
+                if _TRACE:
+                    print('\t"{0}" has unpaired quotes, not split into ' \
+                          'shards'.format(input_file))
+                del data
+                return [Shard(header_end, size, 1)]
+
+            # quotes and newlines counted in [0, pos)
+            pos = header_end
+            quotes, newlines = _count(data, 0, pos)
+
+            start = header_end
+            first_line = newlines
+            for k in range(1, shard_count):
+                target = header_end + k * (size - header_end) // shard_count
+                if target <= pos:
+                    continue
+
+                q, n = _count(data, pos, target)
+                quotes += q
+                newlines += n
+                pos = target
+
+                # advance to the next newline that ends a record
+                boundary = None
+                while True:
+                    nl = mm.find(b'\n', pos)
+                    if nl < 0:
+                        break
+                    q, n = _count(data, pos, nl)
+                    quotes += q
+                    newlines += n + 1
+                    pos = nl + 1
+                    if 0 == quotes % 2:
+                        boundary = pos
+                        break
+
+                if boundary is None or boundary >= size:
+                    break
+
+                shards.append(Shard(start, boundary, first_line))
+                start = boundary
+                first_line = newlines
+
+            if start < size:
+                shards.append(Shard(start, size, first_line))
+
+            # the array must be released before the map can be closed
+            del data
+        finally:
+            mm.close()
+
+    if _TRACE:
+        print('\tsplit "{0}" into {1} shards'.format(input_file, len(shards)))
+
+    return shards
+
+
+###############################################################################
+def estimate_row_count(input_file):
+    """
+    Return an estimate of the number of data rows in a CSV file, from the
+    number of newlines after the header line, or None for a compressed file.
+    A quoted field with newlines makes this an overestimate.
+    """
+
+    if compression.detect(input_file) is not None:
+        return None
+
+    if 0 == os.path.getsize(input_file):
+        return 0
+
+    with open(input_file, 'rb') as infile:
+        mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            data = np.frombuffer(mm, dtype=np.uint8)
+            quotes, newlines = _count(data, 0, len(data))
+            last_byte = data[-1]
+            del data
+        finally:
+            mm.close()
+
+    # the last line may not end with a newline
+    line_count = newlines
+    if _NEWLINE != last_byte:
+        line_count += 1
+
+    return max(0, line_count - 1)
+
+
+###############################################################################
+def whole_file(input_file):
+    """
+    Return a single Shard for all data rows of a CSV file.
+    """
+
+    with compression.open_binary(input_file) as infile:
+        header = infile.readline()
+
+    if compression.detect(input_file) is not None:
+        return Shard(len(header), None, 1)
+
+    size = os.path.getsize(input_file)
+    return Shard(len(header), size, 1)
+
+
+###############################################################################
+def _range_lines(infile, byte_count, raw_lines):
+    """
+    Generator yielding the decoded lines in the next 'byte_count' bytes of a
+    binary file, or in the rest of the file if 'byte_count' is None. Each
+    line is also appended to the list 'raw_lines'.
+    """
+
+    remaining = byte_count
+    while remaining is None or remaining > 0:
+        if remaining is None:
+            line = infile.readline()
+        else:
+            line = infile.readline(remaining)
+        if 0 == len(line):
+            break
+        if remaining is not None:
+            remaining -= len(line)
+        line = line.decode(ENCODING)
+        raw_lines.append(line)
+        yield line
+
+
+###############################################################################
+def read_records(input_file, shard):
+    """
+    Generator yielding a (line_index, items, raw_lines) tuple for each record
+    in a shard of a CSV file. The 'items' are the parsed fields, 'line_index'
+    is the index of the first line of the record in the file, and
+    'raw_lines' is the list of the lines of the record, for reparsing. The
+    'items' are None for lines that the csv module could not parse as a
+    record, such as a field over the size limit after a stray quote.
+    """
+
+    byte_count = None
+    if shard.end is not None:
+        byte_count = shard.end - shard.start
+
+    raw_lines = []
+    with compression.open_binary(input_file) as infile:
+        if shard.end is None:
+            # a compressed stream cannot seek, so skip the header bytes
+            infile.read(shard.start)
+        else:
+            infile.seek(shard.start)
+        reader = csv.reader(_range_lines(infile, byte_count, raw_lines))
+        line_num = 0
+        while True:
+            try:
+                items = next(reader)
+            except StopIteration:
+                break
+            except csv.Error:
+                # the reader starts again on the line after the failed record
+                items = None
+            lines = list(raw_lines)
+            raw_lines.clear()
+            yield shard.first_line + line_num, items, lines
+            line_num = reader.line_num
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+
+Stages connected by bounded queues, for overlapping I/O with computation.
+
+A StagePipeline runs a source iterator and a list of Stages, each on its own
+threads. The items from the source flow through the stages in order:
+
+    source -> [queue] -> stage 1 -> [queue] -> stage 2 -> ... -> last stage
+
+Each stage calls its function on each item and puts the result on the queue
+to the next stage; the results of the last stage are discarded. The queues
+are bounded, so a fast stage blocks when the stage after it falls behind,
+and memory use stays bounded no matter which stage is the slowest.
+
+A stage can have several workers. The items are numbered by the source, and
+a stage with a single worker always takes its items in that order, so the
+order of the items is preserved even if an earlier stage had several
+workers and finished them out of order.
+
+For each stage, StagePipeline.report gives the number of items, the time
+spent in the stage function ('busy'), waiting for input ('starved'), and
+waiting for room in the next queue ('blocked'), together with the maximum
+and mean depth of its input queue. The slowest stage is busy nearly all of
+the time, the stages before it are blocked, and the stages after it are
+starved; its input queue is usually full.
+
+If a stage function raises an exception, all stages are stopped and the
+exception is raised again by StagePipeline.run.
+
+"""
+
+import os
+import time
+import queue
+import threading
+
+# queue poll interval, for noticing that the pipeline has been stopped
+_POLL_S = 0.1
+
+# marks the end of the items in a queue
+_END = object()
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 1
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+class _Stopped(Exception):
+    """
+    Raised in a stage thread when another stage has failed.
+    """
+    pass
+
+
+###############################################################################
+class StageQueue(object):
+    """
+    Bounded queue of (sequence number, item) pairs that records its depth.
+    """
+
+    def __init__(self, maxsize):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.max_depth = 0
+        self._depth_sum = 0
+        self._put_count = 0
+
+    def put(self, entry, stop_event):
+        while True:
+            if stop_event.is_set():
+                raise _Stopped()
+            try:
+                self._queue.put(entry, timeout=_POLL_S)
+                break
+            except queue.Full:
+                continue
+
+        # the depth is sampled after each put
+        depth = self._queue.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        self._depth_sum += depth
+        self._put_count += 1
+
+    def get(self, stop_event):
+        while True:
+            if stop_event.is_set():
+                raise _Stopped()
+            try:
+                return self._queue.get(timeout=_POLL_S)
+            except queue.Empty:
+                continue
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def mean_depth(self):
+        if 0 == self._put_count:
+            return 0.0
+        return self._depth_sum / self._put_count
+
+
+###############################################################################
+class Stage(object):
+    """
+    A function applied to each item, with its timing statistics.
+    """
+
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self.item_count = 0
+        self.busy_s     = 0.0
+        self.starved_s  = 0.0
+        self.blocked_s  = 0.0
+
+    def _add_times(self, busy_s, starved_s, blocked_s):
+        with self._lock:
+            self.item_count += 1
+            self.busy_s     += busy_s
+            self.starved_s  += starved_s
+            self.blocked_s  += blocked_s
+
+
+###############################################################################
+class StagePipeline(object):
+    """
+    Runs a source iterator and a list of Stages on separate threads.
+    """
+
+    def __init__(self, stages, queue_size=2, source_name='source'):
+        self.stages = stages
+        self.source_name = source_name
+        self.queues = [StageQueue(queue_size) for s in stages]
+        self._stop = threading.Event()
+        self._errors = []
+        self._source_s = 0.0
+        self._source_blocked_s = 0.0
+
+    def _fail(self, exc):
+        self._errors.append(exc)
+        self._stop.set()
+
+    def _run_source(self, source):
+        out_queue = self.queues[0]
+        try:
+            seq = 0
+            start = time.perf_counter()
+            for item in source:
+                t0 = time.perf_counter()
+                out_queue.put( (seq, item), self._stop)
+                self._source_blocked_s += time.perf_counter() - t0
+                seq += 1
+            self._source_s = time.perf_counter() - start
+            for i in range(self.stages[0].workers):
+                out_queue.put( (seq, _END), self._stop)
+        except _Stopped:
+            pass
+        except Exception as exc:
+            self._fail(exc)
+
+    def _run_worker(self, index, finished):
+        """
+        Run one worker of stage 'index'. The 'finished' list counts the
+        workers of the stage that have seen the end of their input.
+        """
+
+        stage = self.stages[index]
+        in_queue = self.queues[index]
+        out_queue = None
+        if index + 1 < len(self.stages):
+            out_queue = self.queues[index + 1]
+
+        # items that arrived ahead of their turn, for in-order processing
+        pending = {}
+        next_seq = 0
+
+        try:
+            while True:
+                t0 = time.perf_counter()
+                if 1 == stage.workers:
+                    while next_seq not in pending:
+                        seq, item = in_queue.get(self._stop)
+                        pending[seq] = item
+                    item = pending.pop(next_seq)
+                    seq = next_seq
+                    next_seq += 1
+                else:
+                    seq, item = in_queue.get(self._stop)
+                t1 = time.perf_counter()
+
+                if item is _END:
+                    break
+
+                result = stage.fn(item)
+                t2 = time.perf_counter()
+
+                if out_queue is not None:
+                    out_queue.put( (seq, result), self._stop)
+                t3 = time.perf_counter()
+
+                stage._add_times(t2 - t1, t1 - t0, t3 - t2)
+
+            # the last worker of the stage to finish ends the next stage
+            with stage._lock:
+                finished.append(index)
+                last = len(finished) == stage.workers
+            if last and out_queue is not None:
+                for i in range(self.stages[index + 1].workers):
+                    out_queue.put( (seq, _END), self._stop)
+
+        except _Stopped:
+            pass
+        except Exception as exc:
+            self._fail(exc)
+
+    def run(self, source):
+        """
+        Run all items from the 'source' iterator through the stages, and
+        return when the last stage has processed the last item.
+        """
+
+        threads = [threading.Thread(target=self._run_source, args=(source,),
+                                    name=self.source_name, daemon=True)]
+        for index, stage in enumerate(self.stages):
+            finished = []
+            for w in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._run_worker, args=(index, finished),
+                    name='{0}-{1}'.format(stage.name, w), daemon=True))
+
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.elapsed_s = time.perf_counter() - start
+
+        if len(self._errors) > 0:
+            raise self._errors[0]
+
+        if _TRACE:
+            print(self.report())
+
+    def depths(self):
+        """
+        Return a dict of the current input queue depth for each stage.
+        """
+
+        return {stage.name:q.depth() for stage, q in zip(self.stages, self.queues)}
+
+    def report(self):
+        """
+        Return a printable summary of the time spent in each stage.
+        """
+
+        lines = ['Stage summary: ']
+        lines.append('\t{0:<10} {1:>7} {2:>9} {3:>9} {4:>9} {5:>6} {6:>6}'.
+                     format('stage', 'items', 'busy s', 'starved s',
+                            'blocked s', 'max q', 'mean q'))
+        lines.append('\t{0:<10} {1:>7} {2:>9.3f} {3:>9} {4:>9.3f} {5:>6} {6:>6}'.
+                     format(self.source_name, '', self._source_s - self._source_blocked_s,
+                            '', self._source_blocked_s, '', ''))
+        for stage, q in zip(self.stages, self.queues):
+            lines.append('\t{0:<10} {1:>7} {2:>9.3f} {3:>9.3f} {4:>9.3f} ' \
+                         '{5:>6} {6:>6.2f}'.
+                         format(stage.name, stage.item_count, stage.busy_s,
+                                stage.starved_s, stage.blocked_s,
+                                q.max_depth, q.mean_depth()))
+
+        return '\n'.join(lines)
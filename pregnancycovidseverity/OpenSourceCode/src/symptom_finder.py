@@ -12,6 +12,7 @@ import json
 from collections import namedtuple
 
 from . import finder_overlap as overlap
+from . import explain
 
 SYMPTOM_TUPLE_FIELDS = [
     'sentence',
@@ -122,11 +123,14 @@ def merge_symptoms(obj_list):
 
 ###############################################################################
 _VERSION_MAJOR = 0
-_VERSION_MINOR = 8
+_VERSION_MINOR = 10
 
 # set to True to enable debug output
 _TRACE = False
 
+# finder name for the explain records
+_FINDER = 'symptom_finder'
+
 # make a negation header, i.e. 'patient denies <symptom>'
 _str_neg_words = r'\b(denie(s|d)|without|absence of|unsure of|not (on|taking)|' \
         r'decline(s|d)|neg|not|no|negative)\b(?! date)\b'
@@ -794,22 +798,15 @@ def _cleanup(sentence):
     
     # collapse repeated whitespace
     sentence = re.sub(r'\s+', ' ', sentence)
-
-    if _TRACE:
-        print('Cleaned sentence: "{0}"'.format(sentence))
     
     return sentence
 
 
 ###############################################################################
-def _regex_match(sentence, regex_list):
+def _regex_match(sentence, regex_list, sink=None, stage=None):
     """
     """
 
-    if _TRACE:
-        print('Calling _regex_match: ')
-        print('\tsentence: {0}'.format(sentence))
-
     candidates = []
     for i, regex in enumerate(regex_list):
         match = regex.search(sentence)
@@ -824,12 +821,10 @@ def _regex_match(sentence, regex_list):
                                                 other=match))
             
 
-            if _TRACE:
-                print('[{0:2}]: [{1:3}, {2:3})\tMATCH TEXT: ->{3}<-'.
-                      format(i, start, end, match_text))
-                print('\tmatch.groupdict entries: ')
-                for k,v in match.groupdict().items():
-                    print('\t\t{0} => {1}'.format(k,v))
+            if sink is not None:
+                sink.add(_FINDER, explain.EVENT_MATCH, stage=stage,
+                         regex_index=i, start=start, end=end, text=match_text,
+                         groups=explain.match_groups(match))
     
 
     if 0 == len(candidates):
@@ -838,59 +833,56 @@ def _regex_match(sentence, regex_list):
     # sort candidates in descending order of length, for overlap resolution
     candidates = sorted(candidates, key=lambda x: x.end-x.start, reverse=True)
 
-    if _TRACE:
-        print('\tCandidate matches: ')
-        index = 0
-        for c in candidates:
-            print('\t[{0:2}]\t[{1},{2}): {3}'.
-                  format(index, c.start, c.end, c.match_text, c.regex))
-            index += 1
-        print()
-
     candidates = sorted(candidates, key=lambda x: x.end-x.start, reverse=True)
     pruned_candidates = overlap.remove_overlap(candidates,
-                                               _TRACE,
                                                keep_longest=True)
     pruned_candidates = sorted(pruned_candidates, key=lambda x: x.start)
+
+    if sink is not None:
+        for c in candidates:
+            if c not in pruned_candidates:
+                sink.add(_FINDER, explain.EVENT_DISCARD, stage=stage,
+                         start=c.start, end=c.end, text=c.match_text,
+                         reason='overlaps a longer candidate')
         
     return pruned_candidates
 
 
 ###############################################################################
-def _has_symptom(cleaned_sentence, regexes, group, neg_group):
+def _has_symptom(cleaned_sentence, regexes, group, neg_group, sink=None):
 
-    candidates = _regex_match(cleaned_sentence, regexes)
+    candidates = _regex_match(cleaned_sentence, regexes, sink, group)
 
     has_symptom = False
 
     for i,c in enumerate(candidates):
-        keys = set()
-        for k,v in c.other.groupdict().items():
-            if v is not None:
-                keys.add(k)
-
-        if _TRACE:
-            print('CANDIDATE {0}'.format(i))
-            print(c)
-            print('\t  text : {0}'.format(c.match_text))
-            print('\tgroups : {0}'.format(keys))
-
-        symptom_present = group in keys
+        symptom_present = overlap.group_value(c.other, group) is not None
 
         neg_symptom_present = False
         if neg_group is not None:
-            neg_symptom_present = neg_group in keys
+            neg_symptom_present = overlap.group_value(c.other, neg_group) is not None
+            if neg_symptom_present and sink is not None:
+                sink.add(_FINDER, explain.EVENT_NEGATION, stage=group,
+                         start=c.start, end=c.end, text=c.match_text,
+                         reason='negation group "{0}" matched'.format(neg_group))
 
             if not neg_symptom_present:
                 # check to see if one of the <words> matches includes the
                 # negation words, in which case it is actually a negation
                 match = _regex_neg_words.search(c.match_text)
                 if match:
-                    print('\t*** negation override ***')
+                    if sink is not None:
+                        sink.add(_FINDER, explain.EVENT_NEGATION, stage=group,
+                                 start=c.start, end=c.end, text=c.match_text,
+                                 reason='negation override, "{0}" in the ' \
+                                 'matching text'.format(match.group()))
                     neg_symptom_present = True
 
         if symptom_present and not neg_symptom_present:
             has_symptom = True
+            if sink is not None:
+                sink.add(_FINDER, explain.EVENT_RESULT, stage=group,
+                         start=c.start, end=c.end, text=c.match_text)
 
     return has_symptom
     
@@ -922,7 +914,7 @@ def _strip_dates(sentence):
     
 
 ###############################################################################
-def _is_in_icu(cleaned_sentence):
+def _is_in_icu(cleaned_sentence, sink=None):
     """
     Special handling for ICU admission. Only accept ICU admission if it is
     for Covid or a related symptom (intubation, ventilation, etc.).
@@ -933,62 +925,75 @@ def _is_in_icu(cleaned_sentence):
     stripped = re.sub(r'\s+', ' ', stripped)
 
     found_match1 = False
-    for regex in _ICU_REGEXES:
+    for i, regex in enumerate(_ICU_REGEXES):
         match = regex.search(stripped)
         if match:
             found_match1 = True
+            if sink is not None:
+                sink.add(_FINDER, explain.EVENT_MATCH, stage=_GROUP_ICU,
+                         regex_index=i, text=match.group(),
+                         groups=explain.match_groups(match),
+                         reason='sentence with dates removed')
 
     found_match2 = False
     if not found_match1:
         # strip out time periods and try to match again
         stripped2 = re.sub(r'\b(at|for) \d+ (weeks|days)\b', ' ', stripped)
         stripped2 = re.sub(r'\s+', ' ', stripped2)
-        for regex in _ICU_REGEXES:
+        for i, regex in enumerate(_ICU_REGEXES):
             match = regex.search(stripped2)
             if match:
                 found_match2 = True
+                if sink is not None:
+                    sink.add(_FINDER, explain.EVENT_MATCH, stage=_GROUP_ICU,
+                             regex_index=i, text=match.group(),
+                             groups=explain.match_groups(match),
+                             reason='sentence with dates and time periods ' \
+                             'removed')
                     
     return found_match1 or found_match2
     
     
 ###############################################################################
-def _has_fever(cleaned_sentence):
+def _has_fever(cleaned_sentence, sink=None):
     """
     Special handling for fever.
     """
 
-    fever_candidates = _regex_match(cleaned_sentence, _FEVER_REGEXES)
+    fever_candidates = _regex_match(cleaned_sentence, _FEVER_REGEXES,
+                                    sink, _GROUP_FEVER)
 
     has_fever = False
     
     for i,c in enumerate(fever_candidates):
-        keys = set()
-        for k,v in c.other.groupdict().items():
-            if v is not None:
-                keys.add(k)
-
-        if _TRACE:
-            print('FEVER CANDIDATE {0}'.format(i))
-            print(c)
-            print('\t  text : {0}'.format(c.match_text))
-            print('\tgroups : {0}'.format(keys))
-
-        fever_present = _GROUP_FEVER in keys
-        temp_present  = _GROUP_TEMP in keys
-        val_present   = _GROUP_TEMPVAL in keys
-        neg_fever     = _GROUP_NEG_FEVER in keys        
+        match = c.other
+        temp_val      = overlap.group_value(match, _GROUP_TEMPVAL)
+        fever_present = overlap.group_value(match, _GROUP_FEVER) is not None
+        temp_present  = overlap.group_value(match, _GROUP_TEMP) is not None
+        val_present   = temp_val is not None
+        neg_fever     = overlap.group_value(match, _GROUP_NEG_FEVER) is not None
 
         if not neg_fever:
             # check to see if one of the <words> matches includes the
             # negation words, in which case it is actually a negation
             match = _regex_neg_words.search(c.match_text)
             if match:
-                # print('\t*** found neg_fever match ***')
+                if sink is not None:
+                    sink.add(_FINDER, explain.EVENT_NEGATION,
+                             stage=_GROUP_FEVER, start=c.start, end=c.end,
+                             text=c.match_text,
+                             reason='negation override, "{0}" in the ' \
+                             'matching text'.format(match.group()))
                 neg_fever = True
+        elif sink is not None:
+            sink.add(_FINDER, explain.EVENT_NEGATION, stage=_GROUP_FEVER,
+                     start=c.start, end=c.end, text=c.match_text,
+                     reason='negation group "{0}" matched'.
+                     format(_GROUP_NEG_FEVER))
         
         # check temp val
         if (fever_present or temp_present) and val_present and not neg_fever:
-            val = float(c.other.groupdict()[_GROUP_TEMPVAL])
+            val = float(temp_val)
             #print('\t\ttemperature value: {0}'.format(val))
             if val < 45.0:
                 # assume celsius
@@ -997,72 +1002,81 @@ def _has_fever(cleaned_sentence):
                 has_fever = val > _FEVER_F
         elif fever_present and not neg_fever:
             has_fever = True
+
+        if has_fever and sink is not None:
+            sink.add(_FINDER, explain.EVENT_RESULT, stage=_GROUP_FEVER,
+                     start=c.start, end=c.end, text=c.match_text)
         
     return has_fever
 
 
 ###############################################################################
-def run(sentence, ignore_common=False):
+def run(sentence, ignore_common=False, sink=None):
     """
     """
 
     results = []
 
+    if sink is None and _TRACE:
+        sink = explain.TraceSink()
+
     cleaned_sentence = _cleanup(sentence)
+    if sink is not None:
+        sink.add(_FINDER, explain.EVENT_SENTENCE, text=cleaned_sentence)
     
-    has_fever           = _has_fever(cleaned_sentence)
-    has_dyspnea         = _has_symptom(cleaned_sentence, _DYSPNEA_REGEXES, _GROUP_DYSPNEA, _GROUP_NEG_DYSP)
-    has_cough           = _has_symptom(cleaned_sentence, _COUGH_REGEXES, _GROUP_COUGH, _GROUP_NEG_COUGH)
+    has_fever           = _has_fever(cleaned_sentence, sink)
+    has_dyspnea         = _has_symptom(cleaned_sentence, _DYSPNEA_REGEXES, _GROUP_DYSPNEA, _GROUP_NEG_DYSP, sink)
+    has_cough           = _has_symptom(cleaned_sentence, _COUGH_REGEXES, _GROUP_COUGH, _GROUP_NEG_COUGH, sink)
     is_intubated        = _has_symptom(cleaned_sentence, _INTUBATED_REGEXES,
-                                       _GROUP_INTUBATED, _GROUP_NEG_INTUBATED)
-    is_ventilated       = _has_symptom(cleaned_sentence, _VENTILATION_REGEXES, _GROUP_VENT, _GROUP_NEG_VENT)
+                                       _GROUP_INTUBATED, _GROUP_NEG_INTUBATED, sink)
+    is_ventilated       = _has_symptom(cleaned_sentence, _VENTILATION_REGEXES, _GROUP_VENT, _GROUP_NEG_VENT, sink)
     #in_icu              = _has_symptom(cleaned_sentence, _ICU_REGEXES, _GROUP_ICU, _GROUP_NEG_ICU)
-    in_icu              = _is_in_icu(cleaned_sentence)    
-    has_ards_or_rf      = _has_symptom(cleaned_sentence, _ARDS_REGEXES, _GROUP_ARDS, _GROUP_NEG_ARDS)
-    on_ecmo             = _has_symptom(cleaned_sentence, _ECMO_REGEXES, _GROUP_ECMO, _GROUP_NEG_ECMO)
-    has_septic_shock    = _has_symptom(cleaned_sentence, _SEPTIC_SHOCK_REGEXES, _GROUP_SHOCK, _GROUP_NEG_SHOCK)
-    has_mod             = _has_symptom(cleaned_sentence, _MOD_REGEXES, _GROUP_MOD, _GROUP_NEG_MOD)
+    in_icu              = _is_in_icu(cleaned_sentence, sink)    
+    has_ards_or_rf      = _has_symptom(cleaned_sentence, _ARDS_REGEXES, _GROUP_ARDS, _GROUP_NEG_ARDS, sink)
+    on_ecmo             = _has_symptom(cleaned_sentence, _ECMO_REGEXES, _GROUP_ECMO, _GROUP_NEG_ECMO, sink)
+    has_septic_shock    = _has_symptom(cleaned_sentence, _SEPTIC_SHOCK_REGEXES, _GROUP_SHOCK, _GROUP_NEG_SHOCK, sink)
+    has_mod             = _has_symptom(cleaned_sentence, _MOD_REGEXES, _GROUP_MOD, _GROUP_NEG_MOD, sink)
     on_remdesivir       = _has_symptom(cleaned_sentence, _REMDESIVIR_REGEXES,
-                                       _GROUP_REMDESIVIR, _GROUP_NEG_REMDESIVIR)
-    on_plasma           = _has_symptom(cleaned_sentence, _PLASMA_REGEXES, _GROUP_PLASMA, _GROUP_NEG_PLASMA)
+                                       _GROUP_REMDESIVIR, _GROUP_NEG_REMDESIVIR, sink)
+    on_plasma           = _has_symptom(cleaned_sentence, _PLASMA_REGEXES, _GROUP_PLASMA, _GROUP_NEG_PLASMA, sink)
     on_plaquenil        = _has_symptom(cleaned_sentence, _PLAQUENIL_REGEXES,
-                                       _GROUP_PLAQUENIL, _GROUP_NEG_PLAQUENIL)
+                                       _GROUP_PLAQUENIL, _GROUP_NEG_PLAQUENIL, sink)
     on_azithromycin     = _has_symptom(cleaned_sentence, _AZITHROMYCIN_REGEXES,
-                                       _GROUP_AZITHROMYCIN, _GROUP_NEG_AZITHROMYCIN)
+                                       _GROUP_AZITHROMYCIN, _GROUP_NEG_AZITHROMYCIN, sink)
     on_other_drugs      = _has_symptom(cleaned_sentence, _OTHER_DRUGS_REGEXES,
-                                       _GROUP_OTHER_DRUGS, _GROUP_NEG_OTHER_DRUGS)
+                                       _GROUP_OTHER_DRUGS, _GROUP_NEG_OTHER_DRUGS, sink)
     on_dexamethasone    = _has_symptom(cleaned_sentence, _DEX_REGEXES,
-                                       _GROUP_DEXAMETHASONE, _GROUP_NEG_DEXAMETHASONE)
+                                       _GROUP_DEXAMETHASONE, _GROUP_NEG_DEXAMETHASONE, sink)
     #died_from_covid  = _has_symptom(cleaned_sentence, _COVID_REGEXES, _GROUP_COVID, None)
-    has_chills          = _has_symptom(cleaned_sentence, _CHILLS_REGEXES, _GROUP_CHILLS, _GROUP_NEG_CHILLS)
-    has_rigors          = _has_symptom(cleaned_sentence, _RIGORS_REGEXES, _GROUP_RIGORS, _GROUP_NEG_RIGORS)
-    has_myalgia         = _has_symptom(cleaned_sentence, _MYALGIAS_REGEXES, _GROUP_MYALGIA, _GROUP_NEG_MYALGIA)
+    has_chills          = _has_symptom(cleaned_sentence, _CHILLS_REGEXES, _GROUP_CHILLS, _GROUP_NEG_CHILLS, sink)
+    has_rigors          = _has_symptom(cleaned_sentence, _RIGORS_REGEXES, _GROUP_RIGORS, _GROUP_NEG_RIGORS, sink)
+    has_myalgia         = _has_symptom(cleaned_sentence, _MYALGIAS_REGEXES, _GROUP_MYALGIA, _GROUP_NEG_MYALGIA, sink)
     has_runny_nose      = _has_symptom(cleaned_sentence, _RUNNY_NOSE_REGEXES,
-                                       _GROUP_RUNNY_NOSE, _GROUP_NEG_RUNNY_NOSE)
+                                       _GROUP_RUNNY_NOSE, _GROUP_NEG_RUNNY_NOSE, sink)
     has_sore_throat     = _has_symptom(cleaned_sentence, _SORE_THROAT_REGEXES,
-                                       _GROUP_SORE_THROAT,_GROUP_NEG_SORE_THROAT)
+                                       _GROUP_SORE_THROAT,_GROUP_NEG_SORE_THROAT, sink)
     has_prob_with_taste = _has_symptom(cleaned_sentence, _TASTE_REGEXES,
-                                       _GROUP_TASTE, _GROUP_NEG_TASTE)
+                                       _GROUP_TASTE, _GROUP_NEG_TASTE, sink)
     has_prob_with_smell = _has_symptom(cleaned_sentence, _SMELL_REGEXES,
-                                       _GROUP_SMELL, _GROUP_NEG_SMELL)
+                                       _GROUP_SMELL, _GROUP_NEG_SMELL, sink)
     has_fatigue         = _has_symptom(cleaned_sentence, _FATIGUE_REGEXES,
-                                       _GROUP_FATIGUE, _GROUP_NEG_FATIGUE)
+                                       _GROUP_FATIGUE, _GROUP_NEG_FATIGUE, sink)
     has_wheezing        = _has_symptom(cleaned_sentence, _WHEEZING_REGEXES,
-                                      _GROUP_WHEEZING, _GROUP_NEG_WHEEZING)
+                                      _GROUP_WHEEZING, _GROUP_NEG_WHEEZING, sink)
     has_chest_pain      = _has_symptom(cleaned_sentence, _CHEST_PAIN_REGEXES,
-                                       _GROUP_CHEST_PAIN, _GROUP_NEG_CHEST_PAIN)
+                                       _GROUP_CHEST_PAIN, _GROUP_NEG_CHEST_PAIN, sink)
     has_nausea          = _has_symptom(cleaned_sentence, _NAUSEA_REGEXES,
-                                       _GROUP_NAUSEA, _GROUP_NEG_NAUSEA)
+                                       _GROUP_NAUSEA, _GROUP_NEG_NAUSEA, sink)
     has_vomiting        = _has_symptom(cleaned_sentence, _VOMITING_REGEXES,
-                                       _GROUP_VOMITING, _GROUP_NEG_VOMITING)
+                                       _GROUP_VOMITING, _GROUP_NEG_VOMITING, sink)
     has_headache        = _has_symptom(cleaned_sentence, _HEADACHE_REGEXES,
-                                       _GROUP_HEADACHE, _GROUP_NEG_HEADACHE)
+                                       _GROUP_HEADACHE, _GROUP_NEG_HEADACHE, sink)
     has_abdominal_pain  = _has_symptom(cleaned_sentence, _ABD_PAIN_REGEXES,
-                                       _GROUP_ABD_PAIN, _GROUP_NEG_ABD_PAIN)
+                                       _GROUP_ABD_PAIN, _GROUP_NEG_ABD_PAIN, sink)
     has_diarrhea        = _has_symptom(cleaned_sentence, _DIARRHEA_REGEXES,
-                                       _GROUP_DIARRHEA, _GROUP_NEG_DIARRHEA)
+                                       _GROUP_DIARRHEA, _GROUP_NEG_DIARRHEA, sink)
     is_asymptomatic     = _has_symptom(cleaned_sentence, _ASYMPTOMATIC_REGEXES,
-                                       _GROUP_ASYMPTOMATIC, None)
+                                       _GROUP_ASYMPTOMATIC, None, sink)
     
     # automatically have dyspnea if have ards
     if has_ards_or_rf:
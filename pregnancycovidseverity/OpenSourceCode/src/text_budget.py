@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+
+Length budget for running the finders on a single text.
+
+Most texts in a SET-NET extract are a few hundred characters long, but an
+occasional text (such as a lab report pasted into the notes) can be hundreds
+of kilobytes. The cost of some of the finder regexes grows faster than the
+length of the text they search, so a single such text can stall the run.
+The word captures of the covid and symptom finders, of up to three runs of
+letters, '-', and '/', can split a single such run in many ways, so their
+cost grows with the cube of the length of the run: a note with a line of
+2000 slashes takes minutes.
+
+A TextBudget bounds the work done on any one text:
+
+    - Before any finder is run, each run of a repeated punctuation
+      character is shortened to REPEAT_CHARS characters, and a space is
+      inserted into each run of non-space characters after every
+      'max_token_chars' characters.
+
+    - Every finder is given at most 'window_chars' characters at a time.
+      A longer text is split into windows of at most 'window_chars'
+      characters, broken at a line end, sentence end, or space where
+      possible, for the covid and symptom finders, and its sentences are
+      split in the same way for the O2 finder. The results for the
+      windows are combined. A match that spans two windows is not found.
+
+    - A text longer than 'max_chars' is split into windows before
+      sentence segmentation, and its windows are split into sentences
+      with the regex splitter in o2sat_finder rather than with spaCy.
+      Only the first 'max_windows' of these windows are processed; the
+      remaining windows are skipped.
+
+The work for each window is then bounded, so the work for a single text is
+bounded by the work for about max('max_chars' / 'window_chars',
+'max_windows') windows, independent of the text. The budget depends only on
+the text and never on the elapsed time, so the results for a text are the
+same on every run. Texts longer than 'max_chars' are flagged FLAG_WINDOWED,
+texts with skipped windows are flagged FLAG_TRUNCATED, and other texts
+changed by 'cap_text' are flagged FLAG_CAPPED. A BudgetStats object counts
+the flagged texts and records the slowest text.
+
+"""
+
+import os
+import re
+from collections import namedtuple
+
+TEXT_BUDGET_FIELDS = [
+    'max_chars',        # split texts longer than this into windows
+    'window_chars',     # max length of each window, in characters
+    'max_windows',      # skip the windows of a text after this many
+    'max_token_chars',  # break runs of non-space characters this long
+]
+TextBudget = namedtuple('TextBudget', TEXT_BUDGET_FIELDS)
+
+# texts this long are far longer than any abstractor note
+DEFAULT_BUDGET = TextBudget(
+    max_chars    = 20000,
+    window_chars = 1000,
+    max_windows  = 20,
+    # longer than any word or number the finders look for
+    max_token_chars = 40,
+)
+
+# runs of a repeated punctuation character are shortened to this length
+REPEAT_CHARS = 3
+
+# flags for texts that exceeded the budget
+FLAG_WINDOWED  = 'windowed'
+FLAG_TRUNCATED = 'truncated'
+FLAG_CAPPED    = 'capped'
+
+# a window is broken at the last of these found in its second half
+_WINDOW_BREAKS = ['\n', '. ', '; ', ' ']
+
+_regex_repeat = re.compile(r'([^\w\s])\1{' + str(REPEAT_CHARS) + r',}')
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 4
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+def _window_end(text, start, window_chars):
+    """
+    Return the end offset of the window beginning at 'start'.
+    """
+
+    end = start + window_chars
+    if end >= len(text):
+        return len(text)
+
+    # do not break in the first half of the window, to keep windows long
+    lo = start + window_chars // 2
+    for brk in _WINDOW_BREAKS:
+        pos = text.rfind(brk, lo, end)
+        if pos >= 0:
+            return pos + len(brk)
+
+    # no break found, so split mid-word
+    return end
+
+
+###############################################################################
+def _split(text, window_chars):
+    """
+    Split a text into windows of at most 'window_chars' characters.
+    """
+
+    windows = []
+    start = 0
+    while start < len(text):
+        end = _window_end(text, start, window_chars)
+        windows.append(text[start:end])
+        start = end
+
+    return windows
+
+
+###############################################################################
+def cap_text(text, budget):
+    """
+    Return the text with each run of a repeated punctuation character
+    shortened to REPEAT_CHARS characters, and with a space inserted into each
+    run of non-space characters after every 'max_token_chars' characters.
+    Returns the text unchanged if 'budget' is None.
+    """
+
+    if budget is None:
+        return text
+
+    text = _regex_repeat.sub(lambda match: match.group(1) * REPEAT_CHARS, text)
+    return re.sub(r'\S{{{0}}}(?=\S)'.format(budget.max_token_chars), r'\g<0> ',
+                  text)
+
+
+###############################################################################
+def split_windows(text, budget):
+    """
+    Return a list of windows for a text that exceeds the length budget, or
+    None if the text is within the budget or 'budget' is None.
+    """
+
+    if budget is None or len(text) <= budget.max_chars:
+        return None
+
+    return _split(text, budget.window_chars)
+
+
+###############################################################################
+def split_sentences(sentences, budget):
+    """
+    Return the list of sentences capped with 'cap_text', with each sentence
+    longer than the window length of the budget split into windows. Returns
+    the list unchanged if 'budget' is None. A text is split into windows for
+    the finders by passing it as the only sentence.
+    """
+
+    if budget is None:
+        return sentences
+
+    split = []
+    for sentence in sentences:
+        sentence = cap_text(sentence, budget)
+        if len(sentence) <= budget.window_chars:
+            split.append(sentence)
+        else:
+            split.extend(_split(sentence, budget.window_chars))
+
+    return split
+
+
+###############################################################################
+def run_windows(windows, run_fn, budget):
+    """
+    Call 'run_fn' on each of the first 'max_windows' windows in turn.
+    Returns the list of results for the windows processed, and the flag
+    for the text.
+    """
+
+    results = [run_fn(window) for window in windows[:budget.max_windows]]
+    if len(windows) > budget.max_windows:
+        if _TRACE:
+            print('\twindow budget exceeded, skipped {0} of {1} windows'.
+                  format(len(windows) - budget.max_windows, len(windows)))
+        return results, FLAG_TRUNCATED
+
+    return results, FLAG_WINDOWED
+
+
+###############################################################################
+class BudgetStats(object):
+    """
+    Counts of the texts that exceeded the budget, and the slowest text.
+    """
+
+    def __init__(self):
+        self.text_count      = 0
+        self.windowed_count  = 0
+        self.truncated_count = 0
+        self.capped_count    = 0
+        self.window_count    = 0
+        self.max_seconds     = 0.0
+        self.max_chars       = 0     # length of the slowest text
+
+    def add(self, text_len, seconds, flag=None, window_count=0):
+        """
+        Record the time for a single text and its flag, if any.
+        """
+
+        self.text_count += 1
+        if FLAG_WINDOWED == flag:
+            self.windowed_count += 1
+        elif FLAG_TRUNCATED == flag:
+            self.truncated_count += 1
+        elif FLAG_CAPPED == flag:
+            self.capped_count += 1
+        self.window_count += window_count
+
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+            self.max_chars = text_len
+
+    def merge(self, other):
+        """
+        Add the counts from another BudgetStats object to this one.
+        """
+
+        self.text_count      += other.text_count
+        self.windowed_count  += other.windowed_count
+        self.truncated_count += other.truncated_count
+        self.capped_count    += other.capped_count
+        self.window_count    += other.window_count
+        if other.max_seconds > self.max_seconds:
+            self.max_seconds = other.max_seconds
+            self.max_chars = other.max_chars
+
+    def report(self):
+        """
+        Return a printable summary of the budget statistics.
+        """
+
+        lines = ['Text budget summary: ']
+        lines.append('\tTexts        : {0:>9}'.format(self.text_count))
+        lines.append('\tWindowed     : {0:>9}'.format(self.windowed_count))
+        lines.append('\tTruncated    : {0:>9}'.format(self.truncated_count))
+        lines.append('\tCapped       : {0:>9}'.format(self.capped_count))
+        lines.append('\tWindows      : {0:>9}'.format(self.window_count))
+        lines.append('\tSlowest text : {0:>9.3f} s ({1} chars)'.
+                     format(self.max_seconds, self.max_chars))
+
+        return '\n'.join(lines)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+
+Unique-text execution plan for the SET-NET driver.
+
+The text columns of a SET-NET extract are highly redundant. The same
+medication names, 'other symptom' descriptions, and stock abstractor phrases
+appear in many rows. A TextPlan assigns an integer id to each distinct text
+in each column, so that the driver can run segmentation and the finders once
+per distinct text and then fan the results back out to the patients.
+
+The texts are grouped exactly as they appear in the file. The finders are
+sensitive to case and whitespace in a few places (sentence segmentation is
+only attempted for texts longer than a fixed length, and some regexes are
+case-sensitive), so any more aggressive normalization could change results.
+Empty texts are not stored; they all share the id EMPTY_ID.
+
+A long file can be processed in chunks of rows by calling 'clear' after each
+chunk. This drops the texts and restarts the ids, but keeps the counts, so
+that the statistics cover all chunks. If the chunks are processed
+concurrently, each chunk needs its own plan; the statistics of each can then
+be added to a single plan with 'add_stats'.
+
+"""
+
+import os
+from collections import namedtuple
+
+# text id for an empty text field
+EMPTY_ID = -1
+
+DEDUP_STATS_FIELDS = [
+    'col_name',
+    'row_count',        # number of rows added to the plan
+    'text_count',       # number of nonempty texts in the column
+    'unique_count',     # number of distinct nonempty texts
+    'char_count',       # total chars in all nonempty texts
+    'unique_char_count' # total chars in the distinct texts
+]
+DedupStats = namedtuple('DedupStats', DEDUP_STATS_FIELDS)
+
+
+###############################################################################
+_VERSION_MAJOR = 0
+_VERSION_MINOR = 3
+
+# set to True to enable debug output
+_TRACE = False
+
+
+###############################################################################
+def enable_debug():
+
+    global _TRACE
+    _TRACE = True
+
+
+###############################################################################
+def get_version():
+    path, module_name = os.path.split(__file__)
+    return '{0} {1}.{2}'.format(module_name, _VERSION_MAJOR, _VERSION_MINOR)
+
+
+###############################################################################
+class TextPlan(object):
+    """
+    Map of (column, text) to text id for a set of text columns.
+    """
+
+    def __init__(self, col_names):
+        self.col_names = list(col_names)
+
+        # maps text to text id, one dict per column
+        self._ids = {col_name:{} for col_name in self.col_names}
+
+        # distinct texts, indexed by text id
+        self._texts = {col_name:[] for col_name in self.col_names}
+
+        self._row_counts  = {col_name:0 for col_name in self.col_names}
+        self._text_counts = {col_name:0 for col_name in self.col_names}
+        self._char_counts = {col_name:0 for col_name in self.col_names}
+
+        # counts of distinct texts from the chunks that have been cleared
+        self._unique_counts      = {col_name:0 for col_name in self.col_names}
+        self._unique_char_counts = {col_name:0 for col_name in self.col_names}
+
+    def add(self, col_name, text):
+        """
+        Add a text for one row of the given column and return its text id.
+        """
+
+        self._row_counts[col_name] += 1
+        if 0 == len(text):
+            return EMPTY_ID
+
+        self._text_counts[col_name] += 1
+        self._char_counts[col_name] += len(text)
+
+        id_map = self._ids[col_name]
+        text_id = id_map.get(text)
+        if text_id is None:
+            text_id = len(id_map)
+            id_map[text] = text_id
+            self._texts[col_name].append(text)
+            if _TRACE:
+                print('\t{0}: new text {1}: "{2}"'.
+                      format(col_name, text_id, text))
+
+        return text_id
+
+    def texts(self, col_name):
+        """
+        Return the list of distinct texts for a column, indexed by text id.
+        """
+
+        return self._texts[col_name]
+
+    def text(self, col_name, text_id):
+        """
+        Return the text with the given id, or the empty string for EMPTY_ID.
+        """
+
+        if EMPTY_ID == text_id:
+            return ''
+        return self._texts[col_name][text_id]
+
+    def run(self, col_name, run_fn, empty_result=None):
+        """
+        Call 'run_fn' on the list of distinct texts for the given column.
+        The function must return one result per text, in the same order.
+        Returns a function that maps a text id to its result.
+        """
+
+        texts = self._texts[col_name]
+        results = run_fn(texts)
+        assert len(results) == len(texts)
+
+        def lookup(text_id):
+            if EMPTY_ID == text_id:
+                return empty_result
+            return results[text_id]
+
+        return lookup
+
+    def clear(self):
+        """
+        Drop all distinct texts and restart the text ids at zero, but keep
+        the counts for the statistics.
+        """
+
+        for col_name in self.col_names:
+            texts = self._texts[col_name]
+            self._unique_counts[col_name] += len(texts)
+            self._unique_char_counts[col_name] += sum([len(t) for t in texts])
+            self._ids[col_name] = {}
+            self._texts[col_name] = []
+
+    def add_stats(self, stats_list):
+        """
+        Add the DedupStats from the 'stats' method of another plan for the
+        same columns to the counts of this plan, as if the texts of the other
+        plan had been added to this plan and then cleared.
+        """
+
+        for s in stats_list:
+            col_name = s.col_name
+            self._row_counts[col_name]         += s.row_count
+            self._text_counts[col_name]        += s.text_count
+            self._char_counts[col_name]        += s.char_count
+            self._unique_counts[col_name]      += s.unique_count
+            self._unique_char_counts[col_name] += s.unique_char_count
+
+    def stats(self):
+        """
+        Return a list of DedupStats namedtuples, one per column.
+        """
+
+        stats_list = []
+        for col_name in self.col_names:
+            texts = self._texts[col_name]
+            unique_count = self._unique_counts[col_name] + len(texts)
+            unique_chars = self._unique_char_counts[col_name] + \
+                sum([len(t) for t in texts])
+            stats_list.append(DedupStats(
+                col_name          = col_name,
+                row_count         = self._row_counts[col_name],
+                text_count        = self._text_counts[col_name],
+                unique_count      = unique_count,
+                char_count        = self._char_counts[col_name],
+                unique_char_count = unique_chars,
+            ))
+
+        return stats_list
+
+    def report(self):
+        """
+        Return a printable summary of the deduplication savings per column.
+        """
+
+        lines = ['Unique text summary: ']
+        lines.append('\t{0:<16} {1:>9} {2:>9} {3:>9} {4:>7}'.
+                     format('column', 'texts', 'unique', 'chars', 'saved'))
+
+        total_chars = 0
+        total_unique_chars = 0
+        for s in self.stats():
+            total_chars += s.char_count
+            total_unique_chars += s.unique_char_count
+            lines.append('\t{0:<16} {1:>9} {2:>9} {3:>9} {4:>6.1f}%'.
+                         format(s.col_name, s.text_count, s.unique_count,
+                                s.char_count,
+                                _pct_saved(s.char_count, s.unique_char_count)))
+
+        lines.append('\t{0:<16} {1:>9} {2:>9} {3:>9} {4:>6.1f}%'.
+                     format('all', '', '', total_chars,
+                            _pct_saved(total_chars, total_unique_chars)))
+
+        return '\n'.join(lines)
+
+
+###############################################################################
+def _pct_saved(char_count, unique_char_count):
+    """
+    Percentage of the text that does not need to be processed.
+    """
+
+    if 0 == char_count:
+        return 0.0
+    return 100.0 * (char_count - unique_char_count) / char_count
@@ -0,0 +1,31 @@
+"""
+
+Shared fixtures for the tests. Run from the OpenSourceCode directory with:
+
+    python -m pytest -q tests
+
+The tests that import the pipeline need the spaCy model 'en_core_web_md',
+and are skipped if it is not installed.
+
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+###############################################################################
+@pytest.fixture(scope='session')
+def pipeline():
+    """
+    The pipeline module, or skip the test if the spaCy model is missing.
+    """
+
+    try:
+        from src import pipeline
+    except OSError as e:
+        pytest.skip('spaCy model not available: {0}'.format(e))
+    return pipeline
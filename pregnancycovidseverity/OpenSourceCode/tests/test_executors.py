@@ -0,0 +1,59 @@
+"""
+
+Tests that the executor backends give the same diagnoses as the in-process
+backend.
+
+"""
+
+import os
+
+import pytest
+
+from src import executors
+
+INPUT_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'synthetic_data_20220328.csv')
+
+
+###############################################################################
+def _fail(*args):
+    raise RuntimeError('initializer failed')
+
+
+###############################################################################
+def test_inprocess_initializer():
+    # the error in the initializer is raised by the first task's future
+    executor = executors.InProcessExecutor(initializer=_fail)
+    future = executor.submit(len, 'abc')
+    with pytest.raises(RuntimeError):
+        future.result()
+
+    calls = []
+    executor = executors.InProcessExecutor(initializer=calls.append,
+                                           initargs=(1,))
+    assert [] == calls
+    assert [3, 2] == [executor.submit(len, s).result() for s in ['abc', 'ab']]
+    assert [1] == calls
+
+
+###############################################################################
+def _diagnoses(pipeline, output_dir, backend):
+    from src import output
+
+    writer = output.OutputWriter(output_dir, 'x')
+    pipeline.run(INPUT_FILE, writer, shard_count=2, processes=2,
+                 backend=backend, progress_interval=None)
+    writer.close()
+    with open(os.path.join(output_dir, 'diagnoses_x.csv'), 'rb') as infile:
+        return infile.read()
+
+
+###############################################################################
+@pytest.mark.parametrize('backend', [executors.PROCESS, executors.DASK])
+def test_backends(pipeline, tmp_path, backend):
+    if executors.DASK == backend:
+        pytest.importorskip('distributed')
+
+    expected = _diagnoses(pipeline, str(tmp_path / executors.INPROCESS),
+                          executors.INPROCESS)
+    assert expected == _diagnoses(pipeline, str(tmp_path / backend), backend)
@@ -0,0 +1,53 @@
+"""
+
+Tests for the per-stage peaks of the memory profile.
+
+"""
+
+from src import memory_profile as mp
+
+
+###############################################################################
+def test_stage_peaks():
+    profile = mp.MemoryProfile(trace=True)
+    profile.start()
+    try:
+        # a stage that runs alone has a peak
+        state = profile.begin('a')
+        data = bytearray(1 << 20)
+        del data
+        profile.end('a', state)
+
+        # stages that overlap have none, even if one began alone
+        state_b = profile.begin('b')
+        state_c = profile.begin('c')
+        profile.end('c', state_c)
+        profile.end('b', state_b)
+
+        # a stage that fails does not count as running
+        previous = mp.use(profile)
+        try:
+            with mp.stage('d'):
+                raise ValueError()
+        except ValueError:
+            pass
+        finally:
+            mp.use(previous)
+        state = profile.begin('e')
+        profile.end('e', state)
+    finally:
+        profile.stop()
+
+    calls, net, peak, peak_calls = profile.stages['a']
+    assert 1 == peak_calls
+    assert peak >= 1 << 20
+    assert 0 == profile.stages['b'][3]
+    assert 0 == profile.stages['c'][3]
+    assert 'd' not in profile.stages
+    assert 1 == profile.stages['e'][3]
+
+    rows = {line.split()[0]: line.split()
+            for line in profile.report().splitlines()[2:]}
+    assert '-' == rows['b'][-1]
+    assert '-' != rows['a'][-1]
+
@@ -0,0 +1,60 @@
+"""
+
+Tests for the O2 keyword prefilter and per-sentence extraction.
+
+"""
+
+import time
+
+from src import o2sat_finder as o2f
+
+# a note whose sentences, scanned as a single document, made the SaO2 regexes
+# backtrack for minutes
+SLOW_NOTE = 'O2 sats down to 89. pt started having increased o2 ' \
+    'requirements. Discord in selected race - both selections recorded. ' \
+    'PATIENT ADMITTED TO ICU FOR WORSENING COVID SYMPTOMS. Admitted to ICU ' \
+    'on Aug 4 2021.'
+
+# generous bound, the note takes a few milliseconds
+MAX_SECONDS = 1.0
+
+
+###############################################################################
+def test_keywords_found_for_every_result():
+    for sentence in o2f.SENTENCES:
+        if len(o2f.extract(sentence)) > 0:
+            assert o2f.has_o2_content(sentence), sentence
+
+
+###############################################################################
+def test_no_keywords():
+    assert not o2f.has_o2_content('Discord in selected race - both ' \
+                                  'selections recorded.')
+    assert not o2f.has_o2_content('Admitted to ICU on Aug 4 2021.')
+
+
+###############################################################################
+def test_slow_note_per_sentence():
+    start = time.perf_counter()
+    assert o2f.has_o2_content(SLOW_NOTE)
+    results = []
+    for sentence in o2f.split_sentences(SLOW_NOTE):
+        if o2f.has_o2_content(sentence):
+            results.extend(o2f.extract(sentence))
+    assert time.perf_counter() - start < MAX_SECONDS
+
+    assert 2 == len(results)
+    assert 89 == results[0].value
+    assert results[1].needs_o2
+
+
+###############################################################################
+def test_slow_note_pipeline(pipeline):
+    start = time.perf_counter()
+    o2_summary, o2_lists = pipeline.extract_o2_info(SLOW_NOTE, None, True)
+    assert time.perf_counter() - start < MAX_SECONDS
+
+    assert 2 == o2_summary.count
+    assert 89 == o2_summary.min_spo2
+    assert o2_summary.needs_o2
+    assert 2 == len(o2_lists.needs_o2)
@@ -0,0 +1,99 @@
+"""
+
+Tests for the output files of a run, and of a run that fails.
+
+"""
+
+import os
+import shutil
+
+import pytest
+
+from src import output
+
+INPUT_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'synthetic_data_20220328.csv')
+
+
+###############################################################################
+def test_close_renames(tmp_path):
+    for sort_by_id in [True, False]:
+        output_dir = str(tmp_path / str(sort_by_id))
+        writer = output.OutputWriter(output_dir, 'x', sort_by_id=sort_by_id)
+        assert not os.path.exists(writer.diagnoses_file)
+        writer.close()
+
+        names = os.listdir(output_dir)
+        assert 'diagnoses_x.csv' in names
+        assert not any([n.startswith(output.PARTIAL_PREFIX) for n in names])
+
+
+###############################################################################
+def test_discard(tmp_path):
+    for sort_by_id in [True, False]:
+        output_dir = str(tmp_path / str(sort_by_id))
+        writer = output.OutputWriter(output_dir, 'x', sort_by_id=sort_by_id)
+        writer.discard()
+        assert [] == os.listdir(output_dir)
+
+
+###############################################################################
+def test_failed_jobs(pipeline, tmp_path):
+    from src import jobs
+    from src import executors
+
+    good_file = str(tmp_path / 'good_20220328.csv')
+    shutil.copy(INPUT_FILE, good_file)
+
+    # a data row repeats the patient id of the first row
+    dup_file = str(tmp_path / 'dup_20220101.csv')
+    with open(INPUT_FILE, 'rb') as infile:
+        lines = infile.readlines()
+    with open(dup_file, 'wb') as outfile:
+        outfile.writelines(lines + [lines[1]])
+
+    # the header cannot be read
+    bad_file = str(tmp_path / 'bad_20230101.csv.gz')
+    with open(bad_file, 'wb') as outfile:
+        outfile.write(b'\x1f\x8b\x08\x00garbage')
+
+    job_list = [
+        jobs.Job(f, str(tmp_path / 'results' / date), date)
+        for f, date in [(dup_file, '20220101'), (bad_file, '20230101'),
+                        (good_file, '20220328')]
+    ]
+    statuses = jobs.run_jobs(job_list, processes=1,
+                             backend=executors.INPROCESS,
+                             progress_interval=None)
+
+    assert [jobs.STATE_FAILED, jobs.STATE_FAILED, jobs.STATE_DONE] == \
+        [status.state for status in statuses]
+    for job, status in zip(job_list, statuses):
+        diagnoses_file = os.path.join(job.output_dir,
+                                      'diagnoses_{0}.csv'.format(job.date))
+        assert (jobs.STATE_DONE == status.state) == \
+            os.path.isfile(diagnoses_file)
+
+
+###############################################################################
+def test_memory_budget(pipeline, tmp_path):
+    from src import jobs
+    from src import executors
+    from src import memory_profile
+
+    job_list = []
+    for date in ['20220101', '20220328']:
+        input_file = str(tmp_path / 'data_{0}.csv'.format(date))
+        shutil.copy(INPUT_FILE, input_file)
+        job_list.append(jobs.Job(input_file, str(tmp_path / 'results' / date),
+                                 date))
+
+    # every worker exceeds a budget of 1 MB
+    with pytest.raises(memory_profile.MemoryBudgetError):
+        jobs.run_jobs(job_list, processes=1, shard_bytes=4096,
+                      backend=executors.INPROCESS, progress_interval=None,
+                      memory_budget_mb=1)
+
+    for job in job_list:
+        if os.path.isdir(job.output_dir):
+            assert [] == os.listdir(job.output_dir)
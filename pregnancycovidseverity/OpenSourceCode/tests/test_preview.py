@@ -0,0 +1,46 @@
+"""
+
+Tests for the sampling and the estimates of the preview.
+
+"""
+
+import os
+
+import pytest
+
+INPUT_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'synthetic_data_20220328.csv')
+
+
+###############################################################################
+@pytest.fixture(scope='module')
+def preview(pipeline):
+    from src import preview
+    return preview
+
+
+###############################################################################
+def test_collapse_strata(preview):
+    other = preview.OTHER_STRATUM
+    strata = preview._collapse_strata({'a':10, 'b':1, 'c':1, 'd':5})
+    assert {'a':'a', 'b':other, 'c':other, 'd':'d'} == strata
+
+    # a collapsed stratum that is still too small is merged into the
+    # smallest remaining one
+    strata = preview._collapse_strata({'a':10, 'b':1, 'c':0, 'd':5})
+    assert {'a':'a', 'b':'d', 'c':'d', 'd':'d'} == strata
+
+
+###############################################################################
+@pytest.mark.parametrize('stratify_col', [None, 'mv_icu', 'Obs'])
+def test_sample_size(preview, pipeline, stratify_col):
+    col_names, col_map = pipeline.read_header(INPUT_FILE)
+    for sample_size in [1, 20, 150]:
+        sample, strata = preview.sample_lines(INPUT_FILE, col_names, col_map,
+                                              sample_size, 1, stratify_col)
+        assert sample_size == len(sample)
+        assert sample_size == sum([n for N, n in strata.values()])
+        assert len(strata) <= preview.MAX_STRATA + 1
+        if len(strata) > 1:
+            assert all([n >= preview.MIN_STRATUM_SAMPLE
+                        for N, n in strata.values()])
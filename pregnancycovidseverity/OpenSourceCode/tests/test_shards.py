@@ -0,0 +1,118 @@
+"""
+
+Tests for splitting a CSV file into shards.
+
+"""
+
+import os
+import csv
+import random
+
+from src import shards
+
+INPUT_FILE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'synthetic_data_20220328.csv')
+
+
+###############################################################################
+def _write_rows(path, rows):
+    with open(path, 'w', encoding='latin-1', newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['id', 'height', 'notes'])
+        writer.writerows(rows)
+
+
+###############################################################################
+def _sharded_records(path, shard_count):
+    records = []
+    for shard in shards.find_shards(path, shard_count):
+        records.extend([items for line_index, items, raw_lines
+                        in shards.read_records(path, shard)])
+    return records
+
+
+###############################################################################
+def _whole_records(path):
+    with open(path, 'r', encoding='latin-1', newline='') as infile:
+        reader = csv.reader(infile)
+        next(reader)
+        return list(reader)
+
+
+###############################################################################
+def test_quoted_newlines(tmp_path):
+    rng = random.Random(1)
+    rows = []
+    for i in range(2000):
+        notes = 'line one\nline "two", three' if rng.random() < 0.1 else 'ok'
+        rows.append( (str(i), '160', notes) )
+    path = str(tmp_path / 'quoted.csv')
+    _write_rows(path, rows)
+
+    expected = _whole_records(path)
+    for shard_count in [4, 8, 16]:
+        assert len(shards.find_shards(path, shard_count)) > 1
+        assert expected == _sharded_records(path, shard_count)
+
+
+###############################################################################
+def test_stray_quotes(tmp_path):
+    rng = random.Random(2)
+    lines = ['id,height,notes\r\n']
+    for i in range(2000):
+        # quotes within unquoted fields are written as they are
+        height = '5\'2" tall' if rng.random() < 0.01 else '160'
+        notes = '"seen, then\r\nreleased"' if rng.random() < 0.1 else 'ok'
+        lines.append('{0},{1},{2}\r\n'.format(i, height, notes))
+    path = str(tmp_path / 'stray.csv')
+    with open(path, 'w', encoding='latin-1', newline='') as outfile:
+        outfile.write(''.join(lines))
+
+    expected = _whole_records(path)
+    assert 2000 == len(expected)
+    for shard_count in [4, 8, 16]:
+        assert expected == _sharded_records(path, shard_count)
+
+
+###############################################################################
+def _read_lines(pipeline, path):
+    col_names, col_map = pipeline.read_header(path)
+    corrupted_line_indices = []
+    lines = list(pipeline.read_lines(path, col_names, corrupted_line_indices))
+    return [i for i, line_items in lines], corrupted_line_indices
+
+
+###############################################################################
+def test_stray_quote_pair(pipeline, tmp_path):
+    with open(INPUT_FILE, 'r', encoding='latin-1', newline='') as infile:
+        lines = infile.readlines()
+
+    # a quote at the start of the second field of two rows, which joins the
+    # rows from one to the other into a record with the right field count
+    for i in [5, 50]:
+        items = lines[i].split(',')
+        items[1] = '"' + items[1]
+        lines[i] = ','.join(items)
+    path = str(tmp_path / 'pair.csv')
+    with open(path, 'w', encoding='latin-1', newline='') as outfile:
+        outfile.write(''.join(lines))
+
+    indices, corrupted_line_indices = _read_lines(pipeline, path)
+    assert [5, 50] == corrupted_line_indices
+    assert [i for i in range(1, len(lines)) if i not in [5, 50]] == indices
+
+
+###############################################################################
+def test_unterminated_quote(pipeline, tmp_path):
+    # a quote that is never closed, followed by more than the csv field limit
+    lines = ['id,height,notes\r\n', '0,"160,ok\r\n']
+    for i in range(1, 2000):
+        lines.append('{0},160,{1}\r\n'.format(i, 'x' * 100))
+    path = str(tmp_path / 'unterminated.csv')
+    with open(path, 'w', encoding='latin-1', newline='') as outfile:
+        outfile.write(''.join(lines))
+    assert os.path.getsize(path) > csv.field_size_limit()
+
+    indices, corrupted_line_indices = _read_lines(pipeline, path)
+    assert [1] == corrupted_line_indices
+    assert list(range(2, len(lines))) == indices
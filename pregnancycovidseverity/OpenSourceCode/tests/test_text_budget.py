@@ -0,0 +1,122 @@
+"""
+
+Tests for the text budget and for the worst-case time of a single text.
+
+"""
+
+import time
+from collections import namedtuple
+
+from src import result_cache
+from src import text_budget
+
+BUDGET = text_budget.TextBudget(
+    max_chars    = 2000,
+    window_chars = 500,
+    max_windows  = 4,
+    max_token_chars = 40,
+)
+
+# a note that makes the O2 regexes backtrack on long sentences
+SLOW_NOTE = 'o2 ' + 'a' * 200000
+
+# notes that each took minutes before every finder was under the budget:
+# a line of slashes made the covid finder backtrack, a line of dashes the
+# symptom finder, a long word both, and a run of short words after an O2
+# header the O2 finder
+PATHOLOGICAL_NOTES = [
+    'foresight testing positive for homocystinuria CBS-related with ' \
+    'testing on father not complete; COVID sx were fatigue and loss of ' \
+    'taste and smell; her child had known exposure and all household ' \
+    'members tested positive ' + '/' * 2000 + ' Diagnosed with ' \
+    'subchorionic hemorrhage in first and second trimester of pregnancy',
+    'SpO2: 100%   ABG: 7.43/40/81/23/0   Ve: 17.4 L/min   PaO2 / FiO2: ' \
+    '164 ' + '-' * 2000 + ' Discord in selected race',
+    'PATIENT ADMITTED TO ICU FOR WORSENING COVID SYMPTOMS ' + '-' * 2000,
+    'household members tested positive ' + 'ab' * 400,
+    'O2 sat was stable overnight and the patient was comfortable resting ' \
+    'in bed with family at the bedside and no acute distress noted',
+]
+
+# generous bound, the notes take well under a second within the budget
+MAX_SECONDS = 5.0
+
+_Result = namedtuple('_Result', ['value', 'budget_flag'])
+
+
+###############################################################################
+def test_windows_cover_text():
+    text = 'word ' * 1000
+    windows = text_budget.split_windows(text, BUDGET)
+    assert text == ''.join(windows)
+    assert all([len(w) <= BUDGET.window_chars for w in windows])
+    assert text_budget.split_windows(text[:BUDGET.max_chars], BUDGET) is None
+
+
+###############################################################################
+def test_run_windows_is_deterministic():
+    windows = ['w{0}'.format(i) for i in range(10)]
+    results, flag = text_budget.run_windows(windows, str.upper, BUDGET)
+    assert ['W0', 'W1', 'W2', 'W3'] == results
+    assert text_budget.FLAG_TRUNCATED == flag
+
+    results, flag = text_budget.run_windows(windows[:4], str.upper, BUDGET)
+    assert 4 == len(results)
+    assert text_budget.FLAG_WINDOWED == flag
+
+
+###############################################################################
+def test_split_sentences():
+    sentences = ['short', 'long ' * 300]
+    split = text_budget.split_sentences(sentences, BUDGET)
+    assert 'short' == split[0]
+    assert sentences[1] == ''.join(split[1:])
+    assert all([len(s) <= BUDGET.window_chars for s in split])
+    assert sentences is text_budget.split_sentences(sentences, None)
+
+
+###############################################################################
+def test_cap_text():
+    text = 'sat 95%, bp 120/80 ... -- ok'
+    assert text == text_budget.cap_text(text, BUDGET)
+
+    capped = text_budget.cap_text('a ' + '/' * 100 + ' ' + 'x' * 100, BUDGET)
+    assert 'a /// ' == capped[:6]
+    assert all([len(token) <= BUDGET.max_token_chars
+                for token in capped.split()])
+    assert text is text_budget.cap_text(text, None)
+
+
+###############################################################################
+def test_truncated_results_not_cached():
+    cache = result_cache.ResultCache()
+    flags = [None, text_budget.FLAG_WINDOWED, text_budget.FLAG_TRUNCATED]
+    run_fn = lambda indices: [_Result(i, flags[i]) for i in indices]
+    cache.run('col', ['a', 'b', 'c'], run_fn)
+    assert 2 == len(cache)
+
+
+###############################################################################
+def test_worst_case_latency(pipeline):
+    tasks = pipeline.TEXT_COL_TASKS['mg_notes']
+    for text in [SLOW_NOTE[:BUDGET.max_chars], SLOW_NOTE]:
+        start = time.perf_counter()
+        results = pipeline.run_texts([text], tasks, budget=BUDGET)
+        assert time.perf_counter() - start < MAX_SECONDS
+
+    assert text_budget.FLAG_TRUNCATED == results[0].budget_flag
+    again = pipeline.run_texts([SLOW_NOTE], tasks, budget=BUDGET)
+    assert results[0].symptoms == again[0].symptoms
+    assert results[0].o2_summary.count == again[0].o2_summary.count
+
+    for budget in [BUDGET, text_budget.DEFAULT_BUDGET]:
+        for text in PATHOLOGICAL_NOTES:
+            start = time.perf_counter()
+            pipeline.run_texts([text], tasks, budget=budget)
+            assert time.perf_counter() - start < MAX_SECONDS
+
+    # the finders still see the words around the slashes
+    results = pipeline.run_texts(PATHOLOGICAL_NOTES[:1], tasks,
+                                 budget=text_budget.DEFAULT_BUDGET)
+    assert text_budget.FLAG_CAPPED == results[0].budget_flag
+    assert results[0].symptoms.has_fatigue